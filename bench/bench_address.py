@@ -0,0 +1,122 @@
+"""
+    Compare construction time and memory use of the openbsd.utils address
+    classes against the original string-backed implementation.
+"""
+import sys, os, time, random
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+from openbsd import utils
+import legacyutils
+
+N = 100000
+
+
+def timeit(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def footprint(obj):
+    """
+        Approximate the memory held by an address object: the object itself,
+        its instance dictionary (if any), and the values it references.
+    """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+        values = obj.__dict__.values()
+    else:
+        values = [getattr(obj, i, None) for i in ("_int", "_address", "prefix")]
+    for v in values:
+        if v is not None and not isinstance(v, bool):
+            size += sys.getsizeof(v)
+    return size
+
+
+def report(name, legacy, current):
+    print "%-32s %10.4f %10.4f %8.1fx"%(name, legacy, current, legacy/max(current, 1e-9))
+
+
+def main():
+    r = random.Random(0)
+    ip4bytes = ["".join([chr(r.randrange(256)) for j in range(4)]) for i in range(N)]
+    ip6bytes = ["".join([chr(r.randrange(256)) for j in range(16)]) for i in range(N)]
+    ip4text = [legacyutils.IPAddress.fromBytes(i).address for i in ip4bytes]
+    ip6text = [legacyutils.IP6Address.fromBytes(i).address for i in ip6bytes]
+
+    print "%d addresses per run"%N
+    print "%-32s %10s %10s %9s"%("", "legacy(s)", "current(s)", "speedup")
+    cases = [
+        ("IPAddress(text)", "IPAddress", None, ip4text),
+        ("IPAddress.fromBytes", "IPAddress", "fromBytes", ip4bytes),
+        ("IP6Address(text)", "IP6Address", None, ip6text),
+        ("IP6Address.fromBytes", "IP6Address", "fromBytes", ip6bytes),
+    ]
+    for name, cls, meth, data in cases:
+        times = []
+        for mod in (legacyutils, utils):
+            f = getattr(mod, cls)
+            if meth:
+                f = getattr(f, meth)
+            times.append(timeit(lambda: [f(i) for i in data]))
+        report(name, *times)
+    # Text rendering. The original classes render eagerly in fromBytes; the
+    # current ones render on first access to .address.
+    zeros = ["".join([r.choice(["\x00\x00", i[j:j+2]]) for j in range(0, 16, 2)]) for i in ip6bytes]
+    for name, data in [("IP6Address bytes->text", ip6bytes), ("IP6Address bytes->text, zeros", zeros)]:
+        times = [
+            timeit(lambda: [legacyutils.IP6Address.fromBytes(i).address for i in data]),
+            timeit(lambda: [utils.IP6Address.fromBytes(i).address for i in data])
+        ]
+        report(name, *times)
+    masktext = [legacyutils.IPMask(i%33).address for i in xrange(N)]
+    maskbytes = [legacyutils.IPMask(i%33).bytes for i in xrange(N)]
+    for name, meth, data in [
+                ("IPMask(prefix)", None, [i%33 for i in xrange(N)]),
+                ("IPMask(text)", None, masktext),
+                ("IPMask.fromBytes", "fromBytes", maskbytes),
+                ("IP6Mask(prefix)", None, [i%129 for i in xrange(N)])
+            ]:
+        times = []
+        for mod in (legacyutils, utils):
+            f = getattr(mod, name.split("(")[0].split(".")[0])
+            if meth:
+                f = getattr(f, meth)
+            times.append(timeit(lambda: [f(i) for i in data]))
+        report(name, *times)
+
+    # A state table: a few thousand hosts repeated across many states.
+    hosts = ip4bytes[:3000] + ip6bytes[:1000]
+    states = [r.choice(hosts) for i in xrange(N)]
+    texts = [utils.AddressFromBytes(i).address for i in states]
+    times = [timeit(lambda: [legacyutils.AddressFromBytes(i) for i in states])]
+    utils.setInternCacheSize(0)
+    times.append(timeit(lambda: [utils.AddressFromBytes(i) for i in states]))
+    utils.setInternCacheSize(utils.INTERN_CACHE_SIZE)
+    utils.clearInternCache()
+    times.append(timeit(lambda: [utils.AddressFromBytes(i) for i in states]))
+    report("AddressFromBytes, no interning", times[0], times[1])
+    report("AddressFromBytes, interned", times[0], times[2])
+    times = [timeit(lambda: [legacyutils.Address(i) for i in texts])]
+    utils.setInternCacheSize(0)
+    times.append(timeit(lambda: [utils.Address(i) for i in texts]))
+    utils.setInternCacheSize(utils.INTERN_CACHE_SIZE)
+    utils.clearInternCache()
+    times.append(timeit(lambda: [utils.Address(i) for i in texts]))
+    report("Address(text), no interning", times[0], times[1])
+    report("Address(text), interned", times[0], times[2])
+    print "intern cache:", utils.internCacheStats()
+
+    print
+    print "%-32s %10s %10s"%("bytes per object", "legacy", "current")
+    for name, cls, data in [("IPAddress", "IPAddress", ip4bytes), ("IP6Address", "IP6Address", ip6bytes)]:
+        sizes = []
+        for mod in (legacyutils, utils):
+            objs = [getattr(mod, cls).fromBytes(i) for i in data[:1000]]
+            sizes.append(sum([footprint(i) for i in objs])/len(objs))
+        print "%-32s %10d %10d"%(name, sizes[0], sizes[1])
+
+
+if __name__ == "__main__":
+    main()
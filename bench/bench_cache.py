@@ -0,0 +1,96 @@
+"""
+    Count the listing calls into _pf, and time, for code that walks the
+    tables and sub-anchors of an anchor through the container methods, with
+    and without the Tables and Anchor listing caches. The tables live in the
+    _pf stand-in in recordedpf.py, so times reflect the Python side only;
+    against a kernel, each avoided ioctl also saves a system call and a
+    copy of the whole listing.
+
+    Then compare collecting the tables of a tree of nested anchors by
+    recursing by hand against Anchor.depthFirst(tables=True).
+"""
+import sys, os, time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins, recordedpf
+from openbsd import pf
+
+TABLES = 500
+ANCHORS = 100
+
+
+def walk(anchor):
+    """
+        The usual pattern: list, test membership, then fetch each entry.
+    """
+    n = 0
+    for name in anchor.tables.keys():
+        if anchor.tables.has_key(name):
+            n += anchor.tables[name].flags >= 0
+    for name in anchor.keys():
+        if anchor.has_key(name):
+            n += len(anchor)
+    return n
+
+
+def listings():
+    return len([i for i in recordedpf.calls if i[0] in ("get_tables", "get_anchors")])
+
+
+def recurse(anchor, out):
+    """
+        Hand-rolled recursion over the tree, one table listing per anchor.
+    """
+    out[anchor.name] = anchor.tables.keys()
+    for name in anchor.keys():
+        recurse(anchor[name], out)
+    return out
+
+
+def batched(anchor):
+    out = {}
+    for a, tables in anchor.depthFirst(tables=True):
+        out[a.name] = tables.keys()
+    return out
+
+
+def main():
+    recordedpf.reset()
+    for i in range(TABLES):
+        recordedpf.add_table("t%d"%i, "bench", 0, 0)
+    for i in range(ANCHORS):
+        recordedpf.add_table("t", "bench/a%d"%i, 0, 0)
+    p = pf.PF()
+    print "%d tables and %d sub-anchors"%(TABLES, ANCHORS)
+    print "%-24s %10s %10s"%("", "_pf calls", "seconds")
+    for name, ttl in [("uncached", False), ("cached, no ttl", None), ("cached, 1s ttl", 1)]:
+        a = p["bench"]
+        if ttl is not False:
+            a.enableCache(ttl)
+            a.tables.enableCache(ttl)
+        del recordedpf.calls[:]
+        start = time.time()
+        walk(a)
+        print "%-24s %10d %10.3f"%(name, listings(), time.time() - start)
+    print "table cache:", a.tables.cacheStats()
+    print "anchor cache:", a.cacheStats()
+
+    recordedpf.reset()
+    # Three levels of ten anchors, each with a few tables.
+    for i in range(10):
+        for j in range(10):
+            for k in range(10):
+                for t in range(3):
+                    recordedpf.add_table("t%d"%t, "tree/a%d/b%d/c%d"%(i, j, k), 0, 0)
+    print
+    print "%-24s %10s %10s"%("anchor tree, 1111 anchors", "_pf calls", "seconds")
+    results = []
+    for name, func in [("recursion", lambda: recurse(p["tree"], {})), ("depthFirst", lambda: batched(p["tree"]))]:
+        del recordedpf.calls[:]
+        start = time.time()
+        results.append(func())
+        print "%-24s %10d %10.3f"%(name, len(recordedpf.calls), time.time() - start)
+    assert results[0] == results[1]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+    Time aggregation and set operations on large network lists, compare
+    radix tree lookups against a linear scan of a table's addresses, and
+    compare lazy host ranges against building and parsing address strings.
+"""
+import sys, os, time, random
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+from openbsd import utils, cidr
+
+
+def timeit(func, *args):
+    start = time.time()
+    ret = func(*args)
+    return time.time() - start, ret
+
+
+def randomNetworks(r, n):
+    nets = []
+    for i in xrange(n):
+        p = r.randrange(16, 33)
+        num = r.randrange(0, 1 << 32) & ~((1 << (32 - p)) - 1)
+        nets.append("%s/%s"%(utils.IPAddress.fromInt(num), p))
+    return nets
+
+
+def main():
+    r = random.Random(0)
+    print "%-40s %10s %10s"%("", "seconds", "output")
+    for n in (10000, 100000, 1000000):
+        a = randomNetworks(r, n)
+        b = randomNetworks(r, n)
+        t, out = timeit(lambda: list(cidr.aggregate(a)))
+        print "%-40s %10.3f %10d"%("aggregate, %d networks"%n, t, len(out))
+        if n > 100000:
+            continue
+        for name in ("union", "intersection", "difference"):
+            t, out = timeit(lambda: list(getattr(cidr, name)(a, b)))
+            print "%-40s %10.3f %10d"%("%s, 2 x %d networks"%(name, n), t, len(out))
+
+    print
+    table = [{"address": a, "mask": m} for a, m in cidr.aggregate(randomNetworks(r, 5000))]
+    queries = [utils.IPAddress.fromInt(r.randrange(0, 1 << 32)) for i in range(2000)]
+    def scan():
+        hits = 0
+        for q in queries:
+            for i in table:
+                if (q._int & i["mask"]._int) == i["address"]._int:
+                    hits += 1
+                    break
+        return hits
+    t, tree = timeit(cidr.RadixTree, table)
+    print "%-40s %10.3f"%("RadixTree build, %d networks"%len(table), t)
+    t1, h1 = timeit(scan)
+    t2, h2 = timeit(lambda: len([q for q in queries if q in tree]))
+    assert h1 == h2
+    print "%-40s %10.3f"%("linear scan, %d lookups"%len(queries), t1)
+    print "%-40s %10.3f"%("RadixTree, %d lookups"%len(queries), t2)
+
+    print
+    n = 1 << 20
+    def strings():
+        base = utils.IPAddress("10.0.0.0")._int
+        texts = [str(utils.IPAddress.fromInt(base + i)) for i in xrange(1, n + 1)]
+        return len([utils.IPAddress(i) for i in texts])
+    t1, c1 = timeit(strings)
+    t2, c2 = timeit(lambda: len([i for i in cidr.hosts("10.0.0.0/8")[:n]]))
+    assert c1 == c2
+    print "%-40s %10.3f"%("string list, %d hosts"%n, t1)
+    print "%-40s %10.3f"%("hosts() range, %d hosts"%n, t2)
+    h = cidr.hosts("2001:db8::/64")
+    t, x = timeit(lambda: [h[r.randrange(h.size)] for i in xrange(100000)])
+    print "%-40s %10.3f"%("hosts() /64, 100000 random indexes", t)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+    Compare the Internet checksum routines in openbsd.utils against the
+    original character-at-a-time cksum16.
+"""
+import sys, os, time, random
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+from openbsd import utils
+import legacyutils
+
+
+def timeit(n, func, *args):
+    start = time.time()
+    for i in xrange(n):
+        func(*args)
+    return (time.time() - start)/n
+
+
+def main():
+    r = random.Random(0)
+    print "%-28s %12s %12s %9s"%("", "legacy(us)", "current(us)", "speedup")
+    for size in (20, 64, 576, 1500, 9000, 65535):
+        data = "".join([chr(r.randrange(256)) for i in range(size)])
+        assert legacyutils.cksum16(data) == utils.cksum16(data)
+        n = max(10, 2000000/size)
+        legacy = timeit(n, legacyutils.cksum16, data) * 1e6
+        current = timeit(n, utils.cksum16, data) * 1e6
+        print "%-28s %12.2f %12.2f %8.1fx"%("cksum16, %d bytes"%size, legacy, current, legacy/current)
+
+    packet = "".join([chr(r.randrange(256)) for i in range(1500)])
+    full = timeit(10000, utils.cksum16, packet) * 1e6
+    c = utils.cksum16(packet)
+    incr = timeit(10000, utils.cksumUpdate, c, packet[12:16], "\xc0\xa8\x00\x01") * 1e6
+    print
+    print "Rewriting one address in a 1500 byte packet:"
+    print "    full re-sum:          %8.2f us"%full
+    print "    cksumUpdate:          %8.2f us"%incr
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+    Time an OpenMetrics scrape of Netstat, PF and CPU counters for 8, 100
+    and 500 interfaces: collection alone, Exporter.render, and a naive
+    renderer that formats every line from scratch on each scrape, as glue
+    code typically does. The counters come from the stand-ins installed by
+    standins.py, so times reflect the Python side only.
+"""
+import sys, os, time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins, recordednetstat, recordedpf
+from openbsd import netstat, pf, system, exporter
+
+ROUNDS = 50
+
+
+def naive(n, p, s):
+    """
+        Walk the counters and format each line, with its labels, every time.
+    """
+    lines = []
+    def emit(name, labels, value):
+        if labels:
+            text = ",".join(["%s=\"%s\""%(k, v) for k, v in labels])
+            lines.append("%s{%s} %d\n"%(name, text, value))
+        else:
+            lines.append("%s %d\n"%(name, value))
+    def walk(name, labels, d):
+        for k in sorted(d):
+            v = d[k]
+            if isinstance(v, dict):
+                walk(name, labels + [("key", k)], v)
+            elif isinstance(v, (int, long)):
+                emit("openbsd_%s_%s_total"%(name, k), labels, v)
+    snapshot = n.snapshot()
+    for block in snapshot._fields[1:]:
+        values = getattr(snapshot, block)
+        if block == "interfaces":
+            for i in sorted(values):
+                walk("netstat_interface", [("interface", i)], values[i])
+        else:
+            walk("netstat_" + block, [], values)
+    walk("pf", [], p.getStatistics())
+    ifaces = p.getInterfaces()
+    for i in sorted(ifaces):
+        walk("pf_interface", [("interface", i)], ifaces[i])
+    walk("cpu", [], s.cpustats)
+    lines.append("# EOF\n")
+    return "".join(lines)
+
+
+def collect(n, p, s):
+    return n.snapshot(), p.getStatistics(), p.getInterfaces(), s.cpustats
+
+
+def main():
+    n, p, s = netstat.Netstat(), pf.PF(), system.System()
+    print "%-16s %12s %12s %12s %10s"%("", "collect(ms)", "naive(ms)", "render(ms)", "bytes")
+    for count in (8, 100, 500):
+        recordednetstat.IFACES = recordedpf.IFACES = count
+        e = exporter.Exporter(n, p, s)
+        e.render()
+        times = []
+        for func in (collect, naive, lambda *args: e.render()):
+            start = time.time()
+            for i in range(ROUNDS):
+                func(n, p, s)
+            times.append((time.time() - start)*1000/ROUNDS)
+        print "%-16s %12.3f %12.3f %12.3f %10d"%(
+            "%d interfaces"%count, times[0], times[1], times[2], len(e.render())
+        )
+
+
+if __name__ == "__main__":
+    main()
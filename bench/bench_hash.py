@@ -0,0 +1,67 @@
+"""
+    Time set- and dict-heavy workloads over address objects: deduplicating,
+    grouping and sorting a million addresses drawn from a smaller set of
+    hosts. The original classes could not be hashed, so the reference runs
+    key them on their byte strings instead. The current objects come from
+    AddressFromBytes with an intern cache large enough for every host, as
+    they would when decoding a state table.
+"""
+import sys, os, time, random
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+from openbsd import utils
+import legacyutils
+
+N = 1000000
+HOSTS = 50000
+
+
+def timeit(func, *args):
+    start = time.time()
+    ret = func(*args)
+    return time.time() - start, ret
+
+
+def main():
+    r = random.Random(0)
+    hosts = ["".join([chr(r.randrange(256)) for j in range(r.choice([4, 16]))]) for i in range(HOSTS)]
+    raw = [r.choice(hosts) for i in xrange(N)]
+    legacy = [legacyutils.AddressFromBytes(i) for i in raw]
+    utils.setInternCacheSize(HOSTS)
+    current = [utils.AddressFromBytes(i) for i in raw]
+
+    print "%d addresses, %d distinct"%(N, HOSTS)
+    print "%-32s %10s %10s"%("", "legacy(s)", "current(s)")
+
+    def legacyDedup():
+        d = {}
+        for a in legacy:
+            d[a.bytes] = a
+        return d.values()
+    t1, x1 = timeit(legacyDedup)
+    t2, x2 = timeit(lambda: set(current))
+    assert len(x1) == len(x2)
+    print "%-32s %10.3f %10.3f"%("dedup", t1, t2)
+
+    def legacyGroup():
+        d = {}
+        for a in legacy:
+            d.setdefault(a.bytes, []).append(a)
+        return d
+    def currentGroup():
+        d = {}
+        for a in current:
+            d.setdefault(a, []).append(a)
+        return d
+    t1, x1 = timeit(legacyGroup)
+    t2, x2 = timeit(currentGroup)
+    print "%-32s %10.3f %10.3f"%("group", t1, t2)
+
+    lsample, csample = legacy[:100000], current[:100000]
+    t1, x1 = timeit(lambda: sorted(lsample, key=lambda a: (len(a.bytes), a.bytes)))
+    t2, x2 = timeit(lambda: sorted(csample))
+    print "%-32s %10.3f %10.3f"%("sort 100000", t1, t2)
+
+
+if __name__ == "__main__":
+    main()
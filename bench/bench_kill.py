@@ -0,0 +1,77 @@
+"""
+    Kill the states of 10000 hosts, some listed twice, plus a /16, with one
+    killStates call per filter against a single killStatesBatch call. The
+    state table lives in the _pf stand-in in recordedpf.py, which matches
+    states in Python; its time is reported separately from the time spent
+    in openbsd.pf. Each filter the stand-in is given is an ioctl against a
+    kernel, and a walk of the whole state table. The batch spends more time
+    in openbsd.pf per filter, encoding and coalescing them, and makes that
+    back on the filters it drops as redundant. It also issues its ioctls
+    without holding the interpreter lock.
+"""
+import sys, os, time, random
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins, recordedpf
+from openbsd import pf
+
+STATES = 50000
+HOSTS = 10000
+_spent = [0]
+
+def timed(func):
+    def wrapper(*args):
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            _spent[0] += time.time() - start
+    return wrapper
+recordedpf.kill_states = timed(recordedpf.kill_states)
+recordedpf.kill_states_batch = timed(recordedpf.kill_states_batch)
+
+
+def report(name, killed, start):
+    total = time.time() - start
+    filters = sum([i[1] for i in recordedpf.calls if i[0].startswith("kill_states")])
+    print "%-20s %8d %8d %8d %10.3f %10.3f"%(
+            name, len(recordedpf.calls), filters, killed, total - _spent[0], _spent[0]
+        )
+
+
+def reset():
+    recordedpf.makeStates(STATES)
+    recordedpf._killIndex()
+    del recordedpf.calls[:]
+    _spent[0] = 0
+
+
+def main():
+    p = pf.PF()
+    recordedpf.makeStates(STATES)
+    r = random.Random(0)
+    recs = list(p.getStatesRaw())
+    v4 = [i for i in recs if i.af == 2]
+    hosts = [i.ext.address for i in r.sample(recs, HOSTS)]
+    net = v4[0].lan.address
+    # Detectors repeat themselves: a fifth of the hosts are listed twice.
+    hosts += hosts[:HOSTS/5]
+    print "%d states, %d host filters and a /16"%(STATES, len(hosts))
+    print "%-20s %8s %8s %8s %10s %10s"%("", "calls", "filters", "killed", "pf(s)", "stand-in(s)")
+
+    reset()
+    start = time.time()
+    killed = p.killStates(src=net, srcmask="255.255.0.0")
+    for i in hosts:
+        killed += p.killStates(src=i)
+    report("killStates", killed, start)
+
+    reset()
+    start = time.time()
+    filters = [("%s/16"%net, None, None, None, None, None)] + [{"src": i} for i in hosts]
+    total, counts = p.killStatesBatch(filters)
+    report("killStatesBatch", total, start)
+    assert total == killed
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+    Compare answering "is there a state for this connection, and what are
+    its counters?" by dumping and decoding the whole state table, against
+    PF.findStates and PF.lookupState. The state tables are synthetic ones
+    from the _pf stand-in in recordedpf.py, which answers single-state
+    queries from an index, as the kernel does.
+"""
+import sys, os, time, gc, random
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins, recordedpf
+from openbsd import pf, utils
+
+SIZES = [10000, 100000, 500000]
+LOOKUPS = 20
+
+
+def timeit(func, *args):
+    gc.collect()
+    start = time.time()
+    ret = func(*args)
+    return time.time() - start, ret
+
+
+def fullDump(p, conn):
+    """
+        The approach lookupState replaces: decode every state, then search
+        the list.
+    """
+    proto, src, dst, srcport, dstport = conn
+    states = []
+    for s in p.getStatesRaw():
+        states.append({
+            "proto": s.proto, "direction": s.direction,
+            "lan": {"address": s.lan.address, "port": s.lan.port},
+            "ext": {"address": s.ext.address, "port": s.ext.port},
+            "packets": s.packets, "bytes": s.bytes,
+        })
+    for s in states:
+        if s["direction"] == pf.PFDIR_OUT:
+            a, b = s["lan"], s["ext"]
+        else:
+            a, b = s["ext"], s["lan"]
+        if s["proto"] == proto and a["address"] == src and b["address"] == dst \
+                and a["port"] == srcport and b["port"] == dstport:
+            return s
+
+
+def connections(n, seed=0):
+    """
+        Pick n connections from the installed table, as lookupState tuples.
+    """
+    r = random.Random(seed)
+    buf = pf.StateBuffer(recordedpf.states)
+    conns = []
+    for i in r.sample(xrange(len(buf)), n):
+        s = buf[i]
+        if s.direction == pf.PFDIR_OUT:
+            a, b = s.lan, s.ext
+        else:
+            a, b = s.ext, s.lan
+        conns.append((s.proto, a.address, b.address, a.port, b.port))
+    return conns
+
+
+def main():
+    print "%-10s %12s %12s %12s %12s"%(
+        "states", "dump(s)", "find(s)", "lookup(s)", "cached(ms)"
+    )
+    for n in SIZES:
+        recordedpf.makeStates(n)
+        p = pf.PF()
+        conns = connections(LOOKUPS)
+        # Build the stand-in's index, as the kernel's is always there.
+        recordedpf.get_state(0, 0)
+        t_dump, s = timeit(fullDump, p, conns[0])
+        assert s is not None
+        t_find, found = timeit(lambda: p.findStates(*((None,) + conns[0])))
+        assert found
+        t_first, rec = timeit(lambda: [p.lookupState(*c) for c in conns])
+        assert None not in rec
+        t_again, rec = timeit(lambda: [p.lookupState(*c) for c in conns])
+        assert None not in rec
+        print "%-10d %12.3f %12.3f %12.3f %12.3f"%(
+            n, t_dump, t_find, t_first/LOOKUPS, t_again/LOOKUPS*1000
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+    Compare collecting every counter block through the individual Netstat
+    methods against a single Netstat.snapshot call, reporting time per
+    collection, calls into _netstat, and the objects and bytes allocated for
+    the result. Then time RateTracker.update over interface and protocol
+    counters, and the decoding of a NET_RT_IFLIST buffer by parseIfList. The counters come from the _netstat stand-in in
+    recordednetstat.py, so times reflect the Python side only.
+"""
+import sys, os, time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins, recordednetstat
+from openbsd import netstat
+
+ROUNDS = 2000
+METHODS = [
+    "ifstats", "ipstats", "ip6stats", "tcpstats", "udpstats", "icmpstats",
+    "igmpstats", "ahstats", "espstats", "ipipstats", "ipcompstats"
+]
+
+
+def allocation(obj):
+    """
+        Count the objects making up a result, and the bytes they hold.
+    """
+    n, size = 1, sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        obj = obj.keys() + obj.values()
+    if isinstance(obj, (tuple, list)):
+        for i in obj:
+            a, b = allocation(i)
+            n, size = n + a, size + b
+    return n, size
+
+
+def methods(n):
+    return dict([(i, getattr(n, i)()) for i in METHODS])
+
+
+def main():
+    n = netstat.Netstat()
+    print "%-24s %10s %8s %8s %10s"%("", "ms/call", "calls", "objects", "bytes")
+    for ifaces in (4, 100):
+        recordednetstat.IFACES = ifaces
+        for name, func in [("methods", lambda: methods(n)), ("snapshot", n.snapshot)]:
+            del recordednetstat.calls[:]
+            start = time.time()
+            for i in range(ROUNDS):
+                result = func()
+            elapsed = (time.time() - start)*1000/ROUNDS
+            objects, size = allocation(result)
+            print "%-24s %10.3f %8d %8d %10d"%(
+                    "%s, %d interfaces"%(name, ifaces), elapsed,
+                    len(recordednetstat.calls)/ROUNDS, objects, size
+                )
+
+    print
+    print "%-24s %10s"%("RateTracker.update", "ms/call")
+    for ifaces in (4, 100, 500):
+        recordednetstat.IFACES = ifaces
+        r = netstat.RateTracker(n, ["interfaces", "ip", "ip6", "tcp", "udp", "icmp"])
+        snapshots = [n.snapshot(r.blocks) for i in range(ROUNDS/10)]
+        start = time.time()
+        for i in snapshots:
+            r.update(i)
+        print "%-24s %10.3f"%("%d interfaces"%ifaces, (time.time() - start)*1000/len(snapshots))
+
+    print
+    print "%-24s %10s"%("parseIfList", "ms/call")
+    for ifaces in (4, 100, 500):
+        recordednetstat.IFACES = ifaces
+        data = recordednetstat.iflist()
+        start = time.time()
+        for i in range(ROUNDS/10):
+            x = netstat.parseIfList(data, recordednetstat.IFLIST_LAYOUT, "<")
+        assert sorted(x["em0"]) == sorted(methods(n)["ifstats"]["em0"])
+        print "%-24s %10.3f"%("%d interfaces"%ifaces, (time.time() - start)*1000/(ROUNDS/10))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+    Compare loading a blocklist with one address object per line against
+    parsing it straight into a packed pfr_addr buffer.
+"""
+import sys, os, time, random
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins
+from openbsd import utils
+
+N = 1000000
+
+
+def main():
+    r = random.Random(0)
+    lines = []
+    for i in xrange(N):
+        p = r.choice([32, 32, 32, 24, 16])
+        num = r.randrange(0, 1 << 32) & ~((1 << (32 - p)) - 1)
+        lines.append("%s/%s\n"%(utils.IPAddress.fromInt(num), p))
+
+    start = time.time()
+    objs = []
+    for i in lines:
+        a, m = i.strip().split("/")
+        a = utils.Address(a)
+        objs.append((a, a.mask(int(m))))
+    objtime = time.time() - start
+    del objs
+
+    start = time.time()
+    p = utils.parseAddresses(lines)
+    packtime = time.time() - start
+    assert len(p) == N
+
+    print "%d lines"%N
+    print "%-32s %8.3f s"%("Address objects", objtime)
+    print "%-32s %8.3f s  (%d bytes)"%("PackedAddresses", packtime, len(p.buffer))
+
+
+if __name__ == "__main__":
+    main()
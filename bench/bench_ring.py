@@ -0,0 +1,46 @@
+"""
+    Compare reading the latest counters from a ring file written by a
+    Collector against taking a Netstat snapshot directly, as a reader that
+    polls the kernel itself would. The counters come from the _netstat
+    stand-in in recordednetstat.py, so the snapshot time reflects the Python
+    side only.
+"""
+import sys, os, time, tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins, recordednetstat
+from openbsd import netstat, ring
+
+ROUNDS = 20000
+
+
+def timeit(func):
+    start = time.time()
+    for i in xrange(ROUNDS):
+        func()
+    return (time.time() - start)/ROUNDS
+
+
+def main():
+    path = tempfile.mktemp()
+    n = netstat.Netstat()
+    c = ring.Collector(path, {"netstat": lambda: n.snapshot()._asdict()}, interval=0)
+    try:
+        c.run(100)
+        r = ring.RingReader(path)
+        print "%d counters, %d slots of %d bytes"%(len(r.names), r.slots, r._slotSize)
+        print "%-28s %10s"%("", "usec/call")
+        for name, func in [
+                    ("Netstat.snapshot", n.snapshot),
+                    ("Collector.sample", c.sample),
+                    ("RingReader.latest", r.latest),
+                    ("RingReader.history(60)", lambda: r.history(60)),
+                ]:
+            print "%-28s %10.2f"%(name, timeit(func)*1e6)
+        r.close()
+    finally:
+        c.close()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
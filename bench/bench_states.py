@@ -0,0 +1,123 @@
+"""
+    Compare eagerly decoding a large state table into dictionaries, as
+    PF.getStates() does, against iterating lazily over the raw buffer and
+    reading only the fields a typical poll needs, and against building a
+    columnar StateSnapshot and aggregating over its columns. Finally, time
+    StateDiffer against a second poll with a little churn. The state table
+    is a synthetic one from the _pf stand-in in recordedpf.py.
+"""
+import sys, os, time, gc, random, struct
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins, recordedpf
+from openbsd import pf, utils
+
+N = 500000
+
+
+def timeit(func, *args):
+    gc.collect()
+    start = time.time()
+    ret = func(*args)
+    return time.time() - start, ret
+
+
+def eager(buf):
+    """
+        Materialize every field of every state, as get_states and the State
+        class do between them.
+    """
+    states = []
+    for s in buf:
+        states.append({
+            "id": s.id, "creatorid": s.creatorid, "ifname": s.ifname,
+            "proto": s.proto, "af": s.af, "direction": s.direction,
+            "log": s.log, "timeout": s.timeout, "sync_flags": s.sync_flags,
+            "creation": s.creation, "expire": s.expire, "updates": s.updates,
+            "packets": s.packets, "bytes": s.bytes, "src": s.src, "dst": s.dst,
+            "lan": {"address": s.lan.address, "port": s.lan.port},
+            "gwy": {"address": s.gwy.address, "port": s.gwy.port},
+            "ext": {"address": s.ext.address, "port": s.ext.port},
+        })
+    return len(states)
+
+
+def lazy(buf):
+    """
+        Count TCP states per external port, touching two fields per state.
+    """
+    counts = {}
+    for s in buf:
+        if s.proto == 6:
+            port = s.ext["port"]
+            counts[port] = counts.get(port, 0) + 1
+    return len(counts)
+
+
+def lazyBytes(buf):
+    return sum([s.bytes["in"] for s in buf])
+
+
+def snapshotQueries(snap):
+    snap.groupBy("ifname", "bytes_in")
+    snap.groupBy(("proto", "direction"), "packets_out")
+    snap.groupBy("proto")
+    return snap.top(10, "bytes")
+
+
+def churn(data, fraction, seed=1):
+    """
+        Make the next poll of a raw state table: bump the counters of a
+        fraction of the states, and replace another fraction with new ones.
+    """
+    r = random.Random(seed)
+    L = recordedpf.STATE_LAYOUT
+    size = L["size"]
+    n = len(data)/size
+    out = bytearray(data)
+    for i in r.sample(xrange(n), int(n*fraction)):
+        off = i*size + L["bytes"] + 12
+        lo = struct.unpack_from("!I", out, off)[0]
+        struct.pack_into("!I", out, off, (lo + 1500) & 0xffffffff)
+    for i in r.sample(xrange(n), int(n*fraction)):
+        struct.pack_into("!Q", out, i*size + L["id"], n + i + 1)
+    return str(out)
+
+
+def main():
+    print "building %d synthetic states..."%N
+    recordedpf.makeStates(N)
+    p = pf.PF()
+    print "%-40s %10s"%("", "seconds")
+    t, buf = timeit(p.getStatesRaw)
+    print "%-40s %10.3f"%("getStatesRaw", t)
+    t, n = timeit(eager, buf)
+    print "%-40s %10.3f"%("eager decode of every field", t)
+    t, n = timeit(lazy, buf)
+    print "%-40s %10.3f"%("lazy: TCP states per port", t)
+    t, n = timeit(lazyBytes, buf)
+    print "%-40s %10.3f"%("lazy: total bytes in", t)
+    t, snap = timeit(pf.StateSnapshot, buf)
+    print "%-40s %10.3f"%("snapshot: build columns", t)
+    t, n = timeit(lambda: sum(snap.column("bytes_in")))
+    print "%-40s %10.3f"%("snapshot: total bytes in", t)
+    t, n = timeit(snap.groupBy, "ifname", "bytes_in")
+    print "%-40s %10.3f"%("snapshot: bytes in per interface", t)
+    t, n = timeit(snap.groupBy, ("ext_port",))
+    print "%-40s %10.3f"%("snapshot: states per port", t)
+    t, n = timeit(snap.top, 10, "bytes")
+    print "%-40s %10.3f"%("snapshot: top 10 states by bytes", t)
+    t, n = timeit(snap.top, 10, "bytes_in", "ext")
+    print "%-40s %10.3f"%("snapshot: top 10 external hosts", t)
+    t, n = timeit(snapshotQueries, snap)
+    print "%-40s %10.3f"%("snapshot: four summary queries", t)
+    d = pf.StateDiffer()
+    t, c = timeit(d.update, buf)
+    print "%-40s %10.3f  %r"%("differ: first poll", t, c)
+    t, c = timeit(d.update, buf)
+    print "%-40s %10.3f  %r"%("differ: unchanged poll", t, c)
+    t, c = timeit(d.update, churn(buf.data, 0.02))
+    print "%-40s %10.3f  %r"%("differ: poll with 2% churn", t, c)
+
+
+if __name__ == "__main__":
+    main()
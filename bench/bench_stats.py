@@ -0,0 +1,39 @@
+"""
+    Time a round of counter collection through PF.getStatistics and
+    PF.getInterfaces, which build nested dictionaries, against
+    StatsSampler.sample, which flattens the same counters into a list using
+    index maps worked out on the first sample. The counters come from the
+    _pf stand-in in recordedpf.py, so times reflect the Python side only.
+"""
+import sys, os, time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins, recordedpf
+from openbsd import pf
+
+ROUNDS = 200
+
+
+def dicts(p):
+    return p.getStatistics(), p.getInterfaces()
+
+
+def main():
+    p = pf.PF()
+    print "%-24s %12s %12s"%("", "dicts(ms)", "sampler(ms)")
+    for n in (8, 100, 500):
+        recordedpf.IFACES = n
+        s = pf.StatsSampler(size=ROUNDS)
+        times = []
+        for func in (lambda: dicts(p), s.sample):
+            start = time.time()
+            for i in range(ROUNDS):
+                func()
+            times.append((time.time() - start)*1000/ROUNDS)
+        print "%-24s %12.3f %12.3f"%("%d interfaces"%n, times[0], times[1])
+        start = time.time()
+        s.average()
+        print "%-24s %12s %12.3f"%("  average over %d"%ROUNDS, "", (time.time() - start)*1000)
+
+
+if __name__ == "__main__":
+    main()
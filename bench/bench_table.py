@@ -0,0 +1,97 @@
+"""
+    Compare loading and unloading a large blocklist into a PF table one
+    address at a time against the bulk Table methods, and refreshing it by
+    clearing and re-adding against Table.replace(). The _pf extension is
+    replaced by the in-memory stand-in in recordedpf.py, so this measures
+    the userland cost and counts the ioctls that would be issued.
+"""
+import sys, os, time, random
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standins, recordedpf
+from openbsd import pf
+
+N = 500000
+
+
+def timeit(func, *args):
+    start = time.time()
+    ret = func(*args)
+    return time.time() - start, ret
+
+
+def blocklist(r, n):
+    lines = []
+    for i in xrange(n):
+        if r.random() < 0.9:
+            lines.append("%d.%d.%d.%d"%tuple([r.randrange(256) for j in range(4)]))
+        else:
+            lines.append("2001:db8:%x::/%d"%(r.randrange(65536), 48 + r.randrange(17)))
+    return lines
+
+
+def run(name, func):
+    del recordedpf.calls[:]
+    t, ret = timeit(func)
+    print "%-40s %10.3f %10d"%(name, t, len(recordedpf.calls))
+    return ret
+
+
+def main():
+    r = random.Random(0)
+    lines = blocklist(r, N)
+    table = pf.Table("", "blocklist", 0)
+    print "%d entries"%N
+    print "%-40s %10s %10s"%("", "seconds", "ioctls")
+
+    def single(func):
+        for i in lines:
+            a, m = (i.split("/") + [None])[:2]
+            if m:
+                m = int(m)
+            try:
+                func(a, m)
+            except pf.OException:
+                pass
+    contents = recordedpf._table("", "blocklist")
+    run("addAddress, one at a time", lambda: single(table.addAddress))
+    n = len(contents)
+    run("deleteAddress, one at a time", lambda: single(table.deleteAddress))
+    assert not contents
+
+    fb = run("addAddresses", lambda: table.addAddresses(lines))
+    assert len(contents) == n
+    print "    ", fb
+    fb = run("deleteAddresses", lambda: table.deleteAddresses(lines))
+    assert not contents
+    packed = pf.utils.parseAddresses(lines)
+    run("addAddresses, pre-packed", lambda: table.addAddresses(packed))
+    fb = run("deleteAddresses, pre-packed", lambda: table.deleteAddresses(packed))
+    print "    ", fb
+    t, ret = timeit(lambda: len(list(fb)))
+    print "%-40s %10.3f"%("decode per-entry feedback", t)
+
+    # A feed refresh: 1% of the entries change.
+    print
+    table.addAddresses(packed)
+    fresh = lines[:]
+    for i in xrange(len(fresh)/100):
+        fresh[r.randrange(len(fresh))] = "%d.%d.%d.%d"%tuple([r.randrange(256) for j in range(4)])
+    def reload():
+        table.deleteAddresses(table.getAddressesPacked())
+        return table.addAddresses(fresh)
+    run("refresh, clear and re-add", reload)
+    expected = dict(contents)
+    table.addAddresses(lines)
+    table.deleteAddresses(table.getAddressesPacked())
+    table.addAddresses(lines)
+    ret = run("refresh, replace()", lambda: table.replace(fresh))
+    assert contents == expected
+    print "    ", ret
+    table.replace(lines)
+    ret = run("refresh, replace(atomic=1)", lambda: table.replace(fresh, atomic=1))
+    assert contents == expected
+    print "    ", ret
+
+
+if __name__ == "__main__":
+    main()
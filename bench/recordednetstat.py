@@ -0,0 +1,158 @@
+"""
+    A stand-in for the openbsd._netstat extension, returning counters
+    recorded from a running system, so that counter collection can be
+    benchmarked without kernel memory access. It is installed, with
+    stand-ins for the other extensions, by standins.py.
+
+    Every call builds fresh dictionaries, as the extension does, and is
+    recorded in the "calls" list as a (name, blocks) tuple.
+"""
+calls = []
+IFACES = 4
+
+def _counters(names, base):
+    return dict([(n, long(base*(i + 1))) for i, n in enumerate(names.split())])
+
+_BLOCKS = {
+    "ipstats": _counters(
+        "total badsum tooshort toosmall badhlen badlen fragments fragdropped "
+        "fragtimeout forward cantforward redirectsent noproto delivered "
+        "localout odropped reassembled fragmented ofragments cantfrag "
+        "badoptions noroute badvers rawout badfrags rcvmemdrop toolong nogif "
+        "badaddr inhwcsum outhwcsum", 87352),
+    "ip6stats": _counters(
+        "total tooshort toosmall fragments fragdropped fragtimeout "
+        "fragoverflow forward cantforward redirectsent delivered localout "
+        "odropped reassembled fragmented ofragments cantfrag badoptions "
+        "noroute badvers rawout badscope notmember m1 mext1 mext2m "
+        "exthdrtoolong nogif toomanyhdr", 1203),
+    "tcpstats": _counters(
+        "connattempt accepts connects drops conndrops closed segstimed "
+        "rttupdated delack timeoutdrop rexmttimeo persisttimeo persistdrop "
+        "keeptimeo keepprobe keepdrops sndtotal sndpack sndbyte sndrexmitpack "
+        "sndrexmitbyte sndrexmitfast sndacks sndprobe sndurg sndwinup sndctrl "
+        "rcvtotal rcvpack rcvbyte rcvbadsum rcvbadoff rcvmemdrop rcvnosec "
+        "rcvshort rcvduppack rcvdupbyte rcvpartduppack rcvpartdupbyte "
+        "rcvoopack rcvoobyte rcvpackafterwin rcvbyteafterwin rcvafterclose "
+        "rcvwinprobe rcvdupack rcvacktoomuch rcvackpack rcvackbyte rcvwinupd "
+        "pawsdrop predack preddat pcbhashmiss noport badsyn rcvbadsig "
+        "rcvgoodsig inhwcsum outhwcsum ecn_accepts ecn_rcvece ecn_rcvcwr "
+        "ecn_rcvce ecn_sndect ecn_sndece ecn_sndcwr cwr_ecn cwr_frecovery "
+        "cwr_timeout", 33012),
+    "udpstats": _counters(
+        "ipackets hdrops badsum nosum badlen noport noportbcast nosec "
+        "fullsock pcbhashmiss inhwcsum opackets outhwcsum", 8811),
+    "icmpstats": _counters(
+        "error oldshort oldicmp badcode tooshort checksum badlen reflect "
+        "bmcastecho", 312),
+    "igmpstats": _counters(
+        "rcv_total rcv_tooshort rcv_badsum rcv_queries rcv_badqueries "
+        "rcv_reports rcv_badreports rcv_ourreports snd_reports", 12),
+    "ahstats": _counters(
+        "hdrops nopf notdb badkcr badauth noxform qfull wrap replay badauthl "
+        "input output invalid ibytes obytes toobig pdrops crypto", 0),
+    "espstats": _counters(
+        "hdrops nopf notdb badkcr qfull noxform badilen wrap badenc badauth "
+        "replay input output invalid ibytes obytes toobig pdrops crypto", 4411),
+    "ipipstats": _counters(
+        "ipackets opackets hdrops qfull ibytes obytes pdrops spoof family "
+        "unspec", 0),
+    "ipcompstats": _counters(
+        "hdrops nopf notdb badkcr qfull noxform wrap input output invalid "
+        "ibytes obytes toobig pdrops crypto minlen", 0),
+}
+_BLOCKS["icmpstats"]["outhist"] = {"echoreply": 44L, "unreachable": 312L}
+_BLOCKS["icmpstats"]["inhist"] = {"echo": 44L}
+_IFACE = _counters(
+    "mtu metric baudrate ipackets ierrors opackets oerrors collisions ibytes "
+    "obytes imcasts omcasts iqdrops noproto", 1500)
+
+
+def _copy(d):
+    return dict([(k, isinstance(v, dict) and _copy(v) or v) for k, v in d.iteritems()])
+
+
+def _read(name):
+    if name == "ifstats":
+        d = {}
+        for i in range(IFACES):
+            d["em%d"%i] = _copy(_IFACE)
+            d["em%d"%i]["link_state"] = "FULL DUPLEX"
+        return d
+    return _copy(_BLOCKS[name])
+
+
+# NET_RT_IFLIST layout for a little-endian 64-bit system.
+IFLIST_LAYOUT = {
+    "size": 168, "msglen": 0, "version": 2, "type": 3, "addrs": 4,
+    "index": 12, "data": 24, "RTM_VERSION": 4, "RTM_IFINFO": 14,
+    "RTA_IFP": 16, "align": 8, "sdl_nlen": 5, "sdl_data": 8,
+    "fields": {
+        "link_state": (3, 1), "mtu": (4, 4), "metric": (8, 4),
+        "baudrate": (16, 8), "ipackets": (24, 8), "ierrors": (32, 8),
+        "opackets": (40, 8), "oerrors": (48, 8), "collisions": (56, 8),
+        "ibytes": (64, 8), "obytes": (72, 8), "imcasts": (80, 8),
+        "omcasts": (88, 8), "iqdrops": (96, 8), "noproto": (104, 8),
+    },
+    "link_states": {0: "UNKNOWN", 2: "DOWN", 4: "UP", 5: "HALF DUPLEX", 6: "FULL DUPLEX"},
+}
+
+def ifMessage(name, index, counters = None, link_state = 6, dst = False):
+    """
+        Build an RTM_IFINFO message in the layout above, with the recorded
+        interface counters by default. With dst, an RTA_DST sockaddr
+        precedes the interface's sockaddr_dl.
+    """
+    import struct
+    L = IFLIST_LAYOUT
+    if counters is None:
+        counters = _IFACE
+    msg = bytearray(L["size"])
+    for k, (offset, size) in L["fields"].items():
+        v = counters.get(k, 0)
+        if k == "link_state":
+            v = link_state
+        struct.pack_into("<" + {1: "B", 4: "I", 8: "Q"}[size], msg, L["data"] + offset, v)
+    addrs = L["RTA_IFP"]
+    sa = ""
+    if dst:
+        addrs |= 1
+        sa = "\x10\x02" + "\x00"*14
+    sdl = bytearray(8 + len(name) + 6)
+    sdl[0], sdl[1], sdl[L["sdl_nlen"]] = len(sdl), 18, len(name)
+    sdl[L["sdl_data"]:L["sdl_data"] + len(name)] = name
+    sdl += "\x00"*(-len(sdl)%8)
+    msg += sa + sdl
+    struct.pack_into("<HBB", msg, 0, len(msg), L["RTM_VERSION"], L["RTM_IFINFO"])
+    struct.pack_into("<i", msg, L["addrs"], addrs)
+    struct.pack_into("<H", msg, L["index"], index)
+    return str(msg)
+
+
+def iflist():
+    calls.append(("iflist", 1))
+    return "".join([ifMessage("em%d"%i, i + 1) for i in range(IFACES)])
+
+
+def initialise():
+    calls.append(("initialise", 0))
+
+
+def finalise():
+    calls.append(("finalise", 0))
+
+
+def snapshot(names):
+    import time
+    calls.append(("snapshot", len(names)))
+    return time.time(), dict([(i, _read(i)) for i in names])
+
+
+def _method(name):
+    def f():
+        calls.append((name, 1))
+        return _read(name)
+    return f
+
+for _name in ["ifstats"] + _BLOCKS.keys():
+    globals()[_name] = _method(_name)
@@ -0,0 +1,441 @@
+"""
+    A stand-in for the openbsd._pf extension, so that table updates can be
+    benchmarked on systems without PF. It is installed, with stand-ins for
+    the other extensions, by standins.py.
+
+    Tables are kept in memory, with the kernel's semantics for adds,
+    deletes and feedback codes. Every call that would be an ioctl is
+    recorded in the "calls" list as a (name, entries) tuple.
+"""
+PFR_ADDR_SIZE = 20
+_codes = [chr(i) for i in range(256)]
+# Feedback codes, as in net/pfvar.h.
+_NONE, _ADDED, _DELETED, _DUPLICATE, _CONFLICT = 0, 2, 3, 6, 8
+
+calls = []
+tables = {}
+_tflags = {}
+
+def reset():
+    del calls[:]
+    tables.clear()
+    _tflags.clear()
+
+
+def _init():
+    calls.append(("_init", 0))
+
+
+def _table(anchor, name):
+    return tables.setdefault((anchor, name), {})
+
+
+def add_table(name, anchor, tflags, iflags):
+    calls.append(("add_table", 1))
+    if (anchor, name) in tables:
+        return 0
+    _table(anchor, name)
+    _tflags[(anchor, name)] = tflags
+    return 1
+
+
+def delete_table(name, anchor, tflags, iflags):
+    calls.append(("delete_table", 1))
+    if (anchor, name) not in tables:
+        return 0
+    del tables[(anchor, name)]
+    _tflags.pop((anchor, name), None)
+    return 1
+
+
+def clear_tables(anchor, iflags):
+    calls.append(("clear_tables", 0))
+    names = [i for i in tables if i[0] == anchor]
+    for i in names:
+        del tables[i]
+    return len(names)
+
+
+def get_tables(anchor):
+    calls.append(("get_tables", 0))
+    t = {}
+    for a, name in tables:
+        if a == anchor:
+            t[name] = _tflags.get((a, name), 0)
+    return t
+
+
+def get_all_tables():
+    calls.append(("get_all_tables", 0))
+    return [(a, name, _tflags.get((a, name), 0)) for a, name in tables]
+
+
+def get_anchors(path):
+    calls.append(("get_anchors", 0))
+    children = set()
+    for a, name in tables:
+        if a and (not path or a.startswith(path + "/")):
+            children.add(a[len(path):].lstrip("/").split("/")[0])
+    return sorted(children)
+
+
+def _key(address, af, netmask):
+    return address + "\x00"*(16 - len(address)) + chr(af) + chr(netmask)
+
+
+def add_address(anchor, name, address, af, netmask, iflags):
+    calls.append(("add_address", 1))
+    t = _table(anchor, name)
+    key = _key(address, af, netmask)
+    if key in t:
+        return 0
+    if not iflags & 2:
+        t[key] = "\x00"
+    return 1
+
+
+def delete_address(anchor, name, address, af, netmask, iflags):
+    calls.append(("delete_address", 1))
+    t = _table(anchor, name)
+    key = _key(address, af, netmask)
+    if key not in t:
+        return 0
+    if not iflags & 2:
+        del t[key]
+    return 1
+
+
+def _bulk(name, anchor, table, data, iflags, add):
+    n = len(data)/PFR_ADDR_SIZE
+    calls.append((name, n))
+    t = _table(anchor, table)
+    seen = {}
+    out = []
+    count = 0
+    for i in xrange(0, len(data), PFR_ADDR_SIZE):
+        # Entries are keyed on address, family and prefix.
+        key, neg = data[i:i+18], data[i+18]
+        if key in seen:
+            fb = _DUPLICATE
+        elif add:
+            if key not in t:
+                fb = _ADDED
+                count += 1
+            elif t[key] != neg:
+                fb = _CONFLICT
+            else:
+                fb = _NONE
+        else:
+            if key not in t:
+                fb = _NONE
+            elif t[key] != neg:
+                fb = _CONFLICT
+            else:
+                fb = _DELETED
+                count += 1
+        seen[key] = neg
+        out.append(key + neg + _codes[fb])
+    if not iflags & 2:
+        for key, neg in seen.items():
+            if add and key not in t:
+                t[key] = neg
+            elif not add and t.get(key) == neg:
+                del t[key]
+    return count, "".join(out)
+
+
+def add_addresses(anchor, name, data, iflags):
+    return _bulk("add_addresses", anchor, name, data, iflags, True)
+
+
+def delete_addresses(anchor, name, data, iflags):
+    return _bulk("delete_addresses", anchor, name, data, iflags, False)
+
+
+def get_addresses(anchor, name):
+    calls.append(("get_addresses", len(_table(anchor, name))))
+    lst = []
+    for key in _table(anchor, name):
+        af, net = ord(key[16]), ord(key[17])
+        if af == 2:
+            raw = key[:4]
+        else:
+            raw = key[:16]
+        lst.append({"af": af, "mask": net, "address": raw})
+    return lst
+
+
+def get_addresses_raw(anchor, name):
+    t = _table(anchor, name)
+    calls.append(("get_addresses_raw", len(t)))
+    # The kernel walks the radix tree, so entries come back in order.
+    keys = t.keys()
+    keys.sort()
+    return "".join([key + t[key] + "\x00" for key in keys])
+
+
+def set_addresses(anchor, name, data, iflags):
+    n = len(data)/PFR_ADDR_SIZE
+    calls.append(("set_addresses", n))
+    t = _table(anchor, name)
+    new = {}
+    for i in xrange(0, len(data), PFR_ADDR_SIZE):
+        new[data[i:i+18]] = data[i+18]
+    added = len([k for k in new if k not in t])
+    deleted = len([k for k in t if k not in new])
+    changed = len([k for k in new if k in t and t[k] != new[k]])
+    if not iflags & 2:
+        t.clear()
+        t.update(new)
+    return added, deleted, changed
+
+
+
+# Offsets into struct pfsync_state, as exported by the real module. These
+# are for the OpenBSD 4.3/4.4 layout.
+STATE_LAYOUT = {
+    "size": 240, "id": 0, "ifname": 8, "lan": 24, "gwy": 48, "ext": 72,
+    "src": 96, "dst": 128, "rule": 176, "creation": 188, "expire": 192,
+    "packets": 196, "bytes": 212, "creatorid": 228, "af": 232, "proto": 233,
+    "direction": 234, "log": 235, "timeout": 237, "sync_flags": 238,
+    "updates": 239, "host_port": 16, "peer_state": 28, "peer_wscale": 29,
+}
+states = ""
+# (id, creatorid) -> offset into states, standing in for the kernel's tree
+# of states by id.
+_stateIndex = {}
+
+def makeStates(n, seed=0):
+    """
+        Build a plausible raw state table of n TCP and UDP states, mostly
+        IPv4, and install it as the table get_states_raw returns.
+    """
+    import random, struct
+    global states
+    r = random.Random(seed)
+    L = STATE_LAYOUT
+    host = struct.Struct("!16sH6x")
+    counters = struct.Struct("!IIII")
+    out = []
+    for i in xrange(n):
+        rec = bytearray(L["size"])
+        if r.random() < 0.8:
+            af, alen = 2, 4
+        else:
+            af, alen = 24, 16
+        struct.pack_into("!Q", rec, L["id"], i + 1)
+        struct.pack_into("16s", rec, L["ifname"], r.choice(["em0", "em1", "vlan10", "pppoe0"]))
+        lan = "".join([chr(r.randrange(256)) for j in range(alen)])
+        ext = "".join([chr(r.randrange(256)) for j in range(alen)])
+        lport, eport = r.randrange(1024, 65536), r.choice([22, 25, 53, 80, 443])
+        host.pack_into(rec, L["lan"], lan, lport)
+        host.pack_into(rec, L["gwy"], lan, lport)
+        host.pack_into(rec, L["ext"], ext, eport)
+        rec[L["src"] + L["peer_state"]] = r.randrange(11)
+        rec[L["dst"] + L["peer_state"]] = r.randrange(11)
+        struct.pack_into("!III", rec, L["rule"], r.randrange(50), 0, 0)
+        struct.pack_into("!II", rec, L["creation"], r.randrange(86400), r.randrange(86400))
+        counters.pack_into(rec, L["packets"], 0, r.randrange(1 << 20), 0, r.randrange(1 << 20))
+        counters.pack_into(rec, L["bytes"], 0, r.randrange(1 << 30), r.randrange(4), r.randrange(1 << 32))
+        struct.pack_into("!I", rec, L["creatorid"], 0x1234abcd)
+        rec[L["af"]] = af
+        rec[L["proto"]] = r.choice([6, 6, 6, 17])
+        rec[L["direction"]] = r.choice([1, 2])
+        out.append(str(rec))
+    states = "".join(out)
+    _stateIndex.clear()
+    _hosts.clear()
+    _killed.clear()
+
+
+# How much the table grows between one DIOCGETSTATES and the next, as a
+# fraction of its size. When it is set, get_states_raw sizes and retries its
+# buffer as the real module does, and fails with EAGAIN if the table keeps
+# outgrowing it.
+growth = 0
+STATES_RETRIES = 8
+
+def _grow(n):
+    import struct
+    global states
+    size = STATE_LAYOUT["size"]
+    first = len(states)/size + 1
+    new = []
+    for i in xrange(first, first + n):
+        rec = bytearray(size)
+        struct.pack_into("!Q", rec, STATE_LAYOUT["id"], i)
+        new.append(str(rec))
+    states += "".join(new)
+    _stateIndex.clear()
+    _hosts.clear()
+
+
+def get_states_raw():
+    calls.append(("get_states_raw", len(states)/STATE_LAYOUT["size"]))
+    size = STATE_LAYOUT["size"]
+    if growth:
+        # Count the states as the table grows, and only build them once a
+        # fetch fits.
+        live = len(states)/size - len(_killed)
+        n = live + int(live*growth) + 1
+        length = (n + n/8 + 16)*size
+        for tries in xrange(STATES_RETRIES + 1):
+            n += int(n*growth) + 1
+            if (n + 1)*size <= length:
+                break
+            if tries == STATES_RETRIES:
+                import errno, os
+                from openbsd._global import OException
+                raise OException(errno.EAGAIN, os.strerror(errno.EAGAIN))
+            length *= 2
+        _grow(n - live)
+    if _killed:
+        return "".join([states[i:i + size] for i in xrange(0, len(states), size) if not i in _killed])
+    return states
+
+
+# Killed states, by offset, and an index of offsets by (af, address), for
+# both the source and the destination as DIOCKILLSTATES sees them.
+_killed = set()
+_hosts = {}
+KILL_RECORD_SIZE = 85
+
+def _killIndex():
+    if _hosts or not states:
+        return _hosts
+    L = STATE_LAYOUT
+    for off in xrange(0, len(states), L["size"]):
+        af = ord(states[off + L["af"]])
+        alen = 4 if af == 2 else 16
+        lan = states[off + L["lan"]:off + L["lan"] + alen]
+        ext = states[off + L["ext"]:off + L["ext"] + alen]
+        _hosts.setdefault((af, lan), []).append(off)
+        _hosts.setdefault((af, ext), []).append(off)
+    return _hosts
+
+
+def _masked(address, mask):
+    if not mask.strip("\xff"):
+        return address
+    return "".join([chr(ord(a) & ord(m)) for a, m in zip(address, mask)])
+
+
+def _kill(af, name, src, srcmask, dst, dstmask, srcport, dstport):
+    import struct
+    L = STATE_LAYOUT
+    hosts = _killIndex()
+    candidates = None
+    for address, mask in ((src, srcmask), (dst, dstmask)):
+        if address and mask == "\xff"*len(address):
+            candidates = hosts.get((af, address), [])
+            break
+    if candidates is None:
+        candidates = xrange(0, len(states), L["size"])
+    n = 0
+    for off in candidates:
+        if off in _killed:
+            continue
+        if af and ord(states[off + L["af"]]) != af:
+            continue
+        if name and states[off + L["ifname"]:off + L["ifname"] + 16].rstrip("\x00") != name:
+            continue
+        alen = 4 if ord(states[off + L["af"]]) == 2 else 16
+        ends = [states[off + L[i]:off + L[i] + 18] for i in ("lan", "ext")]
+        if ord(states[off + L["direction"]]) != 2:
+            ends.reverse()
+        match = True
+        for end, address, mask, port in zip(ends, (src, dst), (srcmask, dstmask), (srcport, dstport)):
+            if address and mask.strip("\x00") and _masked(end[:alen], mask) != _masked(address, mask):
+                match = False
+            if port and struct.unpack("!H", end[16:18])[0] != port:
+                match = False
+        if match:
+            _killed.add(off)
+            n += 1
+    return n
+
+
+def kill_states(af, name, src, srcmask, dst, dstmask, srcport, dstport):
+    calls.append(("kill_states", 1))
+    return _kill(af, name, src, srcmask, dst, dstmask, srcport, dstport)
+
+
+def kill_states_batch(data):
+    import struct
+    calls.append(("kill_states_batch", len(data)/KILL_RECORD_SIZE))
+    killed = []
+    for off in xrange(0, len(data), KILL_RECORD_SIZE):
+        f = list(struct.unpack_from("!B16s16s16s16s16sHH", data, off))
+        alen = 4 if f[0] == 2 else 16
+        f[1] = f[1].rstrip("\x00")
+        for i in range(2, 6):
+            f[i] = f[i][:alen]
+            if not f[0]:
+                f[i] = None
+        killed.append(_kill(*f))
+    return killed
+
+
+def get_state(id, creatorid):
+    import struct
+    calls.append(("get_state", 1))
+    L = STATE_LAYOUT
+    if not _stateIndex:
+        for off in xrange(0, len(states), L["size"]):
+            key = (
+                struct.unpack_from("!Q", states, off + L["id"])[0],
+                struct.unpack_from("!I", states, off + L["creatorid"])[0]
+            )
+            _stateIndex[key] = off
+    off = _stateIndex.get((id, creatorid))
+    if off is None:
+        return None
+    return states[off:off + L["size"]]
+
+
+# Status counters. Every call to get_stats or get_ifaces advances them, as
+# traffic would between two samples.
+IFACES = 8
+_REASONS = ["match", "bad-offset", "fragment", "short", "normalize", "memory",
+            "bad-timestamp", "congestion", "ip-option", "proto-cksum",
+            "state-mismatch", "state-insert", "state-limit", "src-limit",
+            "synproxy"]
+_LIMITS = ["max states per rule", "max-src-states", "max-src-nodes",
+           "max-src-conn", "max-src-conn-rate", "overload table insertion",
+           "overload flush states"]
+_TABLE = ["searches", "inserts", "removals"]
+_ticks = {"stats": 0, "ifaces": 0}
+
+def _tick(name):
+    calls.append(("get_" + name, 1))
+    _ticks[name] += 1
+    return _ticks[name]
+
+
+def _section(names, t, step):
+    return dict([(n, long(t*step*(i + 1))) for i, n in enumerate(names)])
+
+
+def get_stats():
+    t = _tick("stats")
+    return {
+        "running": 1, "states": 1000 + t%50, "src_nodes": 0, "since": 1000,
+        "debug": 1, "hostid": 0, "ifname": "", "checksum": "\x00"*16,
+        "counters": _section(_REASONS, t, 10),
+        "limits": _section(_LIMITS, t, 0),
+        "state_table": _section(_TABLE, t, 100),
+        "source_tracking_table": _section(_TABLE, t, 0),
+        "packets": [long(t*1000*(i + 1)) for i in range(12)],
+        "bytes": [long(t*1500000*(i + 1)) for i in range(4)],
+    }
+
+
+def get_ifaces():
+    t = _tick("ifaces")
+    d = {}
+    for n in range(IFACES):
+        d["em%d"%n] = {
+            "tzero": 1000, "rules": 2, "states": 10 + n, "flags": 0,
+            "trafinfo": [long(t*(n + 1)*(i + 1)) for i in range(16)]
+        }
+    return d
@@ -0,0 +1,190 @@
+"""
+    A stand-in for the openbsd._sysvar extension, holding the values of its
+    constants on OpenBSD, so that the package can be imported on other
+    systems. Installed by standins.py.
+"""
+AF_UNSPEC = 0
+AF_LOCAL = 1
+AF_INET = 2
+AF_APPLETALK = 16
+AF_ROUTE = 17
+AF_LINK = 18
+AF_INET6 = 24
+AF_ENCAP = 28
+
+IFNAMSIZ = 16
+PF_RULESET_NAME_SIZE = 16
+
+ENC_CONF = 0x0400
+ENC_AUTH = 0x0800
+ENC_AUTH_AH = 0x2000
+
+TCPS_CLOSED = 0
+TCPS_LISTEN = 1
+TCPS_SYN_SENT = 2
+TCPS_SYN_RECEIVED = 3
+TCPS_ESTABLISHED = 4
+TCPS_CLOSE_WAIT = 5
+TCPS_FIN_WAIT_1 = 6
+TCPS_CLOSING = 7
+TCPS_LAST_ACK = 8
+TCPS_FIN_WAIT_2 = 9
+TCPS_TIME_WAIT = 10
+PF_TCPS_PROXY_SRC = 11
+PF_TCPS_PROXY_DST = 12
+
+IPPROTO_IP = 0
+IPPROTO_HOPOPTS = 0
+IPPROTO_ICMP = 1
+IPPROTO_IGMP = 2
+IPPROTO_GGP = 3
+IPPROTO_IPIP = 4
+IPPROTO_IPV4 = 4
+IPPROTO_TCP = 6
+IPPROTO_EGP = 8
+IPPROTO_PUP = 12
+IPPROTO_UDP = 17
+IPPROTO_IDP = 22
+IPPROTO_TP = 29
+IPPROTO_IPV6 = 41
+IPPROTO_ROUTING = 43
+IPPROTO_FRAGMENT = 44
+IPPROTO_RSVP = 46
+IPPROTO_GRE = 47
+IPPROTO_ESP = 50
+IPPROTO_AH = 51
+IPPROTO_MOBILE = 55
+IPPROTO_ICMPV6 = 58
+IPPROTO_NONE = 59
+IPPROTO_DSTOPTS = 60
+IPPROTO_EON = 80
+IPPROTO_ETHERIP = 97
+IPPROTO_ENCAP = 98
+IPPROTO_PIM = 103
+IPPROTO_IPCOMP = 108
+IPPROTO_CARP = 112
+IPPROTO_PFSYNC = 240
+IPPROTO_RAW = 255
+
+PFRES_MATCH = 0
+PFRES_BADOFF = 1
+PFRES_FRAG = 2
+PFRES_SHORT = 3
+PFRES_NORM = 4
+PFRES_MEMORY = 5
+
+PFACT_PASS = 0
+PFACT_DROP = 1
+PFACT_SCRUB = 2
+PFACT_NAT = 4
+PFACT_NONAT = 5
+PFACT_BINAT = 6
+PFACT_NOBINAT = 7
+PFACT_RDR = 8
+PFACT_NORDR = 9
+PFACT_SYNPROXY_DROP = 10
+
+PFDIR_INOUT = 0
+PFDIR_IN = 1
+PFDIR_OUT = 2
+
+PFR_TFLAG_PERSIST = 0x01
+PFR_TFLAG_CONST = 0x02
+PFR_TFLAG_ACTIVE = 0x04
+PFR_TFLAG_INACTIVE = 0x08
+PFR_TFLAG_REFERENCED = 0x10
+PFR_TFLAG_REFDANCHOR = 0x20
+PFR_TFLAG_USRMASK = 0x03
+PFR_TFLAG_SETMASK = 0x3C
+PFR_TFLAG_ALLMASK = 0x3F
+
+PFR_FLAG_ATOMIC = 0x01
+PFR_FLAG_DUMMY = 0x02
+PFR_FLAG_FEEDBACK = 0x04
+PFR_FLAG_CLSTATS = 0x08
+PFR_FLAG_ADDRSTOO = 0x10
+PFR_FLAG_REPLACE = 0x20
+PFR_FLAG_ALLRSETS = 0x40
+PFR_FLAG_ALLMASK = 0x7F
+
+PFR_FB_NONE = 0
+PFR_FB_MATCH = 1
+PFR_FB_ADDED = 2
+PFR_FB_DELETED = 3
+PFR_FB_CHANGED = 4
+PFR_FB_CLEARED = 5
+PFR_FB_DUPLICATE = 6
+PFR_FB_NOTMATCH = 7
+PFR_FB_CONFLICT = 8
+
+DLT_NULL = 0
+DLT_EN10MB = 1
+DLT_EN3MB = 2
+DLT_AX25 = 3
+DLT_PRONET = 4
+DLT_CHAOS = 5
+DLT_IEEE802 = 6
+DLT_ARCNET = 7
+DLT_SLIP = 8
+DLT_PPP = 9
+DLT_FDDI = 10
+DLT_ATM_RFC1483 = 11
+DLT_LOOP = 12
+DLT_ENC = 13
+DLT_RAW = 14
+DLT_SLIP_BSDOS = 15
+DLT_PPP_BSDOS = 16
+DLT_OLD_PFLOG = 17
+DLT_PFSYNC = 18
+DLT_IEEE802_11 = 105
+DLT_PFLOG = 117
+
+EVFILT_READ = -1
+EVFILT_WRITE = -2
+EVFILT_AIO = -3
+EVFILT_VNODE = -4
+EVFILT_PROC = -5
+EVFILT_SIGNAL = -6
+EV_ADD = 0x0001
+EV_DELETE = 0x0002
+EV_ENABLE = 0x0004
+EV_DISABLE = 0x0008
+EV_ONESHOT = 0x0010
+EV_CLEAR = 0x0020
+EV_ERROR = 0x4000
+EV_EOF = 0x8000
+NOTE_LOWAT = 0x0001
+NOTE_EOF = 0x0002
+NOTE_DELETE = 0x0001
+NOTE_WRITE = 0x0002
+NOTE_EXTEND = 0x0004
+NOTE_ATTRIB = 0x0008
+NOTE_LINK = 0x0010
+NOTE_RENAME = 0x0020
+NOTE_REVOKE = 0x0040
+NOTE_TRUNCATE = 0x0080
+NOTE_EXIT = 0x80000000
+NOTE_FORK = 0x40000000
+NOTE_EXEC = 0x20000000
+NOTE_PCTRLMASK = 0xf0000000
+NOTE_PDATAMASK = 0x000fffff
+NOTE_TRACK = 0x00000001
+NOTE_TRACKERR = 0x00000002
+NOTE_CHILD = 0x00000004
+
+IFF_UP = 0x1
+IFF_BROADCAST = 0x2
+IFF_DEBUG = 0x4
+IFF_LOOPBACK = 0x8
+IFF_POINTOPOINT = 0x10
+IFF_NOTRAILERS = 0x20
+IFF_RUNNING = 0x40
+IFF_NOARP = 0x80
+IFF_PROMISC = 0x100
+IFF_ALLMULTI = 0x200
+IFF_OACTIVE = 0x400
+IFF_SIMPLEX = 0x800
+IFF_LINK0 = 0x1000
+IFF_LINK1 = 0x2000
+IFF_LINK2 = 0x4000
+IFF_MULTICAST = 0x8000
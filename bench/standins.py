@@ -0,0 +1,51 @@
+"""
+    Make the source tree importable on any system, by installing stand-ins
+    for the C extensions that the openbsd package loads. Import this before
+    anything from openbsd:
+
+        import sys, os
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import standins
+        from openbsd import pf
+
+    The PF and netstat extensions are replaced by the recorded stand-ins in
+    recordedpf.py and recordednetstat.py, and _sysvar by its constants in
+    recordedsysvar.py. _system returns recorded CPU counters. The other
+    extensions are empty modules, so the code that uses them can't be run,
+    but the package imports. The stand-ins are installed even where the real
+    extensions exist, so that timings are comparable between systems.
+"""
+import sys, os, types
+import recordedpf, recordednetstat, recordedsysvar
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+TREE = os.path.dirname(BENCH)
+if not TREE in sys.path:
+    sys.path.insert(0, TREE)
+
+
+def _module(name, **attrs):
+    m = types.ModuleType(name)
+    m.__dict__.update(attrs)
+    return m
+
+
+_cpustats = {"user": 120114L, "nice": 12L, "sys": 331087L, "intr": 41220L, "idle": 8827119L}
+
+STANDINS = {
+    "_pf": recordedpf,
+    "_netstat": recordednetstat,
+    "_sysvar": recordedsysvar,
+    "_system": _module(
+        "_system",
+        get_cpustats = lambda: dict(_cpustats),
+        get_hostname = lambda: "bench",
+        get_boottime = lambda: 1000000000,
+    ),
+    "_ifconfig": _module("_ifconfig"),
+    "_kqueue": _module("_kqueue"),
+    "arc4random": _module("arc4random"),
+}
+
+for _name, _m in STANDINS.items():
+    sys.modules["openbsd." + _name] = _m
@@ -27,9 +27,17 @@
 */
 
 #include <fcntl.h>
+#include <time.h>
+#include <string.h>
+#include <errno.h>
+#include <stddef.h>
+#include <sys/param.h>
 #include <sys/socket.h>
+#include <sys/sysctl.h>
 #include <net/if.h>
+#include <net/if_dl.h>
 #include <net/if_types.h>
+#include <net/route.h>
 #include <netinet/in.h>
 #include <netinet/in_var.h>
 #include <netinet/ip_var.h>
@@ -633,6 +641,114 @@ PyObject *ipcompstats(PyObject *self, PyObject *args){
 	return retdict;
 }
 
+/*
+ * Fetch the NET_RT_IFLIST routing sysctl: an RTM_IFINFO message with the
+ * if_data of each interface, followed by RTM_NEWADDR messages for its
+ * addresses. Needs neither root nor kvm. The buffer is decoded by
+ * netstat.parseIfList, using the offsets in IFLIST_LAYOUT.
+ */
+PyObject *iflist(PyObject *self, PyObject *args){
+	int mib[6] = { CTL_NET, PF_ROUTE, 0, 0, NET_RT_IFLIST, 0 };
+	size_t len;
+	char *buf;
+	PyObject *ret;
+
+	if (!PyArg_ParseTuple(args, ""))
+		return NULL;
+	for (;;){
+		if (sysctl(mib, 6, NULL, &len, NULL, 0) == -1){
+			PyErr_SetFromErrno(OException);
+			return NULL;
+		}
+		if (!(buf = PyMem_Malloc(len ? len : 1)))
+			return PyErr_NoMemory();
+		if (sysctl(mib, 6, buf, &len, NULL, 0) == -1){
+			PyMem_Free(buf);
+			/* Interfaces were added since the size was taken. */
+			if (errno == ENOMEM)
+				continue;
+			PyErr_SetFromErrno(OException);
+			return NULL;
+		}
+		break;
+	}
+	ret = PyString_FromStringAndSize(buf, len);
+	PyMem_Free(buf);
+	return ret;
+}
+
+/*
+ * The counter blocks that snapshot can read, by name.
+ */
+static struct {
+	char *name;
+	PyObject *(*read)(PyObject *, PyObject *);
+} blocks[] = {
+	{ "ifstats",		ifstats },
+	{ "ipstats",		ipstats },
+	{ "ip6stats",		ip6stats },
+	{ "tcpstats",		tcpstats },
+	{ "udpstats",		udpstats },
+	{ "icmpstats",		icmpstats },
+	{ "igmpstats",		igmpstats },
+	{ "ahstats",		ahstats },
+	{ "espstats",		espstats },
+	{ "ipipstats",		ipipstats },
+	{ "ipcompstats",	ipcompstats },
+	{ NULL, NULL }
+};
+
+/*
+ * Read a sequence of named counter blocks in one pass. Returns a
+ * (timestamp, dict) tuple, where the timestamp is CLOCK_MONOTONIC in
+ * seconds, taken just before the first read, and the dict maps each block
+ * name to its counters.
+ */
+PyObject *snapshot(PyObject *self, PyObject *args){
+	PyObject *names, *seq, *noargs, *val, *dct = NULL;
+	struct timespec ts;
+	char *name;
+	int i, j, len;
+
+	if (!PyArg_ParseTuple(args, "O", &names))
+		return NULL;
+	if (!(seq = PySequence_Fast(names, "Block names must be a sequence.")))
+		return NULL;
+	len = PySequence_Fast_GET_SIZE(seq);
+	if (!(noargs = PyTuple_New(0))){
+		Py_DECREF(seq);
+		return NULL;
+	}
+	if (!(dct = PyDict_New()))
+		goto error;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	for (i = 0; i < len; i++){
+		if (!(name = PyString_AsString(PySequence_Fast_GET_ITEM(seq, i))))
+			goto error;
+		for (j = 0; blocks[j].name; j++)
+			if (!strcmp(blocks[j].name, name))
+				break;
+		if (!blocks[j].name){
+			PyErr_Format(PyExc_ValueError, "Unknown counter block: %s", name);
+			goto error;
+		}
+		if (!(val = blocks[j].read(self, noargs)))
+			goto error;
+		if (stealingSetItem(dct, name, val))
+			goto error;
+	}
+	Py_DECREF(seq);
+	Py_DECREF(noargs);
+	return Py_BuildValue("(dN)", (double) ts.tv_sec + ts.tv_nsec / 1e9, dct);
+
+error:
+	Py_DECREF(seq);
+	Py_DECREF(noargs);
+	Py_XDECREF(dct);
+	return NULL;
+}
+
 PyObject *initialise(PyObject *self, PyObject *args){
 	if (!PyArg_ParseTuple(args, ""))
 		return NULL;
@@ -668,12 +784,76 @@ static PyMethodDef NetstatMethods[] = {
 	{"espstats",			espstats,		METH_VARARGS,	"ESP statistics."},
 	{"ipipstats",			ipipstats,		METH_VARARGS,	"IPIP statistics."},
 	{"ipcompstats",			ipcompstats,	METH_VARARGS,	"IPComp statistics."},
+	{"snapshot",			snapshot,		METH_VARARGS,	"Read several counter blocks in one pass."},
+	{"iflist",				iflist,			METH_VARARGS,	"The raw NET_RT_IFLIST sysctl buffer."},
 	{NULL, NULL, 0, NULL}		 /* Sentinel */
 };
 
+#define IFM_FIELD(d, f) \
+	stealingSetItem(d, #f, PyInt_FromLong((long) offsetof(struct if_msghdr, ifm_##f)))
+#define IFI_FIELD(d, name, f) \
+	stealingSetItem(d, name, Py_BuildValue("(ii)", \
+			(int) offsetof(struct if_data, ifi_##f), (int) sizeof(((struct if_data *)0)->ifi_##f)))
+
+static void addLinkState(PyObject *dict, long state, char *name){
+	PyObject *key, *val;
+
+	key = PyInt_FromLong(state);
+	val = PyString_FromString(name);
+	if (key && val)
+		PyDict_SetItem(dict, key, val);
+	Py_XDECREF(key);
+	Py_XDECREF(val);
+}
+
 void init_netstat(void){
-	PyObject *module, *global;
+	PyObject *module, *global, *layout, *fields, *states;
 	module = Py_InitModule("_netstat", NetstatMethods);
+
+	/* Offsets into the NET_RT_IFLIST buffer, for netstat.parseIfList. */
+	if (!(layout = PyDict_New()))
+		return;
+	stealingSetItem(layout, "size", PyInt_FromLong((long) sizeof(struct if_msghdr)));
+	IFM_FIELD(layout, msglen);
+	IFM_FIELD(layout, version);
+	IFM_FIELD(layout, type);
+	IFM_FIELD(layout, addrs);
+	IFM_FIELD(layout, index);
+	IFM_FIELD(layout, data);
+	stealingSetItem(layout, "RTM_VERSION", PyInt_FromLong((long) RTM_VERSION));
+	stealingSetItem(layout, "RTM_IFINFO", PyInt_FromLong((long) RTM_IFINFO));
+	stealingSetItem(layout, "RTA_IFP", PyInt_FromLong((long) RTA_IFP));
+	stealingSetItem(layout, "align", PyInt_FromLong((long) sizeof(long)));
+	stealingSetItem(layout, "sdl_nlen", PyInt_FromLong((long) offsetof(struct sockaddr_dl, sdl_nlen)));
+	stealingSetItem(layout, "sdl_data", PyInt_FromLong((long) offsetof(struct sockaddr_dl, sdl_data)));
+	if (!(fields = PyDict_New()))
+		return;
+	IFI_FIELD(fields, "mtu", mtu);
+	IFI_FIELD(fields, "metric", metric);
+	IFI_FIELD(fields, "baudrate", baudrate);
+	IFI_FIELD(fields, "ipackets", ipackets);
+	IFI_FIELD(fields, "ierrors", ierrors);
+	IFI_FIELD(fields, "opackets", opackets);
+	IFI_FIELD(fields, "oerrors", oerrors);
+	IFI_FIELD(fields, "collisions", collisions);
+	IFI_FIELD(fields, "ibytes", ibytes);
+	IFI_FIELD(fields, "obytes", obytes);
+	IFI_FIELD(fields, "imcasts", imcasts);
+	IFI_FIELD(fields, "omcasts", omcasts);
+	IFI_FIELD(fields, "iqdrops", iqdrops);
+	IFI_FIELD(fields, "noproto", noproto);
+	IFI_FIELD(fields, "link_state", link_state);
+	stealingSetItem(layout, "fields", fields);
+	if (!(states = PyDict_New()))
+		return;
+	addLinkState(states, LINK_STATE_UNKNOWN, "UNKNOWN");
+	addLinkState(states, LINK_STATE_DOWN, "DOWN");
+	addLinkState(states, LINK_STATE_UP, "UP");
+	addLinkState(states, LINK_STATE_HALF_DUPLEX, "HALF DUPLEX");
+	addLinkState(states, LINK_STATE_FULL_DUPLEX, "FULL DUPLEX");
+	stealingSetItem(layout, "link_states", states);
+	PyModule_AddObject(module, "IFLIST_LAYOUT", layout);
+
 	global = PyImport_ImportModule("_global");
 	OException = PyObject_GetAttrString(global, "OException");
 }
@@ -36,6 +36,8 @@
 #include <net/pfvar.h>
 #include <crypto/md5.h>
 #include <err.h>
+#include <errno.h>
+#include <stddef.h>
 #include <stdlib.h>
 
 #include "_cutils.h"
@@ -47,6 +49,12 @@
 	NULL \
 }
 
+/* Attempts at fetching a state table that keeps outgrowing the buffer. */
+#define STATES_RETRIES 8
+
+#define STATE_FIELD(d, f) \
+	stealingSetItem(d, #f, PyInt_FromLong((long) offsetof(struct pfsync_state, f)))
+
 PyObject *OException;
 
 static int dev;
@@ -275,6 +283,70 @@ PyObject *delete_address(PyObject *self, PyObject *args){
 }
 
 
+/*
+ * Submit a packed array of struct pfr_addr in a single table ioctl. The
+ * kernel's per-entry feedback is returned along with the add or delete
+ * count, as a buffer of the same layout.
+ */
+PyObject *_table_addresses(PyObject *self, PyObject *args, int ioc){
+	struct pfr_table	table;
+	struct pfioc_table	io;
+	struct pfr_addr *buf;
+	PyObject *ret;
+	int iflags, len, count;
+	char *anchor, *name, *addrs;
+
+	if (!PyArg_ParseTuple(args, "sss#i", &anchor, &name, &addrs, &len, &iflags))
+		return NULL;
+
+	if (len % sizeof(struct pfr_addr)){
+		PyErr_SetString(OException, "Address buffer is not a multiple of the entry size.");
+		return NULL;
+	}
+	if (len == 0)
+		return Py_BuildValue("is#", 0, "", 0);
+
+	bzero(&table, sizeof(table));
+	bzero(&io, sizeof io);
+
+	strlcpy(table.pfrt_anchor, anchor, sizeof(table.pfrt_anchor));
+	strlcpy(table.pfrt_name, name, sizeof(table.pfrt_name));
+
+	/* The kernel writes feedback into the buffer, so we hand it a copy. */
+	if ((buf = malloc(len)) == NULL){
+		PyErr_SetFromErrno(OException);
+		return NULL;
+	}
+	memcpy(buf, addrs, len);
+
+	io.pfrio_flags = iflags | PFR_FLAG_FEEDBACK;
+	io.pfrio_table = table;
+	io.pfrio_esize = sizeof(struct pfr_addr);
+	io.pfrio_size = len / sizeof(struct pfr_addr);
+	io.pfrio_buffer = buf;
+
+	if (ioctl(dev, ioc, &io)){
+		free(buf);
+		PyErr_SetFromErrno(OException);
+		return NULL;
+	}
+	count = (ioc == DIOCRADDADDRS) ? io.pfrio_nadd : io.pfrio_ndel;
+	ret = Py_BuildValue("is#", count, (char*)buf, len);
+	free(buf);
+	return ret;
+}
+
+
+PyObject *add_addresses(PyObject *self, PyObject *args){
+	return _table_addresses(self, args, DIOCRADDADDRS);
+}
+
+
+PyObject *delete_addresses(PyObject *self, PyObject *args){
+	return _table_addresses(self, args, DIOCRDELADDRS);
+}
+
+
 PyObject *get_addresses(PyObject *self, PyObject *args){
 	struct pfr_table	table;
 	struct pfr_addr	*buf;
@@ -356,6 +428,99 @@ PyObject *get_addresses(PyObject *self, PyObject *args){
 }
 
 
+/*
+ * Like get_addresses, but return the table contents as a packed array of
+ * struct pfr_addr, without building a Python object per entry.
+ */
+PyObject *get_addresses_raw(PyObject *self, PyObject *args){
+	struct pfr_table	table;
+	struct pfioc_table	io;
+	PyObject *ret;
+	int len = 0;
+	char *anchor, *name;
+
+	if (!PyArg_ParseTuple(args, "ss", &anchor, &name))
+		return NULL;
+
+	bzero(&table, sizeof(table));
+	bzero(&io, sizeof io);
+
+	strlcpy(table.pfrt_anchor, anchor, sizeof(table.pfrt_anchor));
+	strlcpy(table.pfrt_name, name, sizeof(table.pfrt_name));
+	io.pfrio_table = table;
+	io.pfrio_esize = sizeof(struct pfr_addr);
+
+	for (;;){
+		if (io.pfrio_size){
+			if (io.pfrio_buffer)
+				free(io.pfrio_buffer);
+			io.pfrio_buffer = calloc(io.pfrio_size, sizeof(struct pfr_addr));
+			if (io.pfrio_buffer == NULL){
+				PyErr_SetFromErrno(OException);
+				return NULL;
+			}
+		}
+		if (ioctl(dev, DIOCRGETADDRS, &io)){
+			if (io.pfrio_buffer)
+				free(io.pfrio_buffer);
+			PyErr_SetFromErrno(OException);
+			return NULL;
+		}
+		if (len == io.pfrio_size || io.pfrio_size == 0)
+			break;
+		len = io.pfrio_size;
+	}
+
+	if (io.pfrio_size == 0){
+		if (io.pfrio_buffer)
+			free(io.pfrio_buffer);
+		return PyString_FromStringAndSize("", 0);
+	}
+	ret = PyString_FromStringAndSize((char*)io.pfrio_buffer, io.pfrio_size * sizeof(struct pfr_addr));
+	free(io.pfrio_buffer);
+	return ret;
+}
+
+
+/*
+ * Replace the contents of a table with a packed array of struct pfr_addr
+ * in a single DIOCRSETADDRS ioctl. Returns (added, deleted, changed).
+ */
+PyObject *set_addresses(PyObject *self, PyObject *args){
+	struct pfr_table	table;
+	struct pfioc_table	io;
+	int iflags, len;
+	char *anchor, *name, *addrs;
+
+	if (!PyArg_ParseTuple(args, "sss#i", &anchor, &name, &addrs, &len, &iflags))
+		return NULL;
+
+	if (len % sizeof(struct pfr_addr)){
+		PyErr_SetString(OException, "Address buffer is not a multiple of the entry size.");
+		return NULL;
+	}
+
+	bzero(&table, sizeof(table));
+	bzero(&io, sizeof io);
+
+	strlcpy(table.pfrt_anchor, anchor, sizeof(table.pfrt_anchor));
+	strlcpy(table.pfrt_name, name, sizeof(table.pfrt_name));
+
+	io.pfrio_flags = iflags;
+	io.pfrio_table = table;
+	io.pfrio_esize = sizeof(struct pfr_addr);
+	io.pfrio_size = len / sizeof(struct pfr_addr);
+	/* The kernel only reads the buffer when no feedback is requested. */
+	io.pfrio_buffer = addrs;
+
+	if (ioctl(dev, DIOCRSETADDRS, &io)){
+		PyErr_SetFromErrno(OException);
+		return NULL;
+	}
+	return Py_BuildValue("iii", io.pfrio_nadd, io.pfrio_ndel, io.pfrio_nchange);
+}
+
+
 PyObject *get_tables(PyObject *self, PyObject *args){
 	struct pfr_table	filter;
 	struct pfr_table	*buf;
@@ -410,6 +575,67 @@ PyObject *get_tables(PyObject *self, PyObject *args){
 }
 
 
+/*
+ * Return every table in every anchor as a list of (anchor, name, flags)
+ * tuples, from a single DIOCRGETTABLES call with PFR_FLAG_ALLRSETS.
+ */
+PyObject *get_all_tables(PyObject *self, PyObject *args){
+	struct pfr_table	*buf;
+	struct pfioc_table	io;
+	PyObject *lst, *t;
+	int i;
+	int len = 0;
+
+	if (!PyArg_ParseTuple(args, ""))
+		return NULL;
+
+	bzero(&io, sizeof io);
+	io.pfrio_flags = PFR_FLAG_ALLRSETS;
+	io.pfrio_esize = sizeof(struct pfr_table);
+
+	for (;;){
+		if (io.pfrio_size){
+			if (io.pfrio_buffer)
+				free(io.pfrio_buffer);
+			io.pfrio_buffer = calloc(io.pfrio_size, sizeof(struct pfr_table));
+			if (io.pfrio_buffer == NULL){
+				PyErr_SetFromErrno(OException);
+				return NULL;
+			}
+		}
+		if (ioctl(dev, DIOCRGETTABLES, &io)){
+			if (io.pfrio_buffer)
+				free(io.pfrio_buffer);
+			PyErr_SetFromErrno(OException);
+			return NULL;
+		}
+		if (len == io.pfrio_size || io.pfrio_size == 0)
+			break;
+		len = io.pfrio_size;
+	}
+
+	if (!(lst = PyList_New(0))){
+		if (io.pfrio_buffer)
+			free(io.pfrio_buffer);
+		return NULL;
+	}
+	buf = (struct pfr_table*)io.pfrio_buffer;
+	for (i = 0; i < io.pfrio_size; i++){
+		t = Py_BuildValue("ssl", buf[i].pfrt_anchor, buf[i].pfrt_name, (long) buf[i].pfrt_flags);
+		if (t == NULL || PyList_Append(lst, t) < 0){
+			Py_XDECREF(t);
+			Py_DECREF(lst);
+			free(buf);
+			return NULL;
+		}
+		Py_DECREF(t);
+	}
+	if (buf)
+		free(buf);
+	return lst;
+}
+
+
 PyObject *get_anchors(PyObject *self, PyObject *args){
 	PyObject *anchors, *rulename;
 	struct pfioc_ruleset rs;
@@ -729,6 +955,88 @@ PyObject *get_states(PyObject *self, PyObject *args){
 }
 
 
+/*
+ * Return the state table as a string holding the raw array of struct
+ * pfsync_state. If the table grows between sizing the buffer and fetching
+ * it, the kernel silently truncates the result. A buffer with no room for
+ * another state is taken as a sign of this, and the fetch is retried with
+ * a larger one. If the table is still growing faster than the buffer after
+ * STATES_RETRIES retries, OException is raised with errno EAGAIN.
+ */
+PyObject *get_states_raw(PyObject *self, PyObject *args){
+	struct pfioc_states ps;
+	PyObject *buf;
+	int len, tries;
+
+	if (!PyArg_ParseTuple(args, ""))
+		return NULL;
+
+	bzero(&ps, sizeof ps);
+	if (ioctl(dev, DIOCGETSTATES, &ps)){
+		PyErr_SetFromErrno(OException);
+		return NULL;
+	}
+
+	/* Leave some headroom for states created in the meantime. */
+	len = ps.ps_len + ps.ps_len/8 + 16 * (int) sizeof(struct pfsync_state);
+	for (tries = 0;; tries++){
+		if (!(buf = PyString_FromStringAndSize(NULL, len)))
+			return NULL;
+		ps.ps_len = len;
+		ps.ps_buf = PyString_AS_STRING(buf);
+		if (ioctl(dev, DIOCGETSTATES, &ps)){
+			Py_DECREF(buf);
+			PyErr_SetFromErrno(OException);
+			return NULL;
+		}
+		if (ps.ps_len + (int) sizeof(struct pfsync_state) <= len)
+			break;
+		Py_DECREF(buf);
+		if (tries == STATES_RETRIES){
+			/* The table outgrew every buffer: don't return part of it. */
+			errno = EAGAIN;
+			PyErr_SetFromErrno(OException);
+			return NULL;
+		}
+		len *= 2;
+	}
+	if (_PyString_Resize(&buf, ps.ps_len) < 0)
+		return NULL;
+	return buf;
+}
+
+
+/*
+ * Look up a single state by its (id, creatorid) key with DIOCGETSTATE, and
+ * return the raw struct pfsync_state. Returns None if there is no such
+ * state. Both key fields are passed in host order, and stored in the
+ * network order that the kernel exports them in.
+ */
+PyObject *get_state(PyObject *self, PyObject *args){
+	unsigned PY_LONG_LONG id;
+	unsigned int creatorid;
+	u_int64_t nid;
+	struct pfioc_state ps;
+
+	if (!PyArg_ParseTuple(args, "KI", &id, &creatorid))
+		return NULL;
+
+	bzero(&ps, sizeof(ps));
+	nid = htobe64((u_int64_t) id);
+	memcpy(&ps.state.id, &nid, sizeof(nid));
+	ps.state.creatorid = htonl(creatorid);
+	if (ioctl(dev, DIOCGETSTATE, &ps)){
+		if (errno == ENOENT){
+			Py_INCREF(Py_None);
+			return Py_None;
+		}
+		PyErr_SetFromErrno(OException);
+		return NULL;
+	}
+	return PyString_FromStringAndSize((char *) &ps.state, sizeof(ps.state));
+}
+
+
 PyObject *clear_states(PyObject *self, PyObject *args){
 	char *name;
 	struct pfioc_state_kill psk;
@@ -815,6 +1123,89 @@ PyObject *kill_states(PyObject *self, PyObject *args){
 }
 
 
+/*
+ * Kill the states matching each of an array of packed filters, as built by
+ * pf.PF.killStatesBatch. Each filter is KILL_RECORD_SIZE bytes:
+ *
+ *      af              1
+ *      ifname          16, NUL padded
+ *      src, srcmask    16 each
+ *      dst, dstmask    16 each
+ *      srcport         2, network order, 0 for any
+ *      dstport         2, network order, 0 for any
+ *
+ * The ioctls are issued in one loop with the interpreter lock released.
+ * Returns a list of the number of states killed by each filter. If an ioctl
+ * fails, the filters before it have already been applied: OException is
+ * raised with (errno, strerror, index of the failed filter, list of counts
+ * for the filters before it) as its arguments.
+ */
+#define KILL_RECORD_SIZE    85
+
+PyObject *kill_states_batch(PyObject *self, PyObject *args){
+	const unsigned char *data, *rec;
+	int len, i, n, err;
+	u_int32_t *killed;
+	struct pfioc_state_kill psk;
+	PyObject *lst, *exc;
+
+	if (!PyArg_ParseTuple(args, "s#", &data, &len))
+		return NULL;
+	if (len % KILL_RECORD_SIZE){
+		PyErr_SetString(OException, "Malformed state kill filters.");
+		return NULL;
+	}
+	n = len / KILL_RECORD_SIZE;
+	if (!(killed = PyMem_Malloc(sizeof(u_int32_t) * (n ? n : 1))))
+		return PyErr_NoMemory();
+
+	err = 0;
+	Py_BEGIN_ALLOW_THREADS
+	for (i = 0; i < n; i++){
+		rec = data + i * KILL_RECORD_SIZE;
+		bzero(&psk, sizeof(psk));
+		psk.psk_af = rec[0];
+		memcpy(psk.psk_ifname, rec + 1, IFNAMSIZ - 1);
+		if (psk.psk_af == AF_INET || psk.psk_af == AF_INET6){
+			memcpy(&psk.psk_src.addr.v.a.addr, rec + 17, 16);
+			memcpy(&psk.psk_src.addr.v.a.mask, rec + 33, 16);
+			memcpy(&psk.psk_dst.addr.v.a.addr, rec + 49, 16);
+			memcpy(&psk.psk_dst.addr.v.a.mask, rec + 65, 16);
+		}
+		memcpy(&psk.psk_src.port[0], rec + 81, 2);
+		memcpy(&psk.psk_dst.port[0], rec + 83, 2);
+		if (psk.psk_src.port[0])
+			psk.psk_src.port_op = PF_OP_EQ;
+		if (psk.psk_dst.port[0])
+			psk.psk_dst.port_op = PF_OP_EQ;
+		if (ioctl(dev, DIOCKILLSTATES, &psk)){
+			err = errno;
+			break;
+		}
+		killed[i] = psk.psk_af;
+	}
+	Py_END_ALLOW_THREADS
+
+	/* On failure, i is the index of the filter that failed. */
+	if (!(lst = PyList_New(i))){
+		PyMem_Free(killed);
+		return NULL;
+	}
+	for (n = 0; n < i; n++)
+		PyList_SET_ITEM(lst, n, PyLong_FromUnsignedLong((unsigned long) killed[n]));
+	PyMem_Free(killed);
+	if (err){
+		exc = Py_BuildValue("(isiN)", err, strerror(err), i, lst);
+		if (exc){
+			PyErr_SetObject(OException, exc);
+			Py_DECREF(exc);
+		}
+		return NULL;
+	}
+	return lst;
+}
+
+
 PyObject *init(PyObject *self, PyObject *args){
 	if (!PyArg_ParseTuple(args, ""))
 		return NULL;
@@ -845,23 +1236,65 @@ static PyMethodDef PFMethods[] = {
 	{"get_anchors",			get_anchors,        METH_VARARGS,	"Get anchors under a specified path."},
 	{"clear_tables",		clear_tables,       METH_VARARGS,	"Clear tables under a specified path."},
 	{"get_tables",			get_tables,         METH_VARARGS,	"Retrieve the list of tables under a specified path."},
+	{"get_all_tables",		get_all_tables,     METH_VARARGS,	"Retrieve the tables in all anchors."},
 	{"add_address",			add_address,	    METH_VARARGS,	"Add an address or network to a table."},
 	{"delete_address",		delete_address,	    METH_VARARGS,	"Delete an address or network from a table."},
+	{"add_addresses",		add_addresses,	    METH_VARARGS,	"Add a packed array of addresses to a table."},
+	{"delete_addresses",	delete_addresses,   METH_VARARGS,	"Delete a packed array of addresses from a table."},
 	{"get_addresses",		get_addresses,	    METH_VARARGS,	"Get a list of addresses in a table."},
+	{"get_addresses_raw",	get_addresses_raw,  METH_VARARGS,	"Get the addresses in a table as a packed array."},
+	{"set_addresses",		set_addresses,	    METH_VARARGS,	"Replace the addresses in a table."},
 	{"get_ifaces",			get_ifaces,		    METH_VARARGS,	"Get a list of interfaces and associated stats."},
 	{"set_log_iface",		set_log_iface,	    METH_VARARGS,	"Set the logging interface. Data retrieved with get_stats"},
 	{"clear_stats",	        clear_stats,	    METH_VARARGS,	"Clear PF statistics."},
 	{"get_stats",		    get_stats,          METH_VARARGS,	"Get PF statistics."},
 	{"get_states",		    get_states,         METH_VARARGS,	"Get state table entries."},
+	{"get_states_raw",		get_states_raw,     METH_VARARGS,	"Get the raw state table."},
+	{"get_state",		    get_state,          METH_VARARGS,	"Get a single raw state by id and creator id."},
 	{"clear_states",		clear_states,       METH_VARARGS,	"Clear state table entries."},
 	{"kill_states",		    kill_states,        METH_VARARGS,	"Kill specified state table entries."},
+	{"kill_states_batch",	kill_states_batch,  METH_VARARGS,	"Kill the state table entries matching each of a list of filters."},
 	{NULL, NULL, 0, NULL}        /* Sentinel */
 };
 
 
 void init_pf(void){
-	PyObject *module, *global;
+	PyObject *module, *global, *layout;
 	module = Py_InitModule("_pf", PFMethods);
+	PyModule_AddIntConstant(module, "PFR_ADDR_SIZE", (long) sizeof(struct pfr_addr));
+	PyModule_AddIntConstant(module, "KILL_RECORD_SIZE", (long) KILL_RECORD_SIZE);
+
+	/* Offsets into struct pfsync_state, for decoding get_states_raw. */
+	if (!(layout = PyDict_New()))
+		return;
+	stealingSetItem(layout, "size", PyInt_FromLong((long) sizeof(struct pfsync_state)));
+	STATE_FIELD(layout, id);
+	STATE_FIELD(layout, ifname);
+	STATE_FIELD(layout, lan);
+	STATE_FIELD(layout, gwy);
+	STATE_FIELD(layout, ext);
+	STATE_FIELD(layout, src);
+	STATE_FIELD(layout, dst);
+	STATE_FIELD(layout, rule);
+	STATE_FIELD(layout, creation);
+	STATE_FIELD(layout, expire);
+	STATE_FIELD(layout, packets);
+	STATE_FIELD(layout, bytes);
+	STATE_FIELD(layout, creatorid);
+	STATE_FIELD(layout, af);
+	STATE_FIELD(layout, proto);
+	STATE_FIELD(layout, direction);
+	STATE_FIELD(layout, log);
+	STATE_FIELD(layout, timeout);
+	STATE_FIELD(layout, sync_flags);
+	STATE_FIELD(layout, updates);
+	stealingSetItem(layout, "host_port",
+			PyInt_FromLong((long) offsetof(struct pfsync_state_host, port)));
+	stealingSetItem(layout, "peer_state",
+			PyInt_FromLong((long) offsetof(struct pfsync_state_peer, state)));
+	stealingSetItem(layout, "peer_wscale",
+			PyInt_FromLong((long) offsetof(struct pfsync_state_peer, wscale)));
+	PyModule_AddObject(module, "STATE_LAYOUT", layout);
 	global = PyImport_ImportModule("_global");
 	OException = PyObject_GetAttrString(global, "OException");
 }
@@ -155,6 +155,16 @@ void init_sysvar(void){
 	PyModule_AddIntConstant(module, "PFR_FLAG_REPLACE", (long) PFR_FLAG_REPLACE);
 	PyModule_AddIntConstant(module, "PFR_FLAG_ALLRSETS", (long) PFR_FLAG_ALLRSETS);
 	PyModule_AddIntConstant(module, "PFR_FLAG_ALLMASK", (long) PFR_FLAG_ALLMASK);
+	/* pfr_addr feedback codes */
+	PyModule_AddIntConstant(module, "PFR_FB_NONE", (long) PFR_FB_NONE);
+	PyModule_AddIntConstant(module, "PFR_FB_MATCH", (long) PFR_FB_MATCH);
+	PyModule_AddIntConstant(module, "PFR_FB_ADDED", (long) PFR_FB_ADDED);
+	PyModule_AddIntConstant(module, "PFR_FB_DELETED", (long) PFR_FB_DELETED);
+	PyModule_AddIntConstant(module, "PFR_FB_CHANGED", (long) PFR_FB_CHANGED);
+	PyModule_AddIntConstant(module, "PFR_FB_CLEARED", (long) PFR_FB_CLEARED);
+	PyModule_AddIntConstant(module, "PFR_FB_DUPLICATE", (long) PFR_FB_DUPLICATE);
+	PyModule_AddIntConstant(module, "PFR_FB_NOTMATCH", (long) PFR_FB_NOTMATCH);
+	PyModule_AddIntConstant(module, "PFR_FB_CONFLICT", (long) PFR_FB_CONFLICT);
     /* BPF Data Link Types */
     PyModule_AddIntConstant(module, "DLT_NULL",         (long) DLT_NULL);
     PyModule_AddIntConstant(module, "DLT_EN10MB",       (long) DLT_EN10MB);
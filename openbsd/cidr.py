@@ -0,0 +1,712 @@
+#    Copyright (c) 2003, Nullcube Pty Ltd
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    *   Redistributions of source code must retain the above copyright notice, this
+#        list of conditions and the following disclaimer.
+#    *   Redistributions in binary form must reproduce the above copyright notice,
+#        this list of conditions and the following disclaimer in the documentation
+#        and/or other materials provided with the distribution.
+#    *   Neither the name of Nullcube nor the names of its contributors may be used to
+#        endorse or promote products derived from this software without specific
+#        prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#    ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#    (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+#    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#    (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#    SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+    Containers for IPv4 and IPv6 networks, built on the address and mask
+    classes in openbsd.utils.
+"""
+import utils
+from _sysvar import *
+
+_FAMILIES = {
+    AF_INET:    (utils.IPAddress, 32),
+    AF_INET6:   (utils.IP6Address, 128),
+}
+
+# Number of leading zero bits in a hex digit.
+_nibbleZeros = {
+    "0": 4, "1": 3, "2": 2, "3": 2, "4": 1, "5": 1, "6": 1, "7": 1,
+    "8": 0, "9": 0, "a": 0, "b": 0, "c": 0, "d": 0, "e": 0, "f": 0
+}
+
+def _bitLength(num):
+    """
+        The number of bits needed to represent a positive integer.
+    """
+    s = "%x"%num
+    return 4*len(s) - _nibbleZeros[s[0]]
+
+
+def parseNetwork(address, mask=None):
+    """
+        Parse a network specification, and return an (address, mask) tuple
+        of utils objects. The address can be an address object or text, with
+        an optional "/prefix" suffix. The mask can be anything accepted by
+        the mask classes. Host bits set in the address are cleared.
+    """
+    if mask is None and utils.isStringLike(address) and "/" in address:
+        address, mask = address.split("/", 1)
+        if mask.isdigit():
+            mask = int(mask)
+    a = utils.Address(address)
+    if not a.af in _FAMILIES:
+        raise ValueError, "Not an IP or IPv6 address."
+    m = a.mask(mask)
+    if a._int & ~m._int:
+        a = a.fromInt(a._int & m._int)
+    return a, m
+
+
+def _key(address, mask):
+    """
+        Return the (af, integer network, prefix length) for a network.
+    """
+    if mask is None:
+        if isinstance(address, utils._IPBase):
+            return address.af, address._int, address.WIDTH
+        if utils.isStringLike(address) and "/" in address:
+            address, mask = address.split("/", 1)
+            if mask.isdigit():
+                mask = int(mask)
+    if isinstance(mask, int):
+        # Fast path for numeric prefixes: no mask object is needed.
+        a = utils.Address(address)
+        if not a.af in _FAMILIES:
+            raise ValueError, "Not an IP or IPv6 address."
+        width = a.WIDTH
+        if mask < 0 or mask > width:
+            raise ValueError, "Prefix must be between 0 and %s."%width
+        return a.af, a._int & ~((1L << (width - mask)) - 1), mask
+    a, m = parseNetwork(address, mask)
+    return a.af, a._int, m.prefix
+
+
+def _keys(networks):
+    """
+        Yield an (af, integer network, prefix length) tuple for each element
+        of a sequence of networks. Each element can be a dictionary with
+        "address" and "mask" keys, as returned by pf.Table.getAddresses(),
+        an (address, mask) tuple, or a single network specification.
+    """
+    for i in networks:
+        if isinstance(i, dict):
+            yield _key(i["address"], i["mask"])
+        elif isinstance(i, tuple):
+            yield _key(*i)
+        else:
+            yield _key(i, None)
+
+
+class _Node(object):
+    """
+        A node in a RadixTree. Nodes with an _EMPTY value are glue nodes,
+        created only to join two branches.
+    """
+    __slots__ = ("key", "plen", "kids", "value")
+    def __init__(self, key, plen, value):
+        self.key, self.plen, self.value = key, plen, value
+        self.kids = [None, None]
+
+
+_EMPTY = object()
+
+class RadixTree(object):
+    """
+        A path-compressed binary (PATRICIA) trie mapping IPv4 and IPv6
+        networks to values. Insertion, deletion, exact match and longest
+        prefix match all take time proportional to the prefix length.
+
+        Networks can be given as "10.0.0.0/8" text, or as an address and a
+        mask, where the mask is anything accepted by the mask classes in
+        openbsd.utils. A bare address is treated as a host network.
+    """
+    def __init__(self, addresses=None):
+        self._roots = {}
+        self._len = 0
+        if addresses:
+            self.update(addresses)
+
+    @classmethod
+    def fromTable(klass, table):
+        """
+            Build a tree from the contents of an openbsd.pf.Table.
+        """
+        return klass(table.getAddresses())
+
+    def update(self, addresses):
+        """
+            Insert a sequence of networks. Each element can be a dictionary
+            with "address" and "mask" keys, as returned by
+            pf.Table.getAddresses(), an (address, mask) tuple, or anything
+            accepted as a single network specification.
+        """
+        for af, key, plen in _keys(addresses):
+            self._insert(af, key, plen, True)
+
+    def _bit(self, key, pos, width):
+        return (key >> (width - 1 - pos)) & 1
+
+    def insert(self, address, mask=None, value=True):
+        """
+            Add a network to the tree, replacing the value of an existing
+            entry for the same network.
+        """
+        af, key, plen = _key(address, mask)
+        self._insert(af, key, plen, value)
+
+    def _insert(self, af, key, plen, value):
+        width = _FAMILIES[af][1]
+        parent, side = None, None
+        node = self._roots.get(af)
+        while node is not None:
+            common = min(self._common(node.key, key, width), node.plen, plen)
+            if common < node.plen:
+                break
+            if node.plen == plen:
+                if node.value is _EMPTY:
+                    self._len += 1
+                node.value = value
+                return
+            parent, side = node, self._bit(key, node.plen, width)
+            node = node.kids[side]
+        new = _Node(key, plen, value)
+        self._len += 1
+        if node is not None:
+            if common == plen:
+                # The new network contains the existing node.
+                new.kids[self._bit(node.key, plen, width)] = node
+            else:
+                glue = _Node(key & self._mask(common, width), common, _EMPTY)
+                glue.kids[self._bit(key, common, width)] = new
+                glue.kids[self._bit(node.key, common, width)] = node
+                new = glue
+        if parent is None:
+            self._roots[af] = new
+        else:
+            parent.kids[side] = new
+
+    def delete(self, address, mask=None):
+        """
+            Remove a network from the tree. Raises KeyError if it is not
+            present.
+        """
+        af, key, plen = _key(address, mask)
+        width = _FAMILIES[af][1]
+        path = []
+        node = self._roots.get(af)
+        while node is not None and node.plen < plen:
+            if self._common(node.key, key, width) < node.plen:
+                node = None
+                break
+            side = self._bit(key, node.plen, width)
+            path.append((node, side))
+            node = node.kids[side]
+        if node is None or node.plen != plen or node.key != key or node.value is _EMPTY:
+            raise KeyError, "Network not in tree."
+        self._len -= 1
+        node.value = _EMPTY
+        # Unlink the node if it has fewer than two children, then collapse
+        # a glue parent left with a single child.
+        while node.value is _EMPTY and not (node.kids[0] and node.kids[1]):
+            child = node.kids[0] or node.kids[1]
+            if path:
+                parent, side = path.pop()
+                parent.kids[side] = child
+            else:
+                if child is None:
+                    del self._roots[af]
+                else:
+                    self._roots[af] = child
+                break
+            if child is not None:
+                break
+            node = parent
+
+    def _common(self, a, b, width):
+        """
+            The number of leading bits a and b have in common.
+        """
+        x = a ^ b
+        if not x:
+            return width
+        return width - _bitLength(x)
+
+    def _mask(self, plen, width):
+        return ((1L << width) - 1) ^ ((1L << (width - plen)) - 1)
+
+    def _find(self, af, key, plen):
+        node = self._roots.get(af)
+        width = _FAMILIES[af][1]
+        while node is not None and node.plen <= plen:
+            if self._common(node.key, key, width) < node.plen:
+                return None
+            if node.plen == plen:
+                return node
+            node = node.kids[self._bit(key, node.plen, width)]
+        return None
+
+    def _path(self, af, key, plen):
+        """
+            Yield the occupied nodes whose networks contain the given one,
+            from least to most specific.
+        """
+        node = self._roots.get(af)
+        width = _FAMILIES[af][1]
+        while node is not None and node.plen <= plen:
+            if self._common(node.key, key, width) < node.plen:
+                return
+            if node.value is not _EMPTY:
+                yield node
+            if node.plen == width:
+                return
+            node = node.kids[self._bit(key, node.plen, width)]
+
+    def _entry(self, af, node):
+        cls = _FAMILIES[af][0]
+        a = cls.fromInt(node.key)
+        return a, a.mask(node.plen), node.value
+
+    def get(self, address, mask=None, default=None):
+        """
+            Return the value stored for exactly this network.
+        """
+        af, key, plen = _key(address, mask)
+        node = self._find(af, key, plen)
+        if node is None or node.value is _EMPTY:
+            return default
+        return node.value
+
+    def has_key(self, address, mask=None):
+        """
+            Is exactly this network in the tree?
+        """
+        af, key, plen = _key(address, mask)
+        node = self._find(af, key, plen)
+        return (node is not None and node.value is not _EMPTY)
+
+    def __getitem__(self, network):
+        af, key, plen = _key(network, None)
+        node = self._find(af, key, plen)
+        if node is None or node.value is _EMPTY:
+            raise KeyError, network
+        return node.value
+
+    def __setitem__(self, network, value):
+        self.insert(network, None, value)
+
+    def __delitem__(self, network):
+        self.delete(network)
+
+    def lookup(self, address, mask=None):
+        """
+            Longest prefix match. Return an (address, mask, value) tuple for
+            the most specific network containing the given address or
+            network, or None if there is no such network.
+        """
+        af, key, plen = _key(address, mask)
+        match = None
+        for match in self._path(af, key, plen):
+            pass
+        if match is None:
+            return None
+        return self._entry(af, match)
+
+    def __contains__(self, address):
+        """
+            Is the address (or network) covered by any network in the tree?
+        """
+        af, key, plen = _key(address, None)
+        for i in self._path(af, key, plen):
+            return True
+        return False
+
+    def covering(self, address, mask=None):
+        """
+            Yield (address, mask, value) tuples for all networks that
+            contain the given network, from least to most specific.
+        """
+        af, key, plen = _key(address, mask)
+        for node in self._path(af, key, plen):
+            yield self._entry(af, node)
+
+    def covered(self, address, mask=None):
+        """
+            Yield (address, mask, value) tuples for all networks contained
+            in the given network, including the network itself, in address
+            order.
+        """
+        af, key, plen = _key(address, mask)
+        width = _FAMILIES[af][1]
+        node = self._roots.get(af)
+        while node is not None and node.plen < plen:
+            if self._common(node.key, key, width) < node.plen:
+                return
+            node = node.kids[self._bit(key, node.plen, width)]
+        if node is None or self._common(node.key, key, width) < plen:
+            return
+        for i in self._walk(af, node):
+            yield i
+
+    def _walk(self, af, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.value is not _EMPTY:
+                yield self._entry(af, node)
+            if node.kids[1] is not None:
+                stack.append(node.kids[1])
+            if node.kids[0] is not None:
+                stack.append(node.kids[0])
+
+    def items(self):
+        """
+            Yield (address, mask, value) tuples for every network in the
+            tree. IPv4 networks come before IPv6 networks, and each family
+            is in address order.
+        """
+        for af in (AF_INET, AF_INET6):
+            if af in self._roots:
+                for i in self._walk(af, self._roots[af]):
+                    yield i
+
+    def __iter__(self):
+        for a, m, v in self.items():
+            yield a, m
+
+    def __len__(self):
+        return self._len
+
+    def __repr__(self):
+        return "RadixTree(%s)"%", ".join(["%s/%s"%(a, m.prefix) for a, m in self])
+
+
+#
+# Set operations over sorted intervals
+#
+def _intervals(networks):
+    """
+        Return the networks as a sorted list of (af, first, last) integer
+        intervals.
+    """
+    lst = []
+    for af, key, plen in _keys(networks):
+        lst.append((af, key, key | ((1L << (_FAMILIES[af][1] - plen)) - 1)))
+    lst.sort()
+    return lst
+
+
+def _merge(intervals):
+    """
+        Coalesce overlapping and adjacent intervals in a sorted sequence.
+    """
+    itr = iter(intervals)
+    for caf, cfirst, clast in itr:
+        break
+    else:
+        return
+    for af, first, last in itr:
+        if af == caf and first <= clast + 1:
+            if last > clast:
+                clast = last
+        else:
+            yield caf, cfirst, clast
+            caf, cfirst, clast = af, first, last
+    yield caf, cfirst, clast
+
+
+def _networks(intervals):
+    """
+        Split each interval into the smallest list of CIDR networks that
+        exactly covers it, and yield them as (address, mask) tuples.
+    """
+    for af, first, last in intervals:
+        cls, width = _FAMILIES[af]
+        while first <= last:
+            # The largest block aligned at first: limited by the lowest set
+            # bit of first, and by the end of the interval.
+            if first:
+                size = _bitLength(first & -first) - 1
+            else:
+                size = width
+            span = _bitLength(last - first + 1) - 1
+            if span < size:
+                size = span
+            a = cls.fromInt(first)
+            yield a, a.mask(width - size)
+            first += 1L << size
+
+
+def aggregate(networks):
+    """
+        Collapse a sequence of networks into the minimal sorted list of CIDR
+        networks covering the same addresses. Overlapping and adjacent
+        networks are merged. The input can take any of the forms accepted
+        by RadixTree.update. The result is yielded as (address, mask)
+        tuples.
+    """
+    return _networks(_merge(_intervals(networks)))
+
+
+def union(a, b):
+    """
+        Yield the minimal CIDR networks covering the addresses in either of
+        two sequences of networks.
+    """
+    intervals = _intervals(a)
+    intervals.extend(_intervals(b))
+    intervals.sort()
+    return _networks(_merge(intervals))
+
+
+def _intersect(x, y):
+    x, y = _merge(x), _merge(y)
+    try:
+        xi, yi = x.next(), y.next()
+        while 1:
+            if xi[0] != yi[0]:
+                if xi[0] < yi[0]:
+                    xi = x.next()
+                else:
+                    yi = y.next()
+                continue
+            first, last = max(xi[1], yi[1]), min(xi[2], yi[2])
+            if first <= last:
+                yield xi[0], first, last
+            if xi[2] < yi[2]:
+                xi = x.next()
+            else:
+                yi = y.next()
+    except StopIteration:
+        return
+
+
+def intersection(a, b):
+    """
+        Yield the minimal CIDR networks covering the addresses present in
+        both of two sequences of networks.
+    """
+    return _networks(_intersect(_intervals(a), _intervals(b)))
+
+
+def _subtract(x, y):
+    y = _merge(y)
+    yi = None
+    for yi in y:
+        break
+    for af, first, last in _merge(x):
+        # Skip subtrahend intervals that lie wholly before this one.
+        while yi is not None and (yi[0], yi[2]) < (af, first):
+            yi = _nextOrNone(y)
+        while yi is not None and yi[0] == af and yi[1] <= last:
+            if yi[1] > first:
+                yield af, first, yi[1] - 1
+            if yi[2] >= last:
+                first = last + 1
+                break
+            first = yi[2] + 1
+            yi = _nextOrNone(y)
+        if first <= last:
+            yield af, first, last
+
+
+def _nextOrNone(itr):
+    for i in itr:
+        return i
+    return None
+
+
+def difference(a, b):
+    """
+        Yield the minimal CIDR networks covering the addresses in a that are
+        not in b.
+    """
+    return _networks(_subtract(_intervals(a), _intervals(b)))
+
+
+#
+# Lazy ranges
+#
+class AddressRange(object):
+    """
+        A read-only sequence of the addresses from first to last inclusive.
+        Nothing is materialized: indexing, slicing, len() and membership are
+        computed arithmetically, and iteration runs in constant memory.
+        Ranges larger than sys.maxint (an IPv6 /64, for instance) can't be
+        measured with len(); use the size attribute instead.
+    """
+    def __init__(self, first, last):
+        first, last = utils.Address(first), utils.Address(last)
+        if not first.af in _FAMILIES or first.af != last.af:
+            raise ValueError, "Range ends must be IP or IPv6 addresses of the same family."
+        self._init(first.af, first._int, 1, max(last._int - first._int + 1, 0))
+
+    def _init(self, af, start, step, size):
+        self.af, self._start, self._step, self.size = af, start, step, size
+        self._klass = _FAMILIES[af][0]
+
+    @classmethod
+    def _make(klass, af, start, step, size):
+        r = object.__new__(klass)
+        r._init(af, start, step, size)
+        return r
+
+    def _item(self, num):
+        return self._klass._fromInt(num)
+
+    def __len__(self):
+        return self.size
+
+    def __nonzero__(self):
+        return self.size > 0
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, step, size = _sliceIndices(i, self.size)
+            r = object.__new__(self.__class__)
+            r.__dict__.update(self.__dict__)
+            r._start = self._start + start*self._step
+            r._step, r.size = step*self._step, size
+            return r
+        if i < 0:
+            i += self.size
+        if i < 0 or i >= self.size:
+            raise IndexError, "Range index out of range."
+        return self._item(self._start + i*self._step)
+
+    def __iter__(self):
+        num, step = self._start, self._step
+        stop = num + self.size*step
+        while num != stop:
+            yield self._item(num)
+            num += step
+
+    def _index(self, num):
+        """
+            The position of an integer in the range, or None.
+        """
+        i, rem = divmod(num - self._start, self._step)
+        if rem or i < 0 or i >= self.size:
+            return None
+        return i
+
+    def __contains__(self, address):
+        address = utils.Address(address)
+        return address.af == self.af and self._index(address._int) is not None
+
+    def index(self, address):
+        address = utils.Address(address)
+        if address.af == self.af:
+            i = self._index(address._int)
+            if i is not None:
+                return i
+        raise ValueError, "Address not in range."
+
+    def __repr__(self):
+        if not self.size:
+            return "%s()"%self.__class__.__name__
+        return "%s(%s, %s, step=%s, size=%s)"%(
+                    self.__class__.__name__, self[0], self[-1], self._step, self.size
+                )
+
+
+class SubnetRange(AddressRange):
+    """
+        A read-only sequence of (address, mask) tuples for the subnets of a
+        given prefix length within a network. See AddressRange.
+    """
+    def __init__(self, address, mask=None, prefix=None):
+        af, key, plen = _key(address, mask)
+        width = _FAMILIES[af][1]
+        if prefix is None:
+            prefix = width
+        if prefix < plen or prefix > width:
+            raise ValueError, "Subnet prefix must be between %s and %s."%(plen, width)
+        self._init(af, key, 1L << (width - prefix), 1L << (prefix - plen))
+        self._mask = self._klass._fromInt(key).mask(prefix)
+
+    def _item(self, num):
+        return self._klass._fromInt(num), self._mask
+
+    def __contains__(self, network):
+        af, key, plen = _key(network, None)
+        return af == self.af and plen == self._mask.prefix and \
+                    self._index(key) is not None
+
+    def index(self, network):
+        af, key, plen = _key(network, None)
+        if af == self.af and plen == self._mask.prefix:
+            i = self._index(key)
+            if i is not None:
+                return i
+        raise ValueError, "Network not in range."
+
+    def __repr__(self):
+        return "%s(%s)"%(
+                    self.__class__.__name__,
+                    ", ".join(["%s/%s"%(a, m.prefix) for a, m in self[:3]] +
+                              (self.size > 3 and ["... %s subnets"%self.size] or []))
+                )
+
+
+def _sliceIndices(s, size):
+    """
+        Resolve a slice against a sequence of the given size, returning a
+        (start, step, count) tuple. Unlike slice.indices(), this works for
+        sizes beyond sys.maxint.
+    """
+    step = s.step
+    if step is None:
+        step = 1
+    if step == 0:
+        raise ValueError, "Slice step cannot be zero."
+    if step > 0:
+        lower, upper = 0, size
+    else:
+        lower, upper = -1, size - 1
+    def clamp(i, default):
+        if i is None:
+            return default
+        if i < 0:
+            return max(i + size, lower)
+        return min(i, upper)
+    if step > 0:
+        start, stop = clamp(s.start, lower), clamp(s.stop, upper)
+        count = max((stop - start + step - 1)//step, 0)
+    else:
+        start, stop = clamp(s.start, upper), clamp(s.stop, lower)
+        count = max((start - stop - step - 1)//-step, 0)
+    return start, step, count
+
+
+def hosts(address, mask=None):
+    """
+        An AddressRange over the host addresses of a network. For IPv4
+        networks with a prefix of 30 or less, the network and broadcast
+        addresses are excluded.
+    """
+    af, key, plen = _key(address, mask)
+    width = _FAMILIES[af][1]
+    size = 1L << (width - plen)
+    if af == AF_INET and plen <= 30:
+        return AddressRange._make(af, key + 1, 1, size - 2)
+    return AddressRange._make(af, key, 1, size)
+
+
+def subnets(address, mask=None, prefix=None):
+    """
+        A SubnetRange splitting a network into subnets of the given prefix
+        length. With no prefix, the network is split into single addresses.
+    """
+    return SubnetRange(address, mask, prefix)
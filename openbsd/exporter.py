@@ -0,0 +1,383 @@
+#    Copyright (c) 2003, Nullcube Pty Ltd
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    *   Redistributions of source code must retain the above copyright notice, this
+#        list of conditions and the following disclaimer.
+#    *   Redistributions in binary form must reproduce the above copyright notice,
+#        this list of conditions and the following disclaimer in the documentation
+#        and/or other materials provided with the distribution.
+#    *   Neither the name of Nullcube nor the names of its contributors may be used to
+#        endorse or promote products derived from this software without specific
+#        prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#    ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#    (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+#    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#    (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#    SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+    Export Netstat, PF and System counters in the OpenMetrics text format
+    (which Prometheus also reads), either as a string or over HTTP:
+
+        e = Exporter(netstat.Netstat(), pf.PF(), system.System())
+        e.serve(("", 9111)).serve_forever()
+
+    Each group of counters - the interface list, a protocol block, the PF
+    status - is rendered from a template: a format string holding every
+    metric name and label set, with a placeholder for each value. Templates
+    are built on the first scrape, and again only when the set of
+    interfaces or counters changes, so that a scrape costs little more than
+    fetching the values and one string formatting operation per group.
+"""
+import operator, itertools, threading
+import BaseHTTPServer, SocketServer
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def _escape(value):
+    value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return value.replace("%", "%%")
+
+
+def _metricName(*parts):
+    name = "_".join([i for i in parts if i])
+    return "".join([(c.isalnum() or c in "_:") and c or "_" for c in name])
+
+
+def _picker(indexes):
+    """
+        Like operator.itemgetter, but always returns a tuple.
+    """
+    if not indexes:
+        return lambda x: ()
+    if len(indexes) == 1:
+        i = indexes[0]
+        return lambda x: (x[i],)
+    return operator.itemgetter(*indexes)
+
+
+def _leaves(d):
+    """
+        The shape of a nested dictionary, as a list of (key, subtree, size)
+        tuples in sorted key order. Integer values have a subtree and size
+        of None; dictionaries have their own shape as subtree, and their
+        number of keys as size. Other values are left out.
+    """
+    tree = []
+    for k in sorted(d):
+        v = d[k]
+        if isinstance(v, dict):
+            tree.append((k, _leaves(v), len(v)))
+        elif isinstance(v, (int, long)):
+            tree.append((k, None, None))
+    return tree
+
+
+def _paths(tree, path = ()):
+    for k, sub, size in tree:
+        if sub is None:
+            yield path + (k,)
+        else:
+            for i in _paths(sub, path + (k,)):
+                yield i
+
+
+def _shape(tree):
+    return tuple([(k, sub and _shape(sub), size) for k, sub, size in tree])
+
+
+def _sized(get, size):
+    """
+        Wrap a getter for a nested dictionary so that it fails if the
+        dictionary has gained or lost keys.
+    """
+    def getter(d):
+        if len(d) != size:
+            raise KeyError, "Counters changed."
+        return get(d)
+    return getter
+
+
+def _getter(tree):
+    """
+        Compile a function returning the leaf values of a nested dictionary
+        shaped like tree, in _paths order, as a tuple. It raises KeyError if
+        a nested dictionary no longer has the keys it had; the caller checks
+        the size of the top level.
+    """
+    keys = [k for k, sub, size in tree]
+    get = _picker(keys)
+    subs = [sub is not None and (sub, size) for k, sub, size in tree]
+    if not [i for i in subs if i]:
+        return get
+    if False not in subs and len(set([(_shape(i), size) for i, size in subs])) == 1:
+        # Equally shaped subtrees, as in the PF counter arrays: one getter
+        # serves them all.
+        sub = _sized(_getter(subs[0][0]), subs[0][1])
+        chain = itertools.chain.from_iterable
+        return lambda d: tuple(chain(map(sub, get(d))))
+    subs = [i and _sized(_getter(i[0]), i[1]) for i in subs]
+    def getter(d):
+        values = []
+        for v, sub in zip(get(d), subs):
+            if sub:
+                values.extend(sub(v))
+            else:
+                values.append(v)
+        return tuple(values)
+    return getter
+
+
+class _Group:
+    """
+        A set of rows - one per interface, say - and the template they are
+        rendered with. The classify function maps the path to each value in
+        a row to a (family, labels, type) tuple, where labels is a sequence
+        of (name, value) pairs, or None to leave the value out.
+
+        Rows usually share their counters, and rows with the same shape
+        share a getter. The template is rebuilt if the rows, or the keys in
+        any row's dictionaries, change.
+    """
+    def __init__(self, prefix, rowLabels, classify):
+        self.prefix, self.rowLabels, self.classify = prefix, rowLabels, classify
+        self._key = None
+        self._getters = self._sizes = None
+        self._order = _picker([])
+        self._template = ""
+
+    def _compile(self, rows):
+        getters, compiled = [], {}
+        # (family, type) -> {labels: [index into the row values]}, with
+        # series kept in order of first appearance.
+        families = {}
+        offset = 0
+        for values, d in rows:
+            tree = _leaves(d)
+            shape = _shape(tree)
+            if not shape in compiled:
+                compiled[shape] = _getter(tree)
+            getters.append(compiled[shape])
+            paths = list(_paths(tree))
+            rowLabels = zip(self.rowLabels, values)
+            for i, path in enumerate(paths):
+                c = self.classify(path)
+                if c is not None:
+                    family, labels, mtype = c
+                    series = families.setdefault((_metricName(self.prefix, family), mtype), ([], {}))
+                    labels = tuple(labels)
+                    if not labels in series[1]:
+                        series[0].append(labels)
+                        series[1][labels] = []
+                    series[1][labels].append((rowLabels, offset + i))
+            offset += len(paths)
+        order, lines = [], []
+        for (family, mtype), (labelOrder, series) in sorted(families.items()):
+            lines.append("# TYPE %s %s\n"%(family, mtype))
+            sample = mtype == "counter" and family + "_total" or family
+            for labels in labelOrder:
+                for rowLabels, i in series[labels]:
+                    order.append(i)
+                    pairs = rowLabels + list(labels)
+                    if pairs:
+                        text = ",".join(["%s=\"%s\""%(k, _escape(v)) for k, v in pairs])
+                        lines.append("%s{%s} %%d\n"%(sample, text))
+                    else:
+                        lines.append("%s %%d\n"%sample)
+        self._template = "".join(lines)
+        self._getters = getters
+        self._sizes = [len(d) for values, d in rows]
+        self._order = _picker(order)
+
+    def _values(self, counters):
+        if map(len, counters) != self._sizes:
+            return None
+        try:
+            values = [g(d) for g, d in zip(self._getters, counters)]
+        except (KeyError, TypeError):
+            return None
+        return self._order(tuple(itertools.chain.from_iterable(values)))
+
+    def render(self, rows):
+        """
+            Render rows, a list of (label values, counters) tuples.
+        """
+        if not rows:
+            return ""
+        key = [i[0] for i in rows]
+        counters = [i[1] for i in rows]
+        if key == self._key:
+            # The same rows and counters as last time: only the values
+            # change.
+            values = self._values(counters)
+            if values is not None:
+                try:
+                    return self._template%values
+                except TypeError:
+                    pass
+        self._compile(rows)
+        self._key = key
+        return self._template%self._values(counters)
+
+
+# Netstat interface fields that are levels, not counters.
+_NETSTAT_GAUGES = ("mtu", "metric", "baudrate", "link_state")
+
+def _netstatClassify(path):
+    if len(path) == 1:
+        if path[0] in _NETSTAT_GAUGES:
+            return path[0], (), "gauge"
+        return path[0], (), "counter"
+    # The ICMP histograms.
+    return path[0], [("type", "_".join(path[1:]))], "counter"
+
+
+_PF_TREES = {
+    "counters": ("reason",),
+    "limits": ("limit",),
+    "state_table": ("operation",),
+    "source_tracking_table": ("operation",),
+    "packets": ("af", "direction", "action"),
+    "bytes": ("af", "direction"),
+}
+_PF_GAUGES = ("running", "debug", "states", "src_nodes", "since")
+
+def _pfClassify(path):
+    if len(path) == 1:
+        if path[0] in _PF_GAUGES:
+            return path[0], (), "gauge"
+        return None
+    labels = _PF_TREES.get(path[0])
+    if labels is None or len(labels) != len(path) - 1:
+        return None
+    return path[0], zip(labels, path[1:]), "counter"
+
+
+def _pfInterfaceClassify(path):
+    if len(path) == 1:
+        if path[0] in ("rules", "states"):
+            return path[0], (), "gauge"
+        return None
+    if path[0] == "trafinfo" and len(path) == 5:
+        af, direction, action, unit = path[1:]
+        return unit, [("af", af), ("direction", direction), ("action", action.lower())], "counter"
+    return None
+
+
+def _cpuClassify(path):
+    return "ticks", [("mode", path[-1])], "counter"
+
+
+class Exporter:
+    """
+        Renders counters from a Netstat, a PF and a System instance, any of
+        which may be None, in the OpenMetrics text format. Metric names
+        start with prefix, e.g.:
+
+            openbsd_netstat_interface_ipackets_total{interface="em0"}
+            openbsd_netstat_tcp_sndtotal_total
+            openbsd_pf_packets_total{af="ipv4",direction="in",action="pass"}
+            openbsd_pf_interface_bytes_total{interface="em0",...}
+            openbsd_cpu_ticks_total{mode="idle"}
+
+        Blocks selects the Netstat counter blocks to export, by
+        NetstatSnapshot field name; all are exported by default.
+        PF interface counters are exported only if pfInterfaces is true.
+    """
+    def __init__(self, netstat = None, pf = None, system = None, prefix = "openbsd",
+                    blocks = None, pfInterfaces = True):
+        self.netstat, self.pf, self.system = netstat, pf, system
+        self.prefix, self.blocks, self.pfInterfaces = prefix, blocks, pfInterfaces
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def _group(self, name, rowLabels, classify):
+        g = self._groups.get(name)
+        if g is None:
+            g = self._groups[name] = _Group(_metricName(self.prefix, name), rowLabels, classify)
+        return g
+
+    def _collect(self):
+        """
+            Yield (group, rows) pairs for everything to be exported.
+        """
+        if self.netstat is not None:
+            snapshot = self.netstat.snapshot(self.blocks)
+            for block in snapshot._fields[1:]:
+                values = getattr(snapshot, block)
+                if values is None:
+                    continue
+                if block == "interfaces":
+                    g = self._group("netstat_interface", ("interface",), _netstatClassify)
+                    yield g, [((k,), v) for k, v in sorted(values.iteritems())]
+                else:
+                    yield self._group("netstat_" + block, (), _netstatClassify), [((), values)]
+        if self.pf is not None:
+            yield self._group("pf", (), _pfClassify), [((), self.pf.getStatistics())]
+            if self.pfInterfaces:
+                values = self.pf.getInterfaces()
+                g = self._group("pf_interface", ("interface",), _pfInterfaceClassify)
+                yield g, [((k,), v) for k, v in sorted(values.iteritems())]
+        if self.system is not None:
+            yield self._group("cpu", (), _cpuClassify), [((), self.system.cpustats)]
+
+    def render(self):
+        """
+            Collect the counters, and return them in the OpenMetrics text
+            format.
+        """
+        self._lock.acquire()
+        try:
+            parts = [g.render(rows) for g, rows in self._collect()]
+        finally:
+            self._lock.release()
+        parts.append("# EOF\n")
+        return "".join(parts)
+
+    def serve(self, address = ("", 9111), path = "/metrics"):
+        """
+            Return an ExporterServer for this exporter, bound to address.
+            Call its serve_forever method to start answering requests.
+        """
+        return ExporterServer(address, self, path)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != self.server.path:
+            self.send_error(404)
+            return
+        try:
+            body = self.server.exporter.render()
+        except Exception, v:
+            self.send_error(500, str(v))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ExporterServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+        A minimal HTTP server answering each scrape of path in a thread of
+        its own. Renders are serialised by the exporter.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    def __init__(self, address, exporter, path = "/metrics"):
+        self.exporter, self.path = exporter, path
+        BaseHTTPServer.HTTPServer.__init__(self, address, _Handler)
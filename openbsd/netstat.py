@@ -29,6 +29,7 @@
     directly from kernel data structures using the kernel memory interface
     (kvm(3)).
 """
+import collections, struct, operator
 import _netstat
 from _global import *
 
@@ -39,31 +40,149 @@ from _global import *
 #        - Unix domain sockets?
 #        - Unit tests probably need to be expanded.
 
+# Snapshot fields, and the _netstat counter block each is read from.
+_BLOCKS = [
+    ("interfaces", "ifstats"),
+    ("ip", "ipstats"),
+    ("ip6", "ip6stats"),
+    ("tcp", "tcpstats"),
+    ("udp", "udpstats"),
+    ("icmp", "icmpstats"),
+    ("igmp", "igmpstats"),
+    ("ah", "ahstats"),
+    ("esp", "espstats"),
+    ("ipip", "ipipstats"),
+    ("ipcomp", "ipcompstats"),
+]
+_blockNames = dict(_BLOCKS)
+
+
+class NetstatSnapshot(collections.namedtuple("NetstatSnapshot", ["time"] + [i[0] for i in _BLOCKS])):
+    """
+        An immutable record of a set of counter blocks, read together. Each
+        field holds the dictionary the corresponding Netstat method would
+        return, or None if the block was not read. The time field is a
+        monotonic clock reading in seconds, taken as the blocks were read,
+        suitable for computing rates between snapshots.
+    """
+    __slots__ = ()
+    BLOCKS = tuple([i[0] for i in _BLOCKS])
+
+
+_SIZES = {1: "B", 2: "H", 4: "I", 8: "Q"}
+_ifDataStructs = {}
+
+def _ifDataStruct(fields, byteorder):
+    """
+        Compile a Struct that decodes the named if_data fields, given as
+        (offset, size) tuples, in one call. Returns (struct, names).
+    """
+    key = (tuple(sorted(fields.items())), byteorder)
+    if not key in _ifDataStructs:
+        fmt, names, pos = [byteorder], [], 0
+        for name, (offset, size) in sorted(fields.items(), key=lambda x: x[1]):
+            if offset > pos:
+                fmt.append("%dx"%(offset - pos))
+            fmt.append(_SIZES[size])
+            names.append(name)
+            pos = offset + size
+        _ifDataStructs[key] = struct.Struct("".join(fmt)), names
+    return _ifDataStructs[key]
+
+
+def parseIfList(data, layout = None, byteorder = "="):
+    """
+        Parse a NET_RT_IFLIST sysctl buffer into the dictionary of
+        interfaces returned by Netstat.ifstats. The layout of the structures
+        in the buffer is described by layout, which defaults to the layout
+        exported by the _netstat module for this system. Pass the layout and
+        byte order of another system to parse buffers captured there.
+    """
+    if layout is None:
+        layout = _netstat.IFLIST_LAYOUT
+    ifdata, names = _ifDataStruct(layout["fields"], byteorder)
+    short = struct.Struct(byteorder + "H")
+    addrs = struct.Struct(byteorder + "i")
+    linkStates = layout["link_states"]
+    align = layout["align"]
+    version, ifinfo, ifp = layout["RTM_VERSION"], layout["RTM_IFINFO"], layout["RTA_IFP"]
+    ifaces = {}
+    offset = 0
+    while offset < len(data):
+        msglen = short.unpack_from(data, offset + layout["msglen"])[0]
+        if not msglen:
+            raise OException, "Malformed interface list."
+        if ord(data[offset + layout["version"]]) == version and \
+                ord(data[offset + layout["type"]]) == ifinfo:
+            present = addrs.unpack_from(data, offset + layout["addrs"])[0]
+            if present & ifp:
+                # The name is in the RTA_IFP sockaddr_dl. Skip any sockaddrs
+                # that precede it, each rounded up to a multiple of a long.
+                pos = offset + layout["size"]
+                bit = 1
+                while bit < ifp:
+                    if present & bit:
+                        salen = ord(data[pos]) or align
+                        pos += 1 + ((salen - 1) | (align - 1))
+                    bit <<= 1
+                nlen = ord(data[pos + layout["sdl_nlen"]])
+                name = data[pos + layout["sdl_data"]:pos + layout["sdl_data"] + nlen]
+                d = dict(zip(names, map(long, ifdata.unpack_from(data, offset + layout["data"]))))
+                try:
+                    d["link_state"] = linkStates[d["link_state"]]
+                except KeyError:
+                    raise ValueError, "Unknown interface link state."
+                ifaces[name] = d
+        offset += msglen
+    return ifaces
+
+
 class Netstat:
-    def __init__(self):
-        _netstat.initialise()
+    """
+        Network statistics. Most counters are read from kernel memory,
+        which is opened on first use. The backend argument selects how
+        ifstats gets interface counters: "kvm" walks the kernel's interface
+        list, with one read per interface, while "sysctl" fetches them all
+        in one NET_RT_IFLIST sysctl, and needs neither root nor kvm.
+    """
+    BACKENDS = ("kvm", "sysctl")
+    def __init__(self, backend = "kvm"):
+        if not backend in self.BACKENDS:
+            raise ValueError, "Unknown backend: %s"%backend
+        self.backend = backend
+        self._open = False
+        if backend == "kvm":
+            self._kvm()
+
+    def _kvm(self):
+        if not self._open:
+            _netstat.initialise()
+            self._open = True
+        return _netstat
 
     def close(self):
-        _netstat.finalise()
+        if self._open:
+            _netstat.finalise()
+            self._open = False
 
     def ahstats(self):
         """
             See <netinet/ip_ah.h>
         """
-        return _netstat.ahstats()
+        return self._kvm().ahstats()
 
     def espstats(self):
         """
             See <netinet/ip_esp.h>
         """
-        return _netstat.espstats()
+        return self._kvm().espstats()
 
 
     def icmpstats(self):
         """
             See <netinet/icmp_var.h>
         """
-        return _netstat.icmpstats()
+        return self._kvm().icmpstats()
 
     def ifstats(self):
         """
@@ -71,46 +190,217 @@ class Netstat:
             dictionaries with the following values:
                 See <net/if_var.h>
         """
-        return _netstat.ifstats()
+        if self.backend == "sysctl":
+            return parseIfList(_netstat.iflist())
+        return self._kvm().ifstats()
 
     def igmpstats(self):
         """
             See <netinet/igmp_var.h>
         """
-        return _netstat.igmpstats()
+        return self._kvm().igmpstats()
 
     def ip6stats(self):
         """
             See <netinet6/ip6_var.h>
         """
-        return _netstat.ip6stats()
+        return self._kvm().ip6stats()
 
     def ipcompstats(self):
         """
             See <netinet/ip_ipcomp.h>
         """
-        return _netstat.ipcompstats()
+        return self._kvm().ipcompstats()
 
     def ipipstats(self):
         """
             See <netinet/ip_ipip.h>
         """
-        return _netstat.ipipstats()
+        return self._kvm().ipipstats()
 
     def ipstats(self):
         """
             See <netinet/ip_var.h>
         """
-        return _netstat.ipstats()
+        return self._kvm().ipstats()
 
     def tcpstats(self):
         """
             See <netinet/tcp_var.h>
         """
-        return _netstat.tcpstats()
+        return self._kvm().tcpstats()
 
     def udpstats(self):
         """
             See <netinet/udp_var.h>
         """
-        return _netstat.udpstats()
+        return self._kvm().udpstats()
+
+    def snapshot(self, blocks = None):
+        """
+            Read a number of counter blocks in one call, and return them as
+            a NetstatSnapshot. Blocks are named by NetstatSnapshot field,
+            e.g. ["ip", "tcp", "interfaces"]. All blocks are read by default.
+        """
+        if blocks is None:
+            blocks = NetstatSnapshot.BLOCKS
+        try:
+            names = [_blockNames[i] for i in blocks]
+        except KeyError, v:
+            raise ValueError, "Unknown counter block: %s"%v
+        ifaces = None
+        if self.backend == "sysctl" and "ifstats" in names:
+            names.remove("ifstats")
+            ifaces = self.ifstats()
+        if names:
+            t, values = self._kvm().snapshot(names)
+        else:
+            t, values = _netstat.snapshot([])
+        if ifaces is not None:
+            values["ifstats"] = ifaces
+        fields = dict([(i, values.get(_blockNames[i])) for i in NetstatSnapshot.BLOCKS])
+        return NetstatSnapshot(time=t, **fields)
+
+
+class RateTracker:
+    """
+        Tracks the change in Netstat counters between successive snapshots,
+        and computes per-second rates. Interface counters are tracked per
+        interface, and protocol counters per block.
+
+        Only the previous counter values are kept - one tuple per interface
+        or block - never whole samples. A counter that goes backwards has
+        either wrapped, if the wrapped difference is less than half the
+        counter range, or been reset, in which case its delta is its new
+        value. Counters are width bits wide, which defaults to the size of
+        an unsigned long, as in the kernel's structures.
+
+        Fields in GAUGES are levels rather than counters, and are ignored.
+        Nested counter dictionaries, such as the ICMP histograms, are
+        tracked with "/"-separated names, e.g. "outhist/echoreply".
+    """
+    GAUGES = ("mtu", "metric", "baudrate", "link_state")
+    def __init__(self, netstat, blocks = ("interfaces",), width = None):
+        self.netstat, self.blocks = netstat, blocks
+        self.width = width or struct.calcsize("L")*8
+        self._modulus = 1L << self.width
+        self._time = None
+        # (block, interface) -> (names, values, getter, number of fields) for
+        # the previous snapshot.
+        self._prev = {}
+        self._names = {}
+        self.deltas = {}
+        self.elapsed = None
+        self.appeared, self.disappeared, self.changed = [], [], []
+        self.wraps = self.resets = 0
+
+    def _counters(self, d):
+        names, values = [], []
+        for k in sorted(d):
+            v = d[k]
+            if k in self.GAUGES:
+                continue
+            if isinstance(v, dict):
+                for j in sorted(v):
+                    names.append("%s/%s"%(k, j))
+                    values.append(v[j])
+            elif isinstance(v, (int, long)):
+                names.append(k)
+                values.append(v)
+        names = tuple(names)
+        # Every interface has the same counters: share one tuple of names.
+        return self._names.setdefault(names, names), tuple(values)
+
+    def _delta(self, old, new):
+        if new >= old:
+            return new - old
+        wrapped = new + self._modulus - old
+        if old < self._modulus and 0 <= wrapped < self._modulus >> 1:
+            self.wraps += 1
+            return wrapped
+        self.resets += 1
+        return new
+
+    def _update(self, key, d, prev):
+        old = self._prev.get(key)
+        getter = None
+        if old is not None and old[2] and len(d) == old[3]:
+            # The same fields as last time: fetch them in C.
+            try:
+                names, values, getter = old[0], old[2](d), old[2]
+            except KeyError:
+                getter = None
+        if getter is None:
+            names, values = self._counters(d)
+            if len(names) > 1 and not [i for i in names if "/" in i]:
+                getter = operator.itemgetter(*names)
+        prev[key] = names, values, getter, len(d)
+        if old is None or old[0] is not names:
+            return None
+        return dict(zip(names, map(self._delta, old[1], values)))
+
+    def update(self, snapshot = None):
+        """
+            Take a snapshot, or use the NetstatSnapshot given, and return
+            the deltas since the previous one. These are a dictionary of
+            block names to counter deltas, with the "interfaces" block a
+            dictionary of interface names to counter deltas. Interfaces
+            seen for the first time have no deltas, and are listed in the
+            appeared attribute; those no longer present are listed in
+            disappeared. Interfaces whose set of counters has changed also
+            have no deltas, and are listed in changed.
+        """
+        if snapshot is None:
+            snapshot = self.netstat.snapshot(self.blocks)
+        prev = {}
+        deltas = {}
+        self.appeared, self.changed = [], []
+        for block in self.blocks:
+            values = getattr(snapshot, block)
+            if block == "interfaces":
+                ifaces = {}
+                for name, d in values.iteritems():
+                    delta = self._update((block, name), d, prev)
+                    if delta is None:
+                        if (block, name) in self._prev:
+                            self.changed.append(name)
+                        else:
+                            self.appeared.append(name)
+                    else:
+                        ifaces[name] = delta
+                deltas[block] = ifaces
+            else:
+                delta = self._update((block, None), values, prev)
+                if delta is not None:
+                    deltas[block] = delta
+        self.disappeared = [i[1] for i in self._prev if i[0] == "interfaces" and not i in prev]
+        self.appeared.sort()
+        self.changed.sort()
+        self.disappeared.sort()
+        self._prev = prev
+        # Keep only the names tuples still in use.
+        self._names = dict([(i[0], i[0]) for i in prev.itervalues()])
+        if self._time is None:
+            deltas, self.elapsed = {}, None
+        else:
+            self.elapsed = snapshot.time - self._time
+        self._time = snapshot.time
+        self.deltas = deltas
+        return deltas
+
+    def rates(self):
+        """
+            Return the deltas from the last update as per-second rates.
+        """
+        if not self.elapsed or self.elapsed <= 0:
+            return {}
+        rates = {}
+        for block, d in self.deltas.iteritems():
+            if block == "interfaces":
+                rates[block] = dict([
+                    (name, dict([(k, v/self.elapsed) for k, v in c.iteritems()]))
+                    for name, c in d.iteritems()
+                ])
+            else:
+                rates[block] = dict([(k, v/self.elapsed) for k, v in d.iteritems()])
+        return rates
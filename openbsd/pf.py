@@ -24,21 +24,257 @@
 #    (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 #    SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-# TODO
-# 
-# - Various parts of the API need to be able to take multiple arguments. I.e.
-# Table.addAddress needs to become Table.addAddresses
-# - Create forward iterators to traverse the PF anchor tree
-
-import _pf, utils
+import _pf, utils, cidr
 from _sysvar import *
 from _global import *
-import socket, datetime
+import socket, datetime, time, struct, sys, array, heapq, itertools, operator, collections, errno
+
+def _networkText(spec):
+    """
+        Render one network specification as text for the address parser.
+        Dictionaries with "address" and "mask" keys, as returned by
+        Table.getAddresses(), and (address, mask) tuples are accepted, as
+        well as address objects and text.
+    """
+    if isinstance(spec, dict):
+        spec = (spec["address"], spec["mask"])
+    if isinstance(spec, tuple):
+        address, mask = spec
+        address = utils.Address(address)
+        return "%s/%s"%(address, address.mask(mask).prefix)
+    return str(spec)
+
+
+def _packAddresses(addresses):
+    if isinstance(addresses, utils.PackedAddresses):
+        return addresses
+    if utils.isStringLike(addresses):
+        addresses = [addresses]
+    return utils.PackedAddresses([_networkText(i) for i in addresses])
+
+
+def _entries(data, size):
+    """
+        Split a packed pfr_addr array into a sorted list of entries, with
+        the trailing feedback byte dropped. Tables come back from the kernel
+        in radix tree order, which is close to sorted already.
+    """
+    lst = [data[i:i+size-1] for i in xrange(0, len(data), size)]
+    lst.sort()
+    return lst
+
+
+def _pack(entries):
+    if not entries:
+        return ""
+    return "\x00".join(entries) + "\x00"
+
+
+def _delta(current, wanted, size):
+    """
+        Merge two packed pfr_addr arrays. Returns (removed, added,
+        unchanged): packed arrays of the entries only in current and only
+        in wanted, and the number of entries in both.
+    """
+    a, b = _entries(current, size), _entries(wanted, size)
+    removed, added = [], []
+    i = j = unchanged = 0
+    alen, blen = len(a), len(b)
+    while i < alen and j < blen:
+        x, y = a[i], b[j]
+        if x == y:
+            unchanged += 1
+            i += 1
+            j += 1
+        elif x < y:
+            removed.append(x)
+            i += 1
+        else:
+            added.append(y)
+            j += 1
+        # Skip repeated entries in the wanted list.
+        while j and j < blen and b[j] == b[j-1]:
+            j += 1
+    removed.extend(a[i:])
+    last = None
+    for y in b[j:]:
+        if y != last:
+            added.append(y)
+            last = y
+    return _pack(removed), _pack(added), unchanged
+
+
+class TableFeedback(object):
+    """
+        The outcome of a bulk table update. The "count" attribute holds the
+        number of addresses the kernel added or deleted, and "packed" holds
+        the submitted entries with the kernel's feedback code filled in.
+        Iterating yields a dictionary for each entry, with "address",
+        "mask", "negate" and "feedback" keys. Entries that could not be
+        parsed come last, with a feedback of "invalid" and the parser's
+        complaint under "reason".
+    """
+    _names = {
+        PFR_FB_NONE:        "none",
+        PFR_FB_MATCH:       "match",
+        PFR_FB_ADDED:       "added",
+        PFR_FB_DELETED:     "deleted",
+        PFR_FB_CHANGED:     "changed",
+        PFR_FB_CLEARED:     "cleared",
+        PFR_FB_DUPLICATE:   "duplicate",
+        PFR_FB_NOTMATCH:    "notmatch",
+        PFR_FB_CONFLICT:    "conflict",
+    }
+    def __init__(self, count, packed, errors):
+        self.count, self.packed, self.errors = count, packed, errors
+
+    def counts(self):
+        """
+            Return a dictionary mapping feedback names to the number of
+            entries that received them.
+        """
+        codes = self.packed.tostring()[self.packed.SIZE-1::self.packed.SIZE]
+        counts = {}
+        for code, name in self._names.items():
+            n = codes.count(chr(code))
+            if n:
+                counts[name] = n
+        if self.errors:
+            counts["invalid"] = len(self.errors)
+        return counts
+
+    def __len__(self):
+        return len(self.packed) + len(self.errors)
+
+    def __iter__(self):
+        for address, prefix, negate, feedback in self.packed:
+            yield {
+                "address": address,
+                "mask": address.mask(prefix),
+                "negate": negate,
+                "feedback": self._names.get(feedback, "unknown")
+            }
+        for lineno, word, reason in self.errors:
+            yield {
+                "address": word,
+                "mask": None,
+                "negate": 0,
+                "feedback": "invalid",
+                "reason": reason
+            }
+
+    def __repr__(self):
+        return "TableFeedback(%s)"%", ".join(
+                    ["%s=%s"%i for i in sorted(self.counts().items())]
+                )
+
 
 class Table(object):
+    # The maximum number of entries submitted in a single ioctl.
+    CHUNK = 65536
     def __init__(self, anchor, name, flags):
         self.anchor, self.name, self.flags = anchor, name, flags
 
+    def _bulk(self, func, addresses, dummy):
+        if _pf.PFR_ADDR_SIZE != utils.PackedAddresses.SIZE:
+            raise OException, "Kernel pfr_addr size does not match the packed layout."
+        iflags = 0
+        if dummy:
+            iflags |= PFR_FLAG_DUMMY
+        packed = _packAddresses(addresses)
+        data = packed.tostring()
+        step = self.CHUNK * packed.SIZE
+        count, out = 0, []
+        for i in range(0, len(data), step):
+            n, feedback = func(self.anchor, self.name, data[i:i+step], iflags)
+            count += n
+            out.append(feedback)
+        return TableFeedback(
+                    count, utils.PackedAddresses.fromString("".join(out)), packed.errors
+                )
+
+    def addAddresses(self, addresses, dummy = 0):
+        """
+            Add many addresses or networks to the table, with one ioctl per
+            CHUNK entries. Addresses can be a utils.PackedAddresses buffer, or
+            an iterable of anything accepted by Table.addAddress, as text
+            (optionally negated with "!"), address objects, (address, mask)
+            tuples, or dictionaries as returned by getAddresses(). Returns a
+            TableFeedback object. Duplicates are reported there rather than
+            raising.
+
+            Updates are not atomic across chunks.
+        """
+        return self._bulk(_pf.add_addresses, addresses, dummy)
+
+    def deleteAddresses(self, addresses, dummy = 0):
+        """
+            Delete many addresses or networks from the table. See
+            addAddresses.
+        """
+        return self._bulk(_pf.delete_addresses, addresses, dummy)
+
+    def getAddressesPacked(self):
+        """
+            Return the table contents as a utils.PackedAddresses buffer.
+        """
+        return utils.PackedAddresses.fromString(
+                    _pf.get_addresses_raw(self.anchor, self.name)
+                )
+
+    def replace(self, addresses, atomic = 0, dummy = 0):
+        """
+            Make the table contain exactly the given addresses, which can be
+            anything accepted by addAddresses.
+
+            By default, the current contents are read once, and the entries
+            to delete and to add are found by merging the sorted packed
+            arrays. Only that delta is applied, so unchanged entries stay in
+            the table throughout. With atomic set, the whole list is instead
+            handed to the kernel in a single DIOCRSETADDRS ioctl.
+
+            Returns a dictionary with "added", "deleted", "changed" (atomic
+            mode only), "unchanged" (delta mode only) and "invalid" counts,
+            and a "timings" dictionary of seconds spent in each phase.
+        """
+        timings = {}
+        start = time.time()
+        packed = _packAddresses(addresses)
+        timings["parse"] = time.time() - start
+        result = {"invalid": len(packed.errors), "timings": timings}
+        if atomic:
+            iflags = 0
+            if dummy:
+                iflags |= PFR_FLAG_DUMMY
+            start = time.time()
+            result["added"], result["deleted"], result["changed"] = _pf.set_addresses(
+                    self.anchor, self.name, packed.tostring(), iflags
+                )
+            timings["apply"] = time.time() - start
+            return result
+
+        start = time.time()
+        current = _pf.get_addresses_raw(self.anchor, self.name)
+        timings["read"] = time.time() - start
+
+        start = time.time()
+        removed, added, unchanged = _delta(current, packed.tostring(), packed.SIZE)
+        timings["delta"] = time.time() - start
+        result["unchanged"] = unchanged
+
+        start = time.time()
+        result["deleted"] = result["added"] = 0
+        if removed:
+            result["deleted"] = self.deleteAddresses(
+                    utils.PackedAddresses.fromString(removed), dummy
+                ).count
+        if added:
+            result["added"] = self.addAddresses(
+                    utils.PackedAddresses.fromString(added), dummy
+                ).count
+        timings["apply"] = time.time() - start
+        return result
+
     def addAddress(self, address, mask = None, dummy = 0):
         """
             Add an address or network to the table. IP and IPv6 are supported.
@@ -86,10 +322,71 @@ class Table(object):
         return "table %s: %s"%(self.name, "|".join(attrs))
     
 
-class Tables(object):
+class _CachedListing(object):
+    """
+        An opt-in cache for the listing that a container fetches from the
+        kernel. With caching enabled, the listing is fetched once and
+        reused until it is older than the time to live, until refresh() is
+        called, or until the container changes it. Subclasses implement
+        _fetch().
+    """
+    _caching = False
+    _ttl = None
+    _cached = None
+    _fetched = 0
+    hits = misses = 0
+    def enableCache(self, ttl = None):
+        """
+            Cache the listing for ttl seconds, or until the next refresh()
+            if ttl is None.
+        """
+        self._caching = True
+        self._ttl = ttl
+        self._cached = None
+
+    def disableCache(self):
+        self._caching = False
+        self._cached = None
+
+    def refresh(self):
+        """
+            Discard the cached listing, if any. It is fetched again when
+            next needed.
+        """
+        self._cached = None
+
+    def cacheStats(self):
+        """
+            Return hit and miss counts for the cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "enabled": self._caching,
+            "ttl": self._ttl
+        }
+
+    def _listing(self):
+        if not self._caching:
+            return self._fetch()
+        now = time.time()
+        if self._cached is None or \
+                (self._ttl is not None and now - self._fetched >= self._ttl):
+            self.misses += 1
+            self._cached = self._fetch()
+            self._fetched = now
+        else:
+            self.hits += 1
+        return self._cached
+
+
+class Tables(_CachedListing):
     def __init__(self, anchor):
         self.anchor = anchor
 
+    def _fetch(self):
+        return _pf.get_tables(self.anchor)
+
     def add(self, name, persist = 0, const = 0, dummy = 0):
         tflags = iflags = 0
         if persist:
@@ -98,15 +395,21 @@ class Tables(object):
             tflags |= PFR_TFLAG_CONST
         if dummy:
             iflags |= PFR_FLAG_DUMMY
-        if not _pf.add_table(name, self.anchor, tflags, iflags):
-            raise OException, "Could not add table."
+        try:
+            if not _pf.add_table(name, self.anchor, tflags, iflags):
+                raise OException, "Could not add table."
+        finally:
+            self.refresh()
 
     def delete(self, name,  dummy = 0):
         iflags = 0
         if dummy:
             iflags |= PFR_FLAG_DUMMY
-        if not _pf.delete_table(name, self.anchor, 0, iflags):
-            raise OException, "Could not delete table."
+        try:
+            if not _pf.delete_table(name, self.anchor, 0, iflags):
+                raise OException, "Could not delete table."
+        finally:
+            self.refresh()
 
     def clear(self, dummy = 0):
         """
@@ -115,23 +418,26 @@ class Tables(object):
         iflags = 0
         if dummy:
             iflags |= PFR_FLAG_DUMMY
-        return _pf.clear_tables(self.anchor, iflags)
+        try:
+            return _pf.clear_tables(self.anchor, iflags)
+        finally:
+            self.refresh()
 
     def keys(self):
-        return _pf.get_tables(self.anchor).keys()
+        return self._listing().keys()
 
     def has_key(self, key):
-        return _pf.get_tables(self.anchor).has_key(key)
+        return self._listing().has_key(key)
 
     def __getitem__(self, key):
         try:
-            t = _pf.get_tables(self.anchor)[key]
+            t = self._listing()[key]
         except KeyError:
             raise OException, "Table does not exist."
         return Table(self.anchor, key, t)
 
     def __len__(self):
-        return len(_pf.get_tables(self.anchor))
+        return len(self._listing())
 
     def __str__(self):
         return "tables %s: %s"%(self.anchor, ", ".join(self.keys()))
@@ -171,12 +477,856 @@ class State(object):
         )
 
 
-class Anchor(object):
+_STATE_LAYOUT = _pf.STATE_LAYOUT
+_ifnameStruct = struct.Struct("16s")
+
+def _stateField(fmt, offset):
+    """
+        A property that decodes a single field of a raw pfsync_state record.
+    """
+    s = struct.Struct(fmt)
+    def get(self):
+        return s.unpack_from(self._buf, self._off + offset)[0]
+    return property(get)
+
+
+class StateHost(object):
+    """
+        A lazily decoded pfsync_state_host. The address and port attributes
+        can also be read as items, as with the dictionaries in State.
+    """
+    __slots__ = ("_buf", "_off", "_af")
+    _addr = struct.Struct("16s")
+    _port = struct.Struct("!H")
+    _portoff = _STATE_LAYOUT["host_port"]
+    def __init__(self, buf, off, af):
+        self._buf, self._off, self._af = buf, off, af
+
+    def _getAddress(self):
+        raw = self._addr.unpack_from(self._buf, self._off)[0]
+        if self._af == AF_INET:
+            raw = raw[:4]
+        return utils.AddressFromBytes(raw)
+    address = property(_getAddress)
+
+    def _getPort(self):
+        return self._port.unpack_from(self._buf, self._off + self._portoff)[0]
+    port = property(_getPort)
+
+    def __getitem__(self, key):
+        if key == "address":
+            return self.address
+        elif key == "port":
+            return self.port
+        raise KeyError, key
+
+    def __repr__(self):
+        return "%s:%s"%(self.address, self.port)
+
+
+def _stateHost(offset):
+    def get(self):
+        return StateHost(self._buf, self._off + offset, self.af)
+    return property(get)
+
+
+def _statePeer(offset):
+    peer = struct.Struct("B")
+    state = offset + _STATE_LAYOUT["peer_state"]
+    wscale = offset + _STATE_LAYOUT["peer_wscale"]
+    def get(self):
+        return {
+            "state": peer.unpack_from(self._buf, self._off + state)[0],
+            "wscale": peer.unpack_from(self._buf, self._off + wscale)[0]
+        }
+    return property(get)
+
+
+def _stateCounters(offset):
+    # Counters are pairs of big-endian 32-bit words, high word first.
+    s = struct.Struct("!IIII")
+    def get(self):
+        hi0, lo0, hi1, lo1 = s.unpack_from(self._buf, self._off + offset)
+        return {
+            "out": (hi0 << 32) | lo0,
+            "in": (hi1 << 32) | lo1
+        }
+    return property(get)
+
+
+class StateRecord(object):
+    """
+        A view of one pfsync_state record in a raw state table buffer. The
+        record is decoded a field at a time, when each attribute is read,
+        using the layout exported by the _pf module. Attributes match those
+        of State.
+    """
+    __slots__ = ("_buf", "_off")
+    _protos = State._protos
+    def __init__(self, buf, off):
+        self._buf, self._off = buf, off
+
+    id = _stateField("!Q", _STATE_LAYOUT["id"])
+    creatorid = _stateField("!I", _STATE_LAYOUT["creatorid"])
+    rule = _stateField("!I", _STATE_LAYOUT["rule"])
+    creation = _stateField("!I", _STATE_LAYOUT["creation"])
+    expire = _stateField("!I", _STATE_LAYOUT["expire"])
+    af = _stateField("B", _STATE_LAYOUT["af"])
+    proto = _stateField("B", _STATE_LAYOUT["proto"])
+    direction = _stateField("B", _STATE_LAYOUT["direction"])
+    log = _stateField("B", _STATE_LAYOUT["log"])
+    timeout = _stateField("B", _STATE_LAYOUT["timeout"])
+    sync_flags = _stateField("B", _STATE_LAYOUT["sync_flags"])
+    updates = _stateField("B", _STATE_LAYOUT["updates"])
+    lan = _stateHost(_STATE_LAYOUT["lan"])
+    gwy = _stateHost(_STATE_LAYOUT["gwy"])
+    ext = _stateHost(_STATE_LAYOUT["ext"])
+    src = _statePeer(_STATE_LAYOUT["src"])
+    dst = _statePeer(_STATE_LAYOUT["dst"])
+    packets = _stateCounters(_STATE_LAYOUT["packets"])
+    bytes = _stateCounters(_STATE_LAYOUT["bytes"])
+
+    def _getIfname(self):
+        return _ifnameStruct.unpack_from(
+                    self._buf, self._off + _STATE_LAYOUT["ifname"]
+                )[0].split("\x00", 1)[0]
+    ifname = property(_getIfname)
+
+    def __repr__(self):
+        return "%s %s %s -> %s -> %s"%(
+            self.ifname,
+            self._protos.get(self.proto, "unknown"),
+            self.lan, self.gwy, self.ext
+        )
+
+class StateBuffer(object):
+    """
+        The state table as returned by the kernel: a packed array of
+        pfsync_state records, exposed through a memoryview in the "view"
+        attribute. Indexing and iteration yield StateRecord views into the
+        buffer; nothing is decoded until a record's attributes are read.
+    """
+    def __init__(self, data):
+        self.size = _STATE_LAYOUT["size"]
+        if len(data) % self.size:
+            raise OException, "State buffer is not a multiple of the record size."
+        self.data = data
+        self.view = memoryview(data)
+
+    def __len__(self):
+        return len(self.data)/self.size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError, "State index out of range."
+        return StateRecord(self.view, i*self.size)
+
+    def __iter__(self):
+        view = self.view
+        for off in xrange(0, len(self.data), self.size):
+            yield StateRecord(view, off)
+
+
+# Array typecodes for unsigned integers of each width, on this platform.
+_UNSIGNED = {}
+for _code in "LIHB":
+    _UNSIGNED[array.array(_code).itemsize] = _code
+del _code
+_SWAP = sys.byteorder == "little"
+# Records per pass when splitting a state table into columns.
+_COLUMN_CHUNK = 4096
+
+def _splitColumns(data, size, fields):
+    """
+        Split a buffer of fixed-size big-endian records into columns, with
+        no Python-level loop over the records. Each field is read as one or
+        more words of the widest unit its offset allows: every chunk of
+        records is viewed as an array of that unit, and the field's words
+        are taken from it with one strided slice each. Words are combined
+        back into a single integer per record at the end.
+
+        fields  - A list of (name, offset, width, swap) tuples. Fields with
+                  swap set are converted to native byte order; others are
+                  left as found, and returned as a list of word arrays
+                  rather than combined.
+
+        Returns a dictionary mapping names to arrays.
+    """
+    count = len(data)/size
+    plan = []
+    for name, offset, width, swap in fields:
+        for unit in (8, 4, 2, 1):
+            if unit in _UNSIGNED and not (offset % unit or width % unit or size % unit):
+                break
+        words = [array.array(_UNSIGNED[unit], [0])*count for i in range(width/unit)]
+        plan.append((name, offset, width, swap, unit, words))
+    units = set([i[4] for i in plan])
+    step = _COLUMN_CHUNK*size
+    for start in xrange(0, len(data), step):
+        chunk = data[start:start + step]
+        first, last = start/size, start/size + len(chunk)/size
+        views = {}
+        for unit in units:
+            if unit == 1:
+                views[unit] = chunk
+            else:
+                views[unit] = array.array(_UNSIGNED[unit], chunk)
+        for name, offset, width, swap, unit, words in plan:
+            view = views[unit]
+            for i, w in enumerate(words):
+                part = view[(offset + i*unit)/unit::size/unit]
+                if unit == 1:
+                    part = array.array(_UNSIGNED[1], part)
+                w[first:last] = part
+    columns = {}
+    for name, offset, width, swap, unit, words in plan:
+        if not swap:
+            columns[name] = words
+            continue
+        if unit > 1 and _SWAP:
+            for w in words:
+                w.byteswap()
+        if len(words) == 1:
+            columns[name] = words[0]
+            continue
+        if width not in _UNSIGNED:
+            # No integer array type this wide on this platform: fall back to
+            # a list of longs.
+            shift = words[0].itemsize*8
+            col = [0L]*len(words[0])
+            for w in words:
+                col = map(lambda a, b: (a << shift) | b, col, w)
+            columns[name] = col
+            continue
+        # Interleave the words, least significant first on little-endian
+        # machines, and reinterpret the result as wider integers.
+        if _SWAP:
+            words.reverse()
+        out = array.array(words[0].typecode, words[0])*len(words)
+        for i, w in enumerate(words):
+            out[i::len(words)] = w
+        columns[name] = array.array(_UNSIGNED[width], out.tostring())
+    return columns
+
+
+def _recordStrings(data, size, ranges):
+    """
+        Return a list with one string for each record in data: the bytes of
+        the given (offset, width) ranges of the record, concatenated.
+    """
+    cols = _splitColumns(
+                data, size, [(i, r[0], r[1], False) for i, r in enumerate(ranges)]
+            )
+    unit = min([cols[i][0].itemsize for i in range(len(ranges))])
+    words = []
+    for i in range(len(ranges)):
+        for w in cols[i]:
+            if w.itemsize == unit:
+                words.append(w)
+            else:
+                # Re-view wider words as several words of the common unit.
+                v = array.array(_UNSIGNED[unit], w.tostring())
+                k = w.itemsize/unit
+                words.extend([v[j::k] for j in range(k)])
+    out = array.array(_UNSIGNED[unit], [0])*(len(words)*(len(data)/size))
+    for i, w in enumerate(words):
+        out[i::len(words)] = w
+    out = out.tostring()
+    n = len(words)*unit
+    return map(out.__getslice__, xrange(0, len(out), n), xrange(n, len(out) + n, n))
+
+
+def _like(column, values):
+    """
+        Build a column of the same kind as column from values.
+    """
+    if isinstance(column, array.array):
+        return array.array(column.typecode, values)
+    return list(values)
+
+
+class ColumnExport(object):
+    """
+        Exposes one snapshot column through the NumPy array interface, so
+        that numpy.asarray(snapshot.export("bytes_in")) wraps the column's
+        memory without copying it. The column itself is an array.array, and
+        so is also available through the buffer protocol. On platforms
+        without a 64-bit array type, 64-bit columns are lists, and can't be
+        exported.
+    """
+    def __init__(self, column):
+        if not isinstance(column, array.array):
+            raise OException, "Column has no fixed-width form on this platform."
+        self.column = column
+        self.__array_interface__ = {
+            "shape": (len(column),),
+            "typestr": "%su%d"%(_SWAP and "<" or ">", column.itemsize),
+            "data": (column.buffer_info()[0], False),
+            "version": 3
+        }
+
+
+class StateSnapshot(object):
+    """
+        The state table as columns: one array.array per field, indexed by
+        state. This is intended for accounting over the whole table - group
+        by interface or protocol, top talkers and the like - where decoding
+        each state individually would dominate.
+
+        Columns:
+            id, creatorid, rule, creation, expire, af, proto, direction,
+            log, timeout, ifname, packets_out, packets_in, bytes_out,
+            bytes_in, and for each of lan, gwy and ext: <host>_hi,
+            <host>_lo (the address as two 64-bit integers) and <host>_port.
+
+        Addresses are stored as in pfsync_state: an IPv4 address occupies
+        the top 32 bits of the _hi column. The ifname column holds indexes
+        into the ifnames list. The derived "packets" and "bytes" columns,
+        the sum of both directions, are computed on first use.
+    """
+    _HOSTS = ("lan", "gwy", "ext")
+    # Key sets with at most this many distinct values are summed with one
+    # C-level pass over the columns per key, rather than a Python loop.
+    PASSES = 8
+    def __init__(self, data):
+        if isinstance(data, StateBuffer):
+            data = data.data
+        self.size = _STATE_LAYOUT["size"]
+        if len(data) % self.size:
+            raise OException, "State buffer is not a multiple of the record size."
+        self.data = data
+        fields = [
+            ("id", "id", 8), ("creatorid", "creatorid", 4), ("rule", "rule", 4),
+            ("creation", "creation", 4), ("expire", "expire", 4),
+            ("af", "af", 1), ("proto", "proto", 1), ("direction", "direction", 1),
+            ("log", "log", 1), ("timeout", "timeout", 1),
+        ]
+        for name in ("packets", "bytes"):
+            fields.append((name + "_out", name, 8))
+            fields.append((name + "_in", (name, 8), 8))
+        for name in self._HOSTS:
+            fields.append((name + "_hi", name, 8))
+            fields.append((name + "_lo", (name, 8), 8))
+            fields.append((name + "_port", (name, _STATE_LAYOUT["host_port"]), 2))
+        spec = [("ifname", _STATE_LAYOUT["ifname"], 16, False)]
+        for name, field, width in fields:
+            if isinstance(field, tuple):
+                offset = _STATE_LAYOUT[field[0]] + field[1]
+            else:
+                offset = _STATE_LAYOUT[field]
+            spec.append((name, offset, width, True))
+        self.columns = _splitColumns(data, self.size, spec)
+        # Interface names are interned: the column holds an index into
+        # self.ifnames. Most names fit in the first word, so words that are
+        # zero throughout are left out of the key.
+        words = self.columns["ifname"]
+        code = words[0].typecode
+        live = [
+            i for i, w in enumerate(words)
+                if w.tostring().count("\x00") != len(w)*w.itemsize
+        ] or [0]
+        if len(live) == 1:
+            keys = lambda: iter(words[live[0]])
+        else:
+            keys = lambda: itertools.izip(*[words[i] for i in live])
+        names = []
+        for k in set(keys()):
+            raw = array.array(code, [0])*len(words)
+            if len(live) == 1:
+                raw[live[0]] = k
+            else:
+                for i, v in zip(live, k):
+                    raw[i] = v
+            names.append((raw.tostring().split("\x00", 1)[0], k))
+        names.sort()
+        ids = dict([(n[1], i) for i, n in enumerate(names)])
+        self.ifnames = [i[0] for i in names]
+        if len(names) > 256:
+            code = _UNSIGNED[2]
+        else:
+            code = _UNSIGNED[1]
+        self.columns["ifname"] = array.array(code, map(ids.__getitem__, keys()))
+
+    def __len__(self):
+        return len(self.data)/self.size
+
+    def column(self, name):
+        """
+            Return the named column.
+        """
+        if name not in self.columns and name in ("packets", "bytes"):
+            a, b = self.columns[name + "_out"], self.columns[name + "_in"]
+            self.columns[name] = _like(a, itertools.imap(operator.add, a, b))
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise KeyError, "No such column: %s"%name
+
+    def export(self, name):
+        """
+            Return the named column wrapped in a ColumnExport.
+        """
+        return ColumnExport(self.column(name))
+
+    def record(self, i):
+        """
+            Return a StateRecord view of state i.
+        """
+        return StateBuffer(self.data)[i]
+
+    def _address(self, af, hi, lo):
+        if af == AF_INET:
+            return utils.IPAddress.fromInt(hi >> 32)
+        return utils.IP6Address.fromInt((long(hi) << 64) | lo)
+
+    def _ifname(self, i):
+        return self.ifnames[i]
+
+    def _keys(self, keys):
+        """
+            Expand a key specification into a list of columns, and a list of
+            (width, decoder) pairs describing how to turn the values of the
+            columns back into a key.
+        """
+        if isinstance(keys, basestring):
+            keys = (keys,)
+        cols, decoders = [], []
+        for k in keys:
+            if k in self._HOSTS:
+                cols.extend([self.columns["af"], self.columns[k + "_hi"], self.columns[k + "_lo"]])
+                decoders.append((3, self._address))
+            elif k == "ifname":
+                cols.append(self.columns[k])
+                decoders.append((1, self._ifname))
+            else:
+                cols.append(self.column(k))
+                decoders.append((1, None))
+        return cols, decoders
+
+    def _decode(self, raw, decoders):
+        if not isinstance(raw, tuple):
+            raw = (raw,)
+        key, pos = [], 0
+        for width, f in decoders:
+            if f:
+                key.append(f(*raw[pos:pos + width]))
+            else:
+                key.append(raw[pos])
+            pos += width
+        if len(key) == 1:
+            return key[0]
+        return tuple(key)
+
+    def groupBy(self, keys, value = None):
+        """
+            Group states by one or more columns, and return a dictionary
+            mapping each key to the sum of the value column over its states,
+            or to the number of states if value is None.
+
+            keys    - A column name or a tuple of them. The names "lan", "gwy"
+                      and "ext" group by address, yielding Address objects;
+                      "ifname" yields interface names.
+        """
+        sums, decoders = self._group(keys, value)
+        return dict([(self._decode(k, decoders), v) for k, v in sums.iteritems()])
+
+    def _group(self, keys, value):
+        cols, decoders = self._keys(keys)
+        if len(cols) == 1:
+            keyiter = lambda: iter(cols[0])
+        else:
+            keyiter = lambda: itertools.izip(*cols)
+        values = None
+        if value:
+            values = self.column(value)
+        if len(cols) == 1 and cols[0].itemsize == 1:
+            # Single byte keys: counts and selection masks come from string
+            # operations on the raw column.
+            raw = cols[0].tostring()
+            distinct = [ord(i) for i in set(raw)]
+        else:
+            raw = None
+            distinct = set(keyiter())
+        if raw is not None and values is None:
+            sums = dict([(k, raw.count(chr(k))) for k in distinct])
+        elif raw is not None and len(distinct) <= self.PASSES:
+            sums = {}
+            for k in distinct:
+                mask = raw.translate("\x00"*k + "\x01" + "\x00"*(255 - k))
+                sums[k] = sum(itertools.compress(values, bytearray(mask)))
+        elif len(distinct) <= self.PASSES:
+            sums = {}
+            for k in distinct:
+                match = itertools.imap(operator.eq, keyiter(), itertools.repeat(k))
+                if values is None:
+                    sums[k] = sum(match)
+                else:
+                    sums[k] = sum(itertools.compress(values, match))
+        else:
+            sums = dict.fromkeys(distinct, 0)
+            if values is None:
+                for k in keyiter():
+                    sums[k] += 1
+            else:
+                for k, v in itertools.izip(keyiter(), values):
+                    sums[k] += v
+        return sums, decoders
+
+    def top(self, n, value, keys = None):
+        """
+            Return the n largest entries of the value column, largest first.
+            Without keys, this is a list of (state index, value) tuples;
+            with keys, the value is first summed with groupBy and the list
+            holds (key, total) tuples.
+        """
+        if keys is not None:
+            sums, decoders = self._group(keys, value)
+            return [
+                (self._decode(k, decoders), v)
+                    for k, v in heapq.nlargest(n, sums.iteritems(), operator.itemgetter(1))
+            ]
+        col = self.column(value)
+        if not n or not len(col):
+            return []
+        # Find the n largest values, then the states that hold them, so the
+        # only pass over the whole column with a key function is avoided.
+        least = heapq.nlargest(n, col)[-1]
+        found = itertools.compress(
+                    xrange(len(col)), itertools.imap(operator.ge, col, itertools.repeat(least))
+                )
+        return [(i, col[i]) for i in heapq.nlargest(n, found, col.__getitem__)]
+
+    def argsort(self, value, reverse = False):
+        """
+            Return the list of state indexes, ordered by the value column.
+        """
+        col = self.column(value)
+        return sorted(xrange(len(col)), key=col.__getitem__, reverse=reverse)
+
+    def take(self, name, indexes):
+        """
+            Return a new array holding the named column's values at the
+            given indexes, e.g. in the order returned by argsort.
+        """
+        col = self.column(name)
+        return _like(col, map(col.__getitem__, indexes))
+
+
+def _counterDict(counters):
+    """
+        Turn a (packets out, packets in, bytes out, bytes in) tuple into the
+        dictionaries used by StateRecord.
+    """
+    return {
+        "packets": {"out": counters[0], "in": counters[1]},
+        "bytes": {"out": counters[2], "in": counters[3]}
+    }
+
+
+class StateChanges(object):
+    """
+        The difference between two polls of the state table, as returned by
+        StateDiffer.update().
+
+        new     - StateRecords for the states that have appeared.
+        updated - (StateRecord, delta) tuples for the states whose counters
+                  have moved. The delta has "packets" and "bytes" entries,
+                  each a dictionary with "out" and "in" keys.
+        expired - A dictionary mapping the (creatorid, id) keys of states
+                  that have gone to their counters as last seen, in the
+                  same form as a delta.
+    """
+    def __init__(self, new, updated, expired):
+        self.new, self.updated, self.expired = new, updated, expired
+
+    def __len__(self):
+        return len(self.new) + len(self.updated) + len(self.expired)
+
+    def __repr__(self):
+        return "<StateChanges: %s new, %s updated, %s expired>"%(
+            len(self.new), len(self.updated), len(self.expired)
+        )
+
+
+class StateDiffer(object):
+    """
+        Follows the state table from poll to poll, and reports only what has
+        changed. States are keyed by (creatorid, id). Between polls, each
+        state is held as a short string of its key and four counters.
+
+            d = StateDiffer()
+            while 1:
+                changes = d.update(pf.getStatesRaw())
+                ...
+    """
+    _RANGES = [
+        (_STATE_LAYOUT["creatorid"], 4),
+        (_STATE_LAYOUT["id"], 8),
+        (_STATE_LAYOUT["packets"], 16),
+        (_STATE_LAYOUT["bytes"], 16),
+    ]
+    _key = struct.Struct("!IQ")
+    _counters = struct.Struct("!12x4Q")
+    def __init__(self):
+        self._states = set()
+
+    def __len__(self):
+        return len(self._states)
+
+    def _delta(self, old, new):
+        delta = []
+        for a, b in zip(self._counters.unpack(old), self._counters.unpack(new)):
+            if b >= a:
+                delta.append(b - a)
+            else:
+                delta.append(b)
+        return _counterDict(delta)
+
+    def update(self, data):
+        """
+            Take a new poll of the state table - a StateBuffer or the raw
+            string from _pf.get_states_raw() - and return a StateChanges
+            describing how it differs from the last one. The first poll
+            reports every state as new.
+
+            A counter that has gone backwards is taken to belong to a new
+            state that reused the key, and its delta is its whole value.
+        """
+        if not isinstance(data, StateBuffer):
+            data = StateBuffer(data)
+        states = _recordStrings(data.data, data.size, self._RANGES)
+        current = set(states)
+        # The set operations compare whole records in C. Everything after
+        # them is proportional to the number of states that changed.
+        appeared = current - self._states
+        gone = {}
+        if appeared or len(current) != len(self._states):
+            for i in self._states - current:
+                gone[i[:12]] = i
+        new, updated = [], []
+        found = []
+        if appeared:
+            found = itertools.compress(
+                        itertools.count(), itertools.imap(appeared.__contains__, states)
+                    )
+        for i in found:
+            old = gone.pop(states[i][:12], None)
+            if old is None:
+                new.append(data[i])
+            else:
+                updated.append((data[i], self._delta(old, states[i])))
+        expired = {}
+        for k, v in gone.iteritems():
+            expired[self._key.unpack(k)] = _counterDict(self._counters.unpack(v))
+        self._states = current
+        return StateChanges(new, updated, expired)
+
+
+class _StateFilter(object):
+    """
+        A filter on interface, protocol, and source and destination address
+        and port. Source and destination are matched as DIOCKILLSTATES
+        matches them: the source of an outbound state is its lan host, and
+        that of an inbound state is its ext host.
+    """
+    _RANGES = [(_STATE_LAYOUT["lan"], 18), (_STATE_LAYOUT["ext"], 18)]
+    def __init__(self, interface, proto, src, dst, srcport, dstport):
+        self.interface, self.proto = interface, proto
+        self.ends = []
+        # Byte strings that a matching record's lan and ext hosts must
+        # contain between them, longest and so most selective first.
+        self.needles = []
+        for address, port in ((src, srcport), (dst, dstport)):
+            if address is not None:
+                address = utils.Address(address)
+                self.needles.append(address.bytes)
+            if port:
+                self.needles.append(struct.pack("!H", port))
+            self.ends.append((address, port))
+        self.needles.sort(key=len, reverse=True)
+
+    def key(self):
+        return (self.interface, self.proto, tuple(self.ends))
+
+    def match(self, rec):
+        if self.proto is not None and rec.proto != self.proto:
+            return False
+        if self.interface is not None and rec.ifname != self.interface:
+            return False
+        if rec.direction == PFDIR_OUT:
+            hosts = (rec.lan, rec.ext)
+        else:
+            hosts = (rec.ext, rec.lan)
+        for host, (address, port) in zip(hosts, self.ends):
+            if address is not None and host.address != address:
+                return False
+            if port and host.port != port:
+                return False
+        return True
+
+    def scan(self, buf, limit = None):
+        """
+            Return the StateRecords in a StateBuffer that match, in table
+            order. When addresses or ports are given, records are first
+            screened in C for the bytes they must contain, so that only
+            likely matches are decoded.
+        """
+        if self.needles:
+            hosts = _recordStrings(buf.data, buf.size, self._RANGES)
+            candidates = itertools.compress(
+                            itertools.count(),
+                            itertools.imap(
+                                operator.contains, hosts, itertools.repeat(self.needles[0])
+                            )
+                        )
+        else:
+            candidates = xrange(len(buf))
+        found = []
+        for i in candidates:
+            rec = buf[i]
+            if self.match(rec):
+                found.append(rec)
+                if limit and len(found) >= limit:
+                    break
+        return found
+
+
+# A state kill filter, packed as kill_states_batch expects it.
+_killRecord = struct.Struct("!B16s16s16s16s16sHH")
+_WIDTHS = {AF_INET: 32, AF_INET6: 128}
+# Address packing functions, and mask bytes by prefix length, for each
+# address family.
+_KILL_FAMILIES = {
+    AF_INET: (utils.IPAddress._pack, [utils.IPMask(i).bytes for i in range(33)]),
+    AF_INET6: (utils.IP6Address._pack, [utils.IP6Mask(i).bytes for i in range(129)]),
+}
+
+def _killFilter(f):
+    """
+        Normalise a state kill filter, given either as a dictionary of
+        PF.killStates keyword arguments, or as a (src, srcmask, dst, dstmask,
+        ports, interface) tuple where ports is a (srcport, dstport) tuple or
+        None. Returns an (af, interface, srcport, dstport, src, dst) tuple,
+        where src and dst are (integer network, prefix length) tuples, and a
+        missing address is the zero-length network.
+    """
+    if isinstance(f, dict):
+        interface = f.get("interface")
+        src, srcmask = f.get("src"), f.get("srcmask")
+        dst, dstmask = f.get("dst"), f.get("dstmask")
+        srcport, dstport = f.get("srcport", 0), f.get("dstport", 0)
+    else:
+        src, srcmask, dst, dstmask, ports, interface = f
+        srcport, dstport = ports or (0, 0)
+    if interface and len(interface) >= 16:
+        raise ValueError, "Interface name too long: %s"%interface
+    af = 0
+    nets = []
+    for address, mask in ((src, srcmask), (dst, dstmask)):
+        if address is None:
+            nets.append(None)
+            continue
+        if mask is None and not (utils.isStringLike(address) and "/" in address):
+            a = utils.Address(address)
+            if not a.af in _WIDTHS:
+                raise ValueError, "Not an IP or IPv6 address."
+            prefix = a.WIDTH
+        else:
+            a, m = cidr.parseNetwork(address, mask)
+            prefix = m.prefix
+        if af and a.af != af:
+            raise ValueError, "All addresses must be of same type."
+        af = a.af
+        nets.append((a._int, prefix))
+    src, dst = [i or (0L, 0) for i in nets]
+    return af, interface or "", srcport or 0, dstport or 0, src, dst
+
+
+def _packKillFilter(f):
+    af, interface, srcport, dstport, src, dst = f
+    if not af:
+        return _killRecord.pack(0, interface, "", "", "", "", srcport, dstport)
+    pack, masks = _KILL_FAMILIES[af]
+    return _killRecord.pack(
+                af, interface,
+                pack(src[0]), masks[src[1]], pack(dst[0]), masks[dst[1]],
+                srcport, dstport
+            )
+
+
+def _coalesceKills(filters):
+    """
+        Takes a list of normalised kill filters, and returns the indexes of
+        those not made redundant by another filter, in order. A filter is
+        redundant if another one matches every state it matches: a
+        duplicate, a host inside a network being killed, or a filter with
+        an interface or port where another has none.
+    """
+    def specificity(i):
+        af, interface, srcport, dstport, src, dst = filters[i]
+        return (bool(af) + bool(interface) + bool(srcport) + bool(dstport)
+                    + src[1] + dst[1])
+    # Any filter that covers another is less specific than it, so visiting
+    # the least specific first means coverers are always seen first.
+    order = sorted(range(len(filters)), key=specificity)
+    kept = {}
+    keep = []
+    for i in order:
+        af, interface, srcport, dstport, src, dst = filters[i]
+        width = _WIDTHS.get(af, 0)
+        covered = False
+        for (kaf, kinterface, ksrcport, kdstport), prefixes in kept.iteritems():
+            if (kaf and kaf != af) or (kinterface and kinterface != interface):
+                continue
+            if (ksrcport and ksrcport != srcport) or (kdstport and kdstport != dstport):
+                continue
+            for (sp, dp), nets in prefixes.iteritems():
+                if sp > src[1] or dp > dst[1]:
+                    continue
+                smask = ~((1L << (width - sp)) - 1)
+                dmask = ~((1L << (width - dp)) - 1)
+                if (src[0] & smask, dst[0] & dmask) in nets:
+                    covered = True
+                    break
+            if covered:
+                break
+        if not covered:
+            key = (af, interface, srcport, dstport)
+            kept.setdefault(key, {}).setdefault((src[1], dst[1]), set()).add((src[0], dst[0]))
+            keep.append(i)
+    keep.sort()
+    return keep
+
+
+class StateKillError(OException):
+    """
+        Raised by PF.killStatesBatch when the kernel rejects a filter. The
+        filters issued before it have taken effect: index is the position
+        of the failed filter in the list passed, and counts and total are
+        as killStatesBatch would have returned for the filters before it.
+        errno and strerror describe the failure.
+    """
+    def __init__(self, errno, strerror, index, counts):
+        OException.__init__(self, errno, strerror, index, counts)
+        self.errno, self.strerror = errno, strerror
+        self.index, self.counts = index, counts
+        self.total = sum(counts)
+
+    def __str__(self):
+        return "[Errno %s] %s (filter %d)"%(self.errno, self.strerror, self.index)
+
+
+class Anchor(_CachedListing):
     def __init__(self, pf, name = ""):
         self.pf = pf
         self.name = name
         self.tables = Tables(name)
 
+    def _fetch(self):
+        return _pf.get_anchors(self.name)
+
     def __repr__(self):
         return "Anchor(%s)"%self.name
 
@@ -189,17 +1339,70 @@ class Anchor(object):
         return Anchor(self.pf, n)
 
     def __len__(self):
-        return len(_pf.get_anchors(self.name))
+        return len(self._listing())
 
     def keys(self):
-        return _pf.get_anchors(self.name)
+        return list(self._listing())
 
     def has_key(self, key):
-        return (key in _pf.get_anchors(self.name))
+        return (key in self._listing())
 
     def items(self):
         return [Anchor(self.pf, i) for i in self.keys()]
 
+    def _children(self):
+        return itertools.imap(self.__getitem__, self.keys())
+
+    def _walkItems(self, anchors, tables):
+        """
+            Yield the anchors from an iterator, or (anchor, tables) tuples
+            if tables is set. The tables of every anchor are fetched with a
+            single call, and grouped by anchor.
+        """
+        if not tables:
+            for a in anchors:
+                yield a
+            return
+        grouped = {}
+        for anchor, name, flags in _pf.get_all_tables():
+            grouped.setdefault(anchor, {})[name] = Table(anchor, name, flags)
+        for a in anchors:
+            yield a, grouped.get(a.name, {})
+
+    def depthFirst(self, tables = False):
+        """
+            Iterate over this anchor and all anchors below it, depth first.
+            Only the path to the current anchor, and the pending siblings
+            along it, are held in memory.
+
+            If tables is set, yield (anchor, tables) tuples, where tables is
+            a dictionary mapping table names to Table objects.
+        """
+        def walk():
+            stack = [iter([self])]
+            while stack:
+                for a in stack[-1]:
+                    yield a
+                    stack.append(a._children())
+                    break
+                else:
+                    stack.pop()
+        return self._walkItems(walk(), tables)
+
+    def breadthFirst(self, tables = False):
+        """
+            Iterate over this anchor and all anchors below it, breadth first.
+            This holds a whole level of the tree at a time. Arguments are as
+            for depthFirst.
+        """
+        def walk():
+            queue = collections.deque([self])
+            while queue:
+                a = queue.popleft()
+                yield a
+                queue.extend(a._children())
+        return self._walkItems(walk(), tables)
+
 
 def _dirmaker(dct, value, *args):
     s = dct
@@ -226,25 +1429,236 @@ def _flatTreeWalker(*labels):
             return
 
 
+# Paths generated by _flatTreeWalker, keyed by label specification.
+_treePaths = {}
+
 def _makeTree(values, *labels):
     """
         Take a multi-dimensional array "flattened" by a depth-first traversal,
         and a multi-dimensional table specification in the form of a list of
         labels.  Generate a matching nested dictionary structure.
     """
+    key = tuple([tuple(i) for i in labels])
+    paths = _treePaths.get(key)
+    if paths is None:
+        paths = _treePaths[key] = list(_flatTreeWalker(*labels))
     dct = {}
-    for i, labs in enumerate(_flatTreeWalker(*labels)):
+    for i, labs in enumerate(paths):
         _dirmaker(dct, values[i], *labs)
     return dct
             
     
+# Label specifications for the flattened counter arrays returned by _pf.
+_IFACE_LABELS = (
+    ["ipv4", "ipv6"],
+    ["in", "out"],
+    ["pass", "blocK"],
+    ["packets", "bytes"]
+)
+_PACKET_LABELS = (
+    ["ipv4", "ipv6"],
+    ["in", "out"],
+    ["pass", "block", "unknown"],
+)
+_BYTE_LABELS = (
+    ["ipv4", "ipv6"],
+    ["in", "out"],
+)
+
+
+class StatsSampler(object):
+    """
+        Samples the PF status counters, and optionally the per-interface
+        counters, at a fixed interval, keeping the last size samples in a
+        ring. Rates, deltas and moving averages are computed over the ring.
+
+        Each sample is stored as a flat list of values. The mapping from
+        the dictionaries returned by _pf to positions in the list is worked
+        out once, and redone only if the set of interfaces changes - at
+        which point the ring is cleared, as old samples can't be compared
+        with new ones.
+
+        Counters are named by their paths, e.g. "counters/match",
+        "packets/ipv4/in/pass" or "interfaces/em0/ipv6/out/block/bytes".
+        The values named in GAUGES are levels rather than counters, and are
+        reported by values() only.
+
+        A counter that goes backwards has been reset - by clearStatistics,
+        for instance - and its delta is taken to be its new value. A change
+        in the "since" timestamp means PF was restarted, and resets every
+        counter. The number of resets seen is kept in the resets attribute.
+    """
+    GAUGES = ("states", "src_nodes")
+    _SECTIONS = ("counters", "limits", "state_table", "source_tracking_table")
+    def __init__(self, interval = 1.0, size = 60, interfaces = True):
+        self.interval, self.size, self.interfaces = interval, size, interfaces
+        self.names = []
+        self.resets = 0
+        self._ifkey = None
+        self._ring = [None]*size
+        self._count = 0
+
+    def _compile(self, stats, ifnames):
+        """
+            Work out the names and order of the values in a sample.
+        """
+        names = list(self.GAUGES)
+        getters = [operator.itemgetter(*self.GAUGES)]
+        for section in self._SECTIONS:
+            keys = sorted(stats[section])
+            names.extend(["%s/%s"%(section, k) for k in keys])
+            if keys:
+                getters.append((section, operator.itemgetter(*keys)))
+        for section, labels in (("packets", _PACKET_LABELS), ("bytes", _BYTE_LABELS)):
+            names.extend(["/".join([section] + i) for i in _flatTreeWalker(*labels)])
+        # _IFACE_LABELS spells "block" as getInterfaces always has.
+        ifpaths = ["/".join(i).lower() for i in _flatTreeWalker(*_IFACE_LABELS)]
+        for i in ifnames:
+            names.extend(["interfaces/%s/%s"%(i, j) for j in ifpaths])
+        self.names = names
+        self._getters = getters
+        self._ifnames = ifnames
+        self._ring = [None]*self.size
+        self._count = 0
+
+    def _flatten(self, stats, ifaces):
+        values = list(self._getters[0](stats))
+        for section, getter in self._getters[1:]:
+            v = getter(stats[section])
+            if isinstance(v, tuple):
+                values.extend(v)
+            else:
+                values.append(v)
+        values.extend(stats["packets"])
+        values.extend(stats["bytes"])
+        for i in self._ifnames:
+            values.extend(ifaces[i]["trafinfo"])
+        return values
+
+    def sample(self, now = None):
+        """
+            Take a sample, stamped with now or the current time.
+        """
+        if now is None:
+            now = time.time()
+        stats = _pf.get_stats()
+        ifaces = {}
+        if self.interfaces:
+            ifaces = _pf.get_ifaces()
+        ifnames = tuple(sorted(ifaces))
+        if ifnames != self._ifkey:
+            self._compile(stats, ifnames)
+            self._ifkey = ifnames
+        values = self._flatten(stats, ifaces)
+        delta = None
+        if self._count:
+            delta = self._delta(self._ring[(self._count - 1) % self.size], stats["since"], values)
+        self._ring[self._count % self.size] = (now, stats["since"], values, delta)
+        self._count += 1
+
+    def run(self, count = None, callback = None):
+        """
+            Sample every interval seconds, count times or forever. Sampling
+            is aligned to a fixed schedule, so that time spent sampling and
+            in callback(self), called after each sample, doesn't add up.
+        """
+        start = time.time()
+        n = 0
+        while count is None or n < count:
+            self.sample()
+            n += 1
+            if callback:
+                callback(self)
+            if count is not None and n >= count:
+                break
+            wait = start + n*self.interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+    def __len__(self):
+        return min(self._count, self.size)
+
+    def samples(self):
+        """
+            Return the samples in the ring, oldest first, as (time, values)
+            tuples.
+        """
+        n = len(self)
+        ring = [self._ring[i % self.size] for i in range(self._count - n, self._count)]
+        return [(i[0], i[2]) for i in ring]
+
+    def _delta(self, old, since, nv):
+        g = len(self.GAUGES)
+        if old[1] != since:
+            # PF has been restarted.
+            self.resets += 1
+            return nv[g:]
+        d = map(operator.sub, nv[g:], old[2][g:])
+        if d and min(d) < 0:
+            for i, v in enumerate(d):
+                if v < 0:
+                    self.resets += 1
+                    d[i] = nv[g + i]
+        return d
+
+    def _last(self, n):
+        n = min(n, len(self))
+        return [self._ring[i % self.size] for i in range(self._count - n, self._count)]
+
+    def _named(self, values):
+        return dict(zip(self.names[len(self.GAUGES):], values))
+
+    def values(self):
+        """
+            Return the latest value of every counter and gauge.
+        """
+        if not len(self):
+            return {}
+        return dict(zip(self.names, self._last(1)[0][2]))
+
+    def deltas(self):
+        """
+            Return the change in each counter between the last two samples.
+        """
+        if len(self) < 2:
+            return {}
+        return self._named(self._last(1)[0][3])
+
+    def rates(self):
+        """
+            Return the per-second rate of each counter between the last two
+            samples.
+        """
+        return self.average(2)
+
+    def average(self, window = None):
+        """
+            Return the per-second rate of each counter averaged over the
+            last window samples, or over the whole ring.
+        """
+        ring = self._last(window or self.size)
+        if len(ring) < 2:
+            return {}
+        total = [sum(i) for i in zip(*[j[3] for j in ring[1:]])]
+        elapsed = ring[-1][0] - ring[0][0]
+        if elapsed <= 0:
+            return {}
+        return self._named([i/elapsed for i in total])
+
+
 class PF(Anchor):
     """
         The top-level PF class is an extension of the root Anchor object.
     """
+    # The number of lookupState results whose state keys are remembered.
+    STATE_KEYS = 1024
+    # Errors from a state query meaning the kernel doesn't support it.
+    _NO_STATE_QUERY = (errno.ENOTTY, errno.ENODEV, errno.EINVAL)
     def __init__(self):
         Anchor.__init__(self, self)
         _pf._init()
+        self._stateKeys = utils.LRUCache(self.STATE_KEYS)
+        self._stateQuery = True
 
     def running(self):
         return self.getStatistics()["running"]
@@ -266,13 +1680,7 @@ class PF(Anchor):
         for i in data.values():
             tdict = {}
             i["tzero"] = datetime.datetime.fromtimestamp(i["tzero"])
-            i["trafinfo"] = _makeTree(
-                                    i["trafinfo"],
-                                    ["ipv4", "ipv6"],
-                                    ["in", "out"],
-                                    ["pass", "blocK"],
-                                    ["packets", "bytes"]
-                                )
+            i["trafinfo"] = _makeTree(i["trafinfo"], *_IFACE_LABELS)
         return data
 
     def setLogInterface(self, ifname):
@@ -280,17 +1688,8 @@ class PF(Anchor):
 
     def getStatistics(self):
         x = _pf.get_stats()
-        x["packets"] = _makeTree(
-                                    x["packets"],
-                                    ["ipv4", "ipv6"],
-                                    ["in", "out"],
-                                    ["pass", "block", "unknown"],
-                                )
-        x["bytes"] = _makeTree(
-                                    x["bytes"],
-                                    ["ipv4", "ipv6"],
-                                    ["in", "out"],
-                                )
+        x["packets"] = _makeTree(x["packets"], *_PACKET_LABELS)
+        x["bytes"] = _makeTree(x["bytes"], *_BYTE_LABELS)
         return x
 
     def clearStatistics(self):
@@ -302,6 +1701,93 @@ class PF(Anchor):
             states.append(State(self, i))
         return states
 
+    def getStatesRaw(self):
+        """
+            Fetch the state table as a StateBuffer, without decoding it.
+        """
+        return StateBuffer(_pf.get_states_raw())
+
+    def iterStates(self):
+        """
+            Iterate over the state table, yielding a lazily decoded
+            StateRecord for each state.
+        """
+        return iter(self.getStatesRaw())
+
+    def getStateSnapshot(self):
+        """
+            Fetch the state table as a StateSnapshot, for accounting over
+            columns rather than individual states.
+        """
+        return StateSnapshot(_pf.get_states_raw())
+
+    def getState(self, id, creatorid):
+        """
+            Fetch a single state by its (id, creatorid) key, without dumping
+            the state table. Returns a StateRecord, or None if there is no
+            such state.
+        """
+        raw = _pf.get_state(id, creatorid)
+        if raw is None:
+            return None
+        return StateBuffer(raw)[0]
+
+    def findStates(self,
+            interface = None,
+            proto = None,
+            src = None,
+            dst = None,
+            srcport = 0,
+            dstport = 0,
+        ):
+        """
+            Return StateRecords for all states matching the given interface,
+            protocol, addresses and ports. Arguments left out match
+            anything. Source and destination are matched as killStates
+            matches them. This scans the whole state table.
+        """
+        f = _StateFilter(interface, proto, src, dst, srcport, dstport)
+        return f.scan(self.getStatesRaw())
+
+    def lookupState(self,
+            proto,
+            src,
+            dst,
+            srcport = 0,
+            dstport = 0,
+            interface = None,
+        ):
+        """
+            Find the state for a connection, and return it as a StateRecord,
+            or None. Arguments are as for findStates.
+
+            The first lookup of a connection scans the state table. The key
+            of the state found is remembered, and later lookups of the same
+            connection fetch just that state from the kernel, at a cost
+            that doesn't depend on the size of the table. If the kernel
+            can't look states up by key, every lookup scans; other errors
+            make just that lookup scan.
+        """
+        f = _StateFilter(interface, proto, src, dst, srcport, dstport)
+        key = f.key()
+        ids = self._stateKeys.get(key)
+        if ids is not None:
+            rec = None
+            if self._stateQuery:
+                try:
+                    rec = self.getState(*ids)
+                except OException, v:
+                    if v.args and v.args[0] in self._NO_STATE_QUERY:
+                        self._stateQuery = False
+            if rec is not None and f.match(rec):
+                return rec
+            self._stateKeys.pop(key)
+        found = f.scan(self.getStatesRaw(), 1)
+        if not found:
+            return None
+        self._stateKeys.put(key, (found[0].id, found[0].creatorid))
+        return found[0]
+
     def clearStates(self, interface = None):
         return _pf.clear_states(interface)
 
@@ -343,6 +1829,37 @@ class PF(Anchor):
                 af = AF_INET6
         return _pf.kill_states(af, interface, src, srcmask, dst, dstmask, srcport, dstport)
 
+    def killStatesBatch(self, filters):
+        """
+            Kill the states matching any of a list of filters. Each filter
+            is a dictionary of killStates keyword arguments, or a (src,
+            srcmask, dst, dstmask, ports, interface) tuple, where ports is a
+            (srcport, dstport) tuple or None. Addresses may carry a
+            "/prefix" suffix in place of a mask.
+
+            Filters are encoded once, filters made redundant by others are
+            dropped, and the rest are issued to the kernel in a single call.
+            Returns a (total, counts) tuple, where counts holds the number
+            of states killed by each filter - zero for dropped ones. If the
+            kernel rejects a filter, StateKillError is raised, carrying the
+            counts for the filters already issued.
+        """
+        filters = [_killFilter(i) for i in filters]
+        keep = _coalesceKills(filters)
+        counts = [0]*len(filters)
+        try:
+            killed = _pf.kill_states_batch("".join([_packKillFilter(filters[i]) for i in keep]))
+        except OException, v:
+            if len(v.args) != 4:
+                raise
+            err, strerror, failed, killed = v.args
+            for i, n in zip(keep, killed):
+                counts[i] = n
+            raise StateKillError(err, strerror, keep[failed], counts)
+        for i, n in zip(keep, killed):
+            counts[i] = n
+        return sum(killed), counts
+
     def __repr__(self):
         if self.running():
             r = "enabled"
@@ -0,0 +1,332 @@
+#    Copyright (c) 2003, Nullcube Pty Ltd
+#    All rights reserved.
+#
+#    Redistribution and use in source and binary forms, with or without
+#    modification, are permitted provided that the following conditions are met:
+#
+#    *   Redistributions of source code must retain the above copyright notice, this
+#        list of conditions and the following disclaimer.
+#    *   Redistributions in binary form must reproduce the above copyright notice,
+#        this list of conditions and the following disclaimer in the documentation
+#        and/or other materials provided with the distribution.
+#    *   Neither the name of Nullcube nor the names of its contributors may be used to
+#        endorse or promote products derived from this software without specific
+#        prior written permission.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+#    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+#    ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#    (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#    LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+#    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#    (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#    SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+    A fixed-layout ring of counter samples in a memory-mapped file, so that
+    one collector process can poll the kernel and any number of readers in
+    other processes can share the results.
+
+    The file starts with a header, followed by the newline-separated counter
+    names, followed by the slots. All values are little-endian:
+
+        magic       4s      "OBCR"
+        version     I
+        slots       I       The number of slots in the ring.
+        count       I       The number of counters in each sample.
+        names       I       The length of the names block.
+        stale       I       Set once the file has been replaced.
+        head        Q       The number of samples written so far.
+
+    Each slot holds a sequence word, a time, and count unsigned 64-bit
+    counter values. Sample n goes in slot n % slots. Its writer sets the
+    sequence word to 2n + 1 before writing the sample and 2n + 2 after, so
+    that readers, which take no locks and make no system calls, can detect
+    a sample that was being written or overwritten while they copied it,
+    and retry. This relies on the writer's stores to the mapping becoming
+    visible in order, as they do on the platforms OpenBSD runs on for a
+    single writer.
+
+    When the set of counters changes, the writer builds a new file, renames
+    it over the old one, and marks the old one stale. Readers notice, and
+    re-attach.
+"""
+import os, mmap, struct, time
+
+MAGIC = "OBCR"
+VERSION = 1
+_header = struct.Struct("<4sIIIII")
+_seq = struct.Struct("<Q")
+_HEAD = 24
+_STALE = 20
+_NAMES = 32
+
+
+def _slotStruct(count):
+    return struct.Struct("<d%dQ"%count)
+
+
+class _Ring(object):
+    def _layout(self):
+        magic, version, self.slots, count, nameslen, stale = _header.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError, "Not a counter ring: %s"%self.path
+        names = self._mm[_NAMES:_NAMES + nameslen]
+        self.names = tuple(names.split("\n")) if names else ()
+        self._data = _slotStruct(count)
+        self._slotSize = _seq.size + self._data.size
+        self._base = _NAMES + nameslen + (-nameslen % 8)
+
+    def _offset(self, n):
+        return self._base + (n % self.slots)*self._slotSize
+
+
+class RingWriter(_Ring):
+    """
+        Writes samples of a fixed set of counters into a ring file. Creating
+        a writer replaces any existing ring at path.
+    """
+    def __init__(self, path, names, slots = 3600):
+        self.path = path
+        self._mm = None
+        self._create(names, slots)
+
+    def _create(self, names, slots):
+        names = tuple(names)
+        for i in names:
+            if not i or "\n" in i:
+                raise ValueError, "Invalid counter name: %r"%i
+        block = "\n".join(names)
+        size = _NAMES + len(block) + (-len(block) % 8) + slots*(_seq.size + _slotStruct(len(names)).size)
+        tmp = "%s.%d.tmp"%(self.path, os.getpid())
+        f = open(tmp, "w+b")
+        try:
+            try:
+                f.truncate(size)
+                mm = mmap.mmap(f.fileno(), size)
+            finally:
+                f.close()
+        except:
+            os.remove(tmp)
+            raise
+        _header.pack_into(mm, 0, MAGIC, VERSION, slots, len(names), len(block), 0)
+        mm[_NAMES:_NAMES + len(block)] = block
+        if self._mm is None:
+            # A ring left by an earlier writer may still have readers.
+            self._mm = self._previous()
+        os.rename(tmp, self.path)
+        self._retire()
+        self._mm = mm
+        self._layout()
+        self.head = 0
+
+    def _previous(self):
+        """
+            Map the ring currently at path, if there is one.
+        """
+        try:
+            f = open(self.path, "r+b")
+        except IOError:
+            return None
+        try:
+            try:
+                mm = mmap.mmap(f.fileno(), 0)
+            except (mmap.error, ValueError):
+                return None
+        finally:
+            f.close()
+        if len(mm) < _header.size or _header.unpack_from(mm, 0)[:2] != (MAGIC, VERSION):
+            mm.close()
+            return None
+        return mm
+
+    def _retire(self):
+        if self._mm is not None:
+            struct.pack_into("<I", self._mm, _STALE, 1)
+            self._mm.close()
+            self._mm = None
+
+    def write(self, values, t = None):
+        """
+            Append a sample: a sequence of values, in the order of names.
+        """
+        if len(values) != len(self.names):
+            raise ValueError, "Expected %d values, got %d."%(len(self.names), len(values))
+        if t is None:
+            t = time.time()
+        n = self.head
+        offset = self._offset(n)
+        _seq.pack_into(self._mm, offset, 2*n + 1)
+        self._data.pack_into(self._mm, offset + _seq.size, t, *values)
+        _seq.pack_into(self._mm, offset, 2*n + 2)
+        self.head = n + 1
+        _seq.pack_into(self._mm, _HEAD, self.head)
+
+    def rename(self, names):
+        """
+            Start a new ring with a different set of counters, of the same
+            size. Readers of the old ring will move to the new one.
+        """
+        self._create(names, self.slots)
+
+    def close(self):
+        """
+            Stop writing. The ring file remains, for readers.
+        """
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+
+class RingReader(_Ring):
+    """
+        Reads samples from a ring file written by a RingWriter, possibly in
+        another process. Samples are (time, values) tuples, with values in
+        the order of the names attribute.
+    """
+    RETRIES = 100
+    def __init__(self, path):
+        self.path = path
+        self._mm = None
+        self._attach()
+
+    def _attach(self):
+        f = open(self.path, "rb")
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        if self._mm is not None:
+            self._mm.close()
+        self._mm = mm
+        self._layout()
+
+    def _check(self):
+        if struct.unpack_from("<I", self._mm, _STALE)[0]:
+            self._attach()
+
+    @property
+    def head(self):
+        self._check()
+        return _seq.unpack_from(self._mm, _HEAD)[0]
+
+    def _read(self, n):
+        """
+            Read sample n, or return None if it has been overwritten.
+        """
+        offset = self._offset(n)
+        done = 2*n + 2
+        for i in xrange(self.RETRIES):
+            seq = _seq.unpack_from(self._mm, offset)[0]
+            if seq == done:
+                sample = self._data.unpack_from(self._mm, offset + _seq.size)
+                if _seq.unpack_from(self._mm, offset)[0] == seq:
+                    return sample[0], sample[1:]
+            elif seq != done - 1:
+                # Not written yet, or already overwritten by a later sample.
+                return None
+        return None
+
+    def latest(self):
+        """
+            Return the most recent sample, or None if there are none.
+        """
+        for i in xrange(self.RETRIES):
+            head = self.head
+            if not head:
+                return None
+            sample = self._read(head - 1)
+            if sample is not None:
+                return sample
+        return None
+
+    def history(self, count = None):
+        """
+            Return up to count of the most recent samples, oldest first.
+        """
+        head = self.head
+        count = min(count or self.slots, self.slots, head)
+        samples = []
+        for n in xrange(head - count, head):
+            sample = self._read(n)
+            if sample is not None:
+                samples.append(sample)
+        return samples
+
+    def get(self, name, count = None):
+        """
+            Return (time, value) tuples for one counter, oldest first.
+        """
+        i = self.names.index(name)
+        return [(t, v[i]) for t, v in self.history(count)]
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for k, v in value.iteritems():
+            _flatten("%s/%s"%(prefix, k), v, out)
+    elif isinstance(value, (int, long)) and value >= 0:
+        out[prefix] = value
+
+
+class Collector(object):
+    """
+        Samples a set of counter sources into a ring every interval seconds.
+        Sources is a dictionary mapping a prefix to a function returning a
+        dictionary of counters, which may be nested, e.g.:
+
+            n = netstat.Netstat()
+            Collector(path, {
+                "pf": pf.PF().getStatistics,
+                "ip": n.ipstats,
+                "interfaces": n.ifstats,
+            })
+
+        Counters are named by their paths, e.g. "interfaces/em0/ipackets".
+        Values that are not non-negative integers are left out. If the set
+        of counters changes - when an interface appears, say - the ring is
+        started afresh.
+    """
+    def __init__(self, path, sources, interval = 1.0, slots = 3600):
+        self.path, self.sources = path, sources
+        self.interval, self.slots = interval, slots
+        self.writer = None
+
+    def sample(self):
+        """
+            Take and write a sample now.
+        """
+        counters = {}
+        for prefix, func in self.sources.iteritems():
+            _flatten(prefix, func(), counters)
+        names = sorted(counters)
+        if self.writer is None:
+            self.writer = RingWriter(self.path, names, self.slots)
+        elif tuple(names) != self.writer.names:
+            self.writer.rename(names)
+        self.writer.write([counters[i] for i in names])
+
+    def run(self, count = None):
+        """
+            Sample count times, or forever, on a fixed schedule.
+        """
+        start = time.time()
+        n = 0
+        while count is None or n < count:
+            self.sample()
+            n += 1
+            if count is not None and n >= count:
+                break
+            wait = start + n*self.interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
@@ -23,7 +23,7 @@
 #    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 #    (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 #    SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
-import math
+import math, struct, array, sys, socket
 from _sysvar import *
 
 
@@ -59,21 +59,112 @@ def multichar(a, width):
     return "".join(ret)
 
 
+#
+# Internet checksums (RFC 1071)
+#
+_littleEndian = (sys.byteorder == "little")
+
+def _asBuffer(data):
+    """
+        Return a read-only buffer over any object supporting the buffer
+        protocol: strings, bytearrays, arrays, mmaps and memoryviews.
+    """
+    if hasattr(data, "tobytes"):
+        # memoryview only exposes the new-style buffer interface.
+        data = data.tobytes()
+    return buffer(data)
+
+
+def cksumAdd(data, initial=0):
+    """
+        Add the 16-bit one's complement sum of data to initial, and return the
+        result folded to 16 bits. The returned value is not complemented, so
+        partial sums over several pieces of a packet can be chained:
+
+            cksumAdd(payload, cksumAdd(header))
+
+        Every piece except the last must be of even length.
+    """
+    buf = _asBuffer(data)
+    length = len(buf)
+    even = length & ~1
+    words = array.array("H")
+    words.fromstring(buffer(buf, 0, even))
+    # Summing 16-bit words in native byte order and swapping the folded
+    # result gives the same value as summing in network byte order.
+    total = sum(words)
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    if _littleEndian:
+        total = ((total & 0xff) << 8) | (total >> 8)
+    total += initial
+    if length != even:
+        total += ord(buf[even]) << 8
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return total
+
+
 def cksum16(data):
     """
-        Calculates the 16-bit CRC checksum accross data.
+        Calculates the 16-bit Internet checksum accross data.
     """
-    sum = 0
-    try:
-        for i in range(0, len(data), 2):
-            a = ord(data[i])
-            b = ord(data[i+1])
-            sum = sum + ((a<<8) + b)
-    except IndexError:
-        sum = sum + (a<<8)
-    while (sum >> 16):
-        sum = (sum & 0xFFFF) + (sum >> 16)
-    return (~sum & 0xFFFF)
+    return (~cksumAdd(data) & 0xFFFF)
+
+
+def cksumPseudoHeader(src, dst, proto, length):
+    """
+        Return the partial sum of a TCP/UDP pseudo-header, for use as the
+        starting sum passed to cksumAdd. src and dst are addresses of the
+        same family (IPv4 or IPv6), proto is the protocol number and length
+        is the length of the transport header plus payload.
+    """
+    src, dst = Address(src), Address(dst)
+    if src.af != dst.af:
+        raise ValueError, "Addresses must be of the same type."
+    if src.af == AF_INET:
+        hdr = src.bytes + dst.bytes + struct.pack("!BBH", 0, proto, length)
+    elif src.af == AF_INET6:
+        hdr = src.bytes + dst.bytes + struct.pack("!I3xB", length, proto)
+    else:
+        raise ValueError, "Pseudo-headers are only defined for IP addresses."
+    return cksumAdd(hdr)
+
+
+def cksumTransport(src, dst, proto, segment):
+    """
+        Calculate the checksum of a TCP or UDP segment, including its
+        pseudo-header. The checksum field in the segment should be zero.
+
+        Note that UDP transmits a computed checksum of 0 as 0xffff.
+    """
+    start = cksumPseudoHeader(src, dst, proto, len(_asBuffer(segment)))
+    return (~cksumAdd(segment, start) & 0xFFFF)
+
+
+def cksumUpdate(cksum, old, new):
+    """
+        Incrementally update a checksum after a field in the checksummed
+        data changes from old to new, without re-summing the data. Uses
+        equation 3 of RFC 1624:
+
+            HC' = ~(~HC + ~m + m')
+
+        The field values can be 16-bit integers or even-length strings (for
+        instance, the bytes of an address).
+    """
+    if isNumberLike(old):
+        total = (~cksum & 0xffff) + (~old & 0xffff) + new
+    else:
+        if len(old) != len(new) or len(old) % 2:
+            raise ValueError, "Field values must be of equal, even length."
+        fmt = "!%dH"%(len(old)/2)
+        total = (~cksum & 0xffff) + sum(struct.unpack(fmt, new))
+        for i in struct.unpack(fmt, old):
+            total += ~i & 0xffff
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return (~total & 0xFFFF)
 
 
 def isStringLike(anobj):
@@ -102,7 +193,7 @@ def findLongestSubsequence(seq, value):
     maxseq = (0, 0)
     for i in itr:
         if seq[i] == value:
-            start = i
+            start = j = i
             for j in itr:
                 if not seq[j] == value:
                     j -= 1
@@ -155,78 +246,248 @@ def getBlocks(addr):
             raise ValueError, "Malformed address."
         nums.append(num)
     return nums
-            
+
+
+_MASK32 = 0xffffffffL
+_MASK64 = 0xffffffffffffffffL
+_MASK128 = (1L << 128) - 1
+_ip4Struct = struct.Struct("!I")
+_ip6Struct = struct.Struct("!QQ")
+_ethStruct = struct.Struct("!HI")
+_ip6Words = struct.Struct("!8H")
+# IPv6 text codec tables. Groups are left-padded to four digits so that a
+# whole address can be converted with a single long(..., 16) call; the
+# zero-run patterns are ordered longest first, so the first match found by
+# str.find is the leftmost longest run, as RFC 5952 requires.
+_IDENTITY = "".join(map(chr, range(256)))
+_HEXDIGITS = "0123456789abcdefABCDEF"
+_GROUPPAD = ["0000", "000", "00", "0", ""]
+_ZERORUNS = [":" + "0:"*i for i in range(8, 1, -1)]
+
 
 class _MaskMixin(object):
-    _prefTable = {
-        0:   0,
-        128: 1,
-        192: 2,
-        224: 3,
-        240: 4,
-        248: 5,
-        252: 6,
-        254: 7
-    }
-    def _countPrefix(self, bytes):
-        num = 0
-        itr = iter(bytes)
-        for b in itr:
-            if b == "\xff":
-                num += 8
-            else:
-                break
-        else:
-            return num
+    """
+        There is exactly one mask object for each prefix length, built when
+        the module is imported. The constructor and fromBytes return these
+        shared instances. Prefix lengths, canonical text and packed bytes
+        are looked up in a single dictionary. Other text is parsed and then
+        looked up by its integer value. Masks are immutable.
+    """
+    __slots__ = ()
+    def __new__(cls, mask=None):
+        if mask is None:
+            mask = cls.WIDTH
+        try:
+            return cls._lookup[mask]
+        except (KeyError, TypeError):
+            pass
+        if isinstance(mask, _AddrBase):
+            if mask.af != cls.af:
+                raise ValueError, "Invalid mask."
+            return cls._fromInt(mask._int)
+        if isNumberLike(mask):
+            raise ValueError, "Prefix must be between 0 and %s."%cls.WIDTH
+        return cls._fromInt(cls._parse(mask))
+
+    def __init__(self, mask=None):
+        pass
+
+    @classmethod
+    def _fromInt(cls, num, address=None):
         try:
-            num += self._prefTable[ord(b)]
+            return cls._byInt[num]
         except KeyError:
             raise ValueError, "Invalid mask."
-        for b in itr:
-            if not b == "\x00":
-                raise ValueError, "Invalid mask."
-        return num
+
+    @classmethod
+    def fromBytes(cls, bytes):
+        try:
+            return cls._lookup[bytes]
+        except KeyError:
+            pass
+        if len(bytes) != cls.WIDTH/8:
+            raise ValueError, "Mask must have %s bytes."%(cls.WIDTH/8)
+        raise ValueError, "Invalid mask."
+
+    @classmethod
+    def _buildMasks(cls):
+        """
+            Create the shared instances and their lookup tables.
+        """
+        cls._byInt, cls._lookup = {}, {}
+        full = (1L << cls.WIDTH) - 1
+        for prefix in range(cls.WIDTH + 1):
+            num = full ^ ((1L << (cls.WIDTH - prefix)) - 1)
+            m = object.__new__(cls)
+            object.__setattr__(m, "_int", num)
+            object.__setattr__(m, "_address", cls._render(num))
+            object.__setattr__(m, "prefix", prefix)
+            cls._byInt[num] = m
+            cls._lookup[prefix] = cls._lookup[m._address] = cls._lookup[m.bytes] = m
+
+    def __setattr__(self, name, value):
+        raise AttributeError, "Mask objects are immutable."
+
+    def __reduce__(self):
+        return (self.__class__, (self.prefix,))
 
 
 class _AddrBase(object):
+    """
+        Addresses are stored as a single integer. The text form is only
+        rendered when it is first asked for, and is then kept. Address
+        objects should be treated as immutable.
+    """
+    __slots__ = ("_int", "_address")
+    af = None
+    # Addresses hash and order on the address family followed by the
+    # integer value. Strings are converted with Address() before comparing,
+    # so an address compares equal to its text form, but does not hash like
+    # it.
+    def _other(self, other):
+        if isinstance(other, _AddrBase):
+            return other
+        if isStringLike(other):
+            return Address(other)
+        return None
+
     def __eq__(self, other):
-        if not isinstance(other, _AddrBase):
-            other = Address(other)
-        return (self.bytes == other.bytes)
+        if other.__class__ is self.__class__:
+            return self._int == other._int
+        other = self._other(other)
+        if other is None:
+            return NotImplemented
+        return (self._int == other._int and self.af == other.af)
+
+    def __ne__(self, other):
+        if other.__class__ is self.__class__:
+            return self._int != other._int
+        other = self._other(other)
+        if other is None:
+            return NotImplemented
+        return (self._int != other._int or self.af != other.af)
+
+    def __lt__(self, other):
+        if other.__class__ is self.__class__:
+            return self._int < other._int
+        other = self._other(other)
+        if other is None:
+            return NotImplemented
+        return (self.af, self._int) < (other.af, other._int)
+
+    def __le__(self, other):
+        if other.__class__ is self.__class__:
+            return self._int <= other._int
+        other = self._other(other)
+        if other is None:
+            return NotImplemented
+        return (self.af, self._int) <= (other.af, other._int)
+
+    def __gt__(self, other):
+        if other.__class__ is self.__class__:
+            return self._int > other._int
+        other = self._other(other)
+        if other is None:
+            return NotImplemented
+        return (self.af, self._int) > (other.af, other._int)
+
+    def __ge__(self, other):
+        if other.__class__ is self.__class__:
+            return self._int >= other._int
+        other = self._other(other)
+        if other is None:
+            return NotImplemented
+        return (self.af, self._int) >= (other.af, other._int)
+
+    def __hash__(self):
+        return hash(self._int) ^ self.af
+
+    @classmethod
+    def _fromInt(cls, num, address=None):
+        """
+            Construct an instance directly from its integer value, skipping
+            all parsing.
+        """
+        a = object.__new__(cls)
+        a._int = num
+        a._address = address
+        return a
+
+    @classmethod
+    def fromInt(cls, num):
+        """
+            Construct an address from its integer value.
+        """
+        if num < 0 or num >> (cls.WIDTH):
+            raise ValueError, "Address out of range."
+        return cls._fromInt(long(num))
+
+    def _getAddress(self):
+        if self._address is None:
+            self._address = self._render(self._int)
+        return self._address
+    address = property(_getAddress, None, None, "The text form of the address.")
+
+    def _getBytes(self):
+        return self._pack(self._int)
+    bytes = property(_getBytes, None, None, "The address in network byte order.")
+
+    def __int__(self):
+        return int(self._int)
+
+    def __long__(self):
+        return long(self._int)
+
+    def __getstate__(self):
+        return (self._int, self._address)
+
+    def __setstate__(self, state):
+        self._int, self._address = state
+
+    def __repr__(self):
+        return self.address
 
 
 class EthernetAddress(_AddrBase):
+    __slots__ = ()
     af = AF_LINK
+    WIDTH = 48
     def __init__(self, address):
-        self.address = address
-        self.bytes = self._bytes()
-
-    @staticmethod
-    def fromBytes(addr):
-        if len(addr) != 6:
-            raise ValueError, "Ethernet address must have 6 bytes."
-        octets = []
-        for i in addr:
-            next = "%x"%ord(i)
-            if len(next) == 1:
-                next = "0"+next
-            octets.append(next)
-        return EthernetAddress(":".join(octets))
-
-    def _bytes(self):
-        nums = getBlocks(self.address)
+        if isinstance(address, _AddrBase):
+            self._int, self._address = address._int, address._address
+            return
+        nums = getBlocks(address)
         if len(nums) != 6:
             raise ValueError, "Malformed Ethernet address."
-        return "".join([chr(i) for i in nums])
+        num = 0L
+        for i in nums:
+            if i > 0xff:
+                raise ValueError, "Malformed Ethernet address."
+            num = (num << 8) | i
+        self._int = num
+        self._address = address
+
+    @classmethod
+    def fromBytes(cls, addr):
+        if len(addr) != 6:
+            raise ValueError, "Ethernet address must have 6 bytes."
+        hi, lo = _ethStruct.unpack(addr)
+        return cls._fromInt((long(hi) << 32) | lo)
 
-    def __repr__(self):
-        return self.address
+    @staticmethod
+    def _pack(num):
+        return _ethStruct.pack(num >> 32, num & _MASK32)
 
+    @staticmethod
+    def _render(num):
+        return "%02x:%02x:%02x:%02x:%02x:%02x"%(
+                    (num >> 40) & 0xff, (num >> 32) & 0xff, (num >> 24) & 0xff,
+                    (num >> 16) & 0xff, (num >> 8) & 0xff, num & 0xff
+                )
 
-class _IPBase(_AddrBase):
-    def __repr__(self):
-        return self.address
 
+class _IPBase(_AddrBase):
+    __slots__ = ()
     def _getMask(self, mask, func):
         """
             Takes a numeric mask, and a prefix function.
@@ -241,36 +502,45 @@ class _IPBase(_AddrBase):
 
 
 class IPAddress(_IPBase):
+    __slots__ = ()
     af = AF_INET
+    WIDTH = 32
     def __init__(self, address):
-        self.address = address
-        self.bytes = self._bytes()
-
-    @staticmethod
-    def fromBytes(bytes):
+        if isinstance(address, _AddrBase):
+            self._int, self._address = address._int, address._address
+            return
+        self._int = self._parse(address)
+        self._address = address
+
+    @classmethod
+    def fromBytes(cls, bytes):
         """
             Converts a sequence of 4 bytes to an IPv4 address.
         """
         if len(bytes) != 4:
             raise ValueError, "IP Address must have 4 bytes."
-        octets = []
-        for i in bytes:
-            val = ord(i)
-            octets.append(str(val))
-        addr = ".".join(octets)
-        return IPAddress(addr)
-
-    def _bytes(self):
-        nums = self.address.split(".")
+        return cls._fromInt(long(_ip4Struct.unpack(bytes)[0]))
+
+    @staticmethod
+    def _parse(address):
+        nums = address.split(".")
         if len(nums) != 4:
             raise ValueError, "Mal-formed IP address."
-        ret = []
+        num = 0L
         for i in nums:
-            num = int(i)
-            if num > 255 or num < 0:
+            i = int(i)
+            if i > 255 or i < 0:
                 raise ValueError, "Mal-formed IP address."
-            ret.append(chr(num))
-        return "".join(ret)
+            num = (num << 8) | i
+        return num
+
+    @staticmethod
+    def _pack(num):
+        return _ip4Struct.pack(num)
+
+    @staticmethod
+    def _render(num):
+        return "%d.%d.%d.%d"%(num >> 24, (num >> 16) & 0xff, (num >> 8) & 0xff, num & 0xff)
 
     def mask(self, *args, **kwargs):
         """
@@ -279,75 +549,98 @@ class IPAddress(_IPBase):
         return IPMask(*args, **kwargs)
 
 
-class IPMask(IPAddress, _MaskMixin):
-    def __init__(self, mask):
-        if mask is None:
-            mask = 32
-        if isNumberLike(mask):
-            mask = self._ipFromPrefix(mask)
-        IPAddress.__init__(self, mask)
-        self.prefix = self._countPrefix(self.bytes)
+class IPMask(_MaskMixin, IPAddress):
+    __slots__ = ("prefix",)
 
-    def _bytesFromIPPrefix(self, prefix):
-        """
-            Produce a binary IPv4 address (netmask) from a prefix length.
-        """
-        if (prefix > 32) or (prefix < 0):
-            raise ValueError, "Prefix must be between 0 and 32."
-        addr = "\xff" * (prefix/8)
-        if prefix%8:
-            addr += chr((255 << (8-(prefix%8)))&255)
-        addr += "\0"*(4 - len(addr))
-        return addr
-
-    def _ipFromPrefix(self, prefix):
-        """
-            Produce an IPv4 address (netmask) from a prefix length.
-        """
-        return IPMask.fromBytes(self._bytesFromIPPrefix(prefix)).address
+IPMask._buildMasks()
 
 
 class IP6Address(_IPBase):
+    __slots__ = ()
     af = AF_INET6
+    WIDTH = 128
     def __init__(self, address):
-        self.address = address
+        if isinstance(address, _AddrBase):
+            self._int, self._address = address._int, address._address
+            return
         # Conformance check: raises on error.
-        self.bytes = self._bytes()
+        self._int = self._parse(address)
+        self._address = address
 
-    @staticmethod
-    def fromBytes(addr):
+    @classmethod
+    def fromBytes(cls, addr):
         """
-            Converts a standard 16-byte IPv6 address to a human-readable string.
+            Converts a standard 16-byte IPv6 address to an address object.
         """
         if len(addr) != 16:
             raise ValueError, "IPv6 address must have 16 bytes: %s"%repr(addr)
-        octets = []
-        for i in range(8):
-            octets.append(hex(multiord(addr[2*i:2*i+2]))[2:])
-        start, finish = findLongestSubsequence(octets, "0")
-        if finish:
-            return IP6Address(":".join(octets[0:start]) + "::" + ":".join(octets[finish+1:]))
-        else:
-            return IP6Address(":".join(octets))
+        hi, lo = _ip6Struct.unpack(addr)
+        return cls._fromInt((long(hi) << 64) | lo)
 
-    def _bytes(self):
+    @staticmethod
+    def _parse(address):
         """
-            Converts a standard IPv6 address to 16 bytes.
+            Converts an IPv6 address in any of the RFC 4291 text forms to an
+            integer, including "::" compression and a trailing embedded IPv4
+            address.
         """
-        abbr = self.address.count("::")
-        if self.address.find("::") > -1:
-            if (self.address.count("::") > 1):
-                raise ValueError, "Mal-formed IPv6 address: only one :: abbreviation allowed."
-            first, second = self.address.split("::")
-            first = getBlocks(first)
-            second = getBlocks(second)
-            padlen = 8 - len(first) - len(second)
-            nums = first + [0]*padlen + second
-        else:
-            nums = getBlocks(self.address)
-        if len(nums) != 8:
+        if address.count("::") > 1:
+            raise ValueError, "Mal-formed IPv6 address: only one :: abbreviation allowed."
+        groups = address.split(":")
+        if "." in groups[-1]:
+            v4 = IPAddress._parse(groups[-1])
+            groups[-1:] = ["%04x"%(v4 >> 16), "%04x"%(v4 & 0xffff)]
+        if len(groups) > 8 and address.find("::") < 0 or len(groups) > 10:
+            raise ValueError, "Mal-formed IPv6 address."
+        if address.find("::") > -1:
+            if groups[0] == "" and groups[1] == "":
+                del groups[0]
+            if groups[-1] == "" and groups[-2] == "":
+                del groups[-1]
+            i = groups.index("")
+            padlen = 9 - len(groups)
+            if padlen < 1:
+                raise ValueError, "Mal-formed IPv6 address."
+            groups[i:i+1] = ["0000"]*padlen
+        elif len(groups) != 8:
+            raise ValueError, "Mal-formed IPv6 address."
+        try:
+            digits = "".join([_GROUPPAD[len(i)] + i for i in groups if i])
+        except IndexError:
+            raise ValueError, "Mal-formed IPv6 address."
+        if len(digits) != 32 or digits.translate(_IDENTITY, _HEXDIGITS):
             raise ValueError, "Mal-formed IPv6 address."
-        return "".join([multichar(i, 2) for i in nums])
+        return long(digits, 16)
+
+    @staticmethod
+    def _pack(num):
+        return _ip6Struct.pack(num >> 64, num & _MASK64)
+
+    @staticmethod
+    def _render(num):
+        """
+            Render an integer as RFC 5952 canonical text: lowercase, no
+            leading zeros, and the leftmost longest run of two or more zero
+            groups replaced by "::". IPv4-mapped addresses keep the dotted
+            quad.
+        """
+        if num >> 32 == 0xffff:
+            return "::ffff:" + IPAddress._render(num & _MASK32)
+        text = ":%x:%x:%x:%x:%x:%x:%x:%x:"%_ip6Words.unpack(
+                            _ip6Struct.pack(num >> 64, num & _MASK64)
+                        )
+        if text.find(":0:0:") < 0:
+            return text[1:-1]
+        for run in _ZERORUNS:
+            i = text.find(run)
+            if i > -1:
+                text = text[:i] + "::" + text[i+len(run):]
+                break
+        if text[:2] != "::":
+            text = text[1:]
+        if text[-2:] != "::":
+            text = text[:-1]
+        return text
 
     def mask(self, *args, **kwargs):
         """
@@ -356,32 +649,136 @@ class IP6Address(_IPBase):
         return IP6Mask(*args, **kwargs)
 
 
-class IP6Mask(IP6Address, _MaskMixin):
-    def __init__(self, mask):
-        if mask is None:
-            mask = 128
-        if isNumberLike(mask):
-            mask = self._ip6FromPrefix(mask)
-        IP6Address.__init__(self, mask)
-        self.prefix = self._countPrefix(self.bytes)
+class IP6Mask(_MaskMixin, IP6Address):
+    __slots__ = ("prefix",)
 
-    def _bytesFromIP6Prefix(self, prefix):
-        """
-            Produce a binary IPv6 address (netmask) from a prefix length.
-        """
-        if (prefix > 128) or (prefix < 0):
-            raise ValueError, "Prefix must be between 0 and 128."
-        addr = "\xff" * (prefix/8)
-        if prefix%8:
-            addr += chr((255 << (8-(prefix%8)))&255)
-        addr += "\0"*(16 - len(addr))
-        return addr
-
-    def _ip6FromPrefix(self, prefix):
-        """
-            Produce an IPv6 address (netmask) from a prefix length.
-        """
-        return IP6Mask.fromBytes(self._bytesFromIP6Prefix(prefix)).address
+IP6Mask._buildMasks()
+
+
+class LRUCache(object):
+    """
+        A bounded mapping that discards its least recently used entry when
+        it is full. Lookups are counted as hits or misses.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.hits = self.misses = 0
+        self._map = {}
+        # Entries form a circular doubly linked list of [prev, next, key,
+        # value] lists, with the least recently used entry after the root.
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def get(self, key, default=None):
+        link = self._map.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+        root = self._root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+        return link[3]
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        link = self._map.get(key)
+        if link is not None:
+            link[3] = value
+            return
+        root = self._root
+        while len(self._map) >= self.size:
+            oldest = root[1]
+            root[1] = oldest[1]
+            oldest[1][0] = root
+            del self._map[oldest[2]]
+        last = root[0]
+        link = [last, root, key, value]
+        last[1] = root[0] = self._map[key] = link
+
+    def pop(self, key, default=None):
+        link = self._map.pop(key, None)
+        if link is None:
+            return default
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+        return link[3]
+
+    def clear(self):
+        self._map.clear()
+        self._root[:] = [self._root, self._root, None, None]
+        self.hits = self.misses = 0
+
+    def resize(self, size):
+        self.size = size
+        root = self._root
+        while len(self._map) > max(size, 0):
+            oldest = root[1]
+            root[1] = oldest[1]
+            oldest[1][0] = root
+            del self._map[oldest[2]]
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._map),
+            "size": self.size
+        }
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return key in self._map
+
+
+# Address objects are immutable, so the objects created by Address and
+# AddressFromBytes are interned and shared between callers.
+INTERN_CACHE_SIZE = 8192
+_textCache = LRUCache(INTERN_CACHE_SIZE)
+_bytesCache = LRUCache(INTERN_CACHE_SIZE)
+
+def setInternCacheSize(size):
+    """
+        Set the number of entries kept by each of the address intern caches.
+        A size of 0 disables interning.
+    """
+    _textCache.resize(size)
+    _bytesCache.resize(size)
+
+
+def clearInternCache():
+    _textCache.clear()
+    _bytesCache.clear()
+
+
+def internCacheStats():
+    """
+        Return hit and miss counts for the text and bytes intern caches.
+    """
+    return {
+        "text": _textCache.stats(),
+        "bytes": _bytesCache.stats()
+    }
+
+
+def _addressClass(address):
+    """
+        Guess the address class from the characters in a text address,
+        without parsing it.
+    """
+    if ":" in address:
+        if address.count(":") == 5 and not "::" in address:
+            return EthernetAddress, IP6Address
+        return IP6Address, EthernetAddress
+    return IPAddress, None
 
 
 def Address(address):
@@ -390,28 +787,183 @@ def Address(address):
     """
     if isinstance(address, _AddrBase):
         return address
+    a = _textCache.get(address)
+    if a is not None:
+        return a
+    cls, alternative = _addressClass(address)
     try:
-        return IPAddress(address)
-    except ValueError:
-        pass
-    try:
-        return IP6Address(address)
+        a = cls(address)
     except ValueError:
-        pass
-    try:
-        return EthernetAddress(address)
-    except ValueError:
-        pass
-    raise ValueError, "Not a valid address."
+        if alternative is None:
+            raise ValueError, "Not a valid address."
+        try:
+            a = alternative(address)
+        except ValueError:
+            raise ValueError, "Not a valid address."
+    _textCache.put(address, a)
+    return a
 
 
 def AddressFromBytes(bytes):
+    a = _bytesCache.get(bytes)
+    if a is not None:
+        return a
     if len(bytes) == 4:
-        return IPAddress.fromBytes(bytes)
+        a = IPAddress.fromBytes(bytes)
     elif len(bytes) == 16:
-        return IP6Address.fromBytes(bytes)
+        a = IP6Address.fromBytes(bytes)
     else:
         raise ValueError, "Address not recognized."
+    _bytesCache.put(bytes, a)
+    return a
+
+
+class PackedAddresses(object):
+    """
+        A contiguous buffer of IP and IPv6 networks laid out as an array of
+        struct pfr_addr:
+
+            16 bytes    Address, in network byte order, zero-padded.
+            1 byte      Address family.
+            1 byte      Prefix length.
+            1 byte      Negation flag.
+            1 byte      Feedback code (filled in by the kernel).
+
+        Entries are parsed straight from text into the buffer, without
+        creating address objects. Lines that fail to parse are recorded in
+        the "errors" list as (line number, text, reason) tuples, and skipped.
+
+        The buffer is available as an array in the "buffer" attribute, and
+        can be handed to the pf table code as it stands.
+    """
+    ENTRY = struct.Struct("16sBBBB")
+    SIZE = ENTRY.size
+    # Entries are flushed to the buffer in chunks of this many.
+    _CHUNK = 4096
+    def __init__(self, lines=None):
+        self.buffer = array.array("B")
+        self.errors = []
+        self._lineno = 0
+        if lines is not None:
+            self.extend(lines)
+
+    @classmethod
+    def fromString(klass, data):
+        """
+            Wrap an existing packed buffer, e.g. one returned by the kernel.
+        """
+        if len(data) % klass.SIZE:
+            raise ValueError, "Buffer length is not a multiple of the entry size."
+        p = klass()
+        p.buffer.fromstring(data)
+        return p
+
+    def _pack(self, word):
+        negate = 0
+        if word[0] == "!":
+            negate = 1
+            word = word[1:]
+        prefix = None
+        if "/" in word:
+            word, prefix = word.split("/", 1)
+            if not prefix.isdigit():
+                raise ValueError, "Invalid prefix length."
+            prefix = int(prefix)
+        if ":" in word:
+            af, width, sockaf = AF_INET6, 128, socket.AF_INET6
+        else:
+            af, width, sockaf = AF_INET, 32, socket.AF_INET
+        try:
+            raw = socket.inet_pton(sockaf, word)
+        except (socket.error, ValueError):
+            raise ValueError, "Invalid address."
+        if prefix is None:
+            prefix = width
+        elif prefix > width:
+            raise ValueError, "Prefix must be between 0 and %s."%width
+        elif prefix < width:
+            # Clear host bits, as the kernel rejects networks that have them.
+            if af == AF_INET:
+                num = _ip4Struct.unpack(raw)[0]
+                raw = _ip4Struct.pack(num & ~((1L << (32 - prefix)) - 1) & _MASK32)
+            else:
+                hi, lo = _ip6Struct.unpack(raw)
+                num = ((long(hi) << 64) | lo) & ~((1L << (128 - prefix)) - 1)
+                raw = _ip6Struct.pack(num >> 64, num & _MASK64)
+        return self.ENTRY.pack(raw, af, prefix, negate, 0)
+
+    def append(self, text):
+        """
+            Add a single network, given as text. Raises ValueError if the
+            text can not be parsed.
+        """
+        self.buffer.fromstring(self._pack(text.strip()))
+
+    def extend(self, lines):
+        """
+            Parse an iterable of lines (such as an open file). Each line can
+            hold any number of whitespace-separated addresses or networks in
+            "address/prefix" form, optionally negated with a leading "!".
+            Anything after a "#" is a comment.
+        """
+        chunk = []
+        pack = self._pack
+        for line in lines:
+            self._lineno += 1
+            if "#" in line:
+                line = line[:line.index("#")]
+            for word in line.split():
+                try:
+                    chunk.append(pack(word))
+                except ValueError, v:
+                    self.errors.append((self._lineno, word, str(v)))
+            if len(chunk) >= self._CHUNK:
+                self.buffer.fromstring("".join(chunk))
+                chunk = []
+        self.buffer.fromstring("".join(chunk))
+
+    def tostring(self):
+        return self.buffer.tostring()
+
+    def __len__(self):
+        return len(self.buffer)/self.SIZE
+
+    def __getitem__(self, i):
+        """
+            Decode one entry, returning a (address, prefix, negate,
+            feedback) tuple.
+        """
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError, "Entry index out of range."
+        raw, af, prefix, negate, feedback = self.ENTRY.unpack(
+                self.buffer[i*self.SIZE:(i+1)*self.SIZE].tostring()
+            )
+        if af == AF_INET:
+            address = IPAddress.fromBytes(raw[:4])
+        else:
+            address = IP6Address.fromBytes(raw)
+        return address, prefix, negate, feedback
+
+    def __iter__(self):
+        data = self.buffer.tostring()
+        unpack = self.ENTRY.unpack_from
+        for i in xrange(0, len(data), self.SIZE):
+            raw, af, prefix, negate, feedback = unpack(data, i)
+            if af == AF_INET:
+                address = IPAddress.fromBytes(raw[:4])
+            else:
+                address = IP6Address.fromBytes(raw)
+            yield address, prefix, negate, feedback
+
+
+def parseAddresses(lines):
+    """
+        Parse an iterable of lines (such as an open file) holding addresses
+        and networks, into a PackedAddresses buffer.
+    """
+    return PackedAddresses(lines)
 
 
 def Mask(address):
@@ -429,4 +981,3 @@ def Mask(address):
     except ValueError:
         pass
     raise ValueError, "Not a valid mask."
-
@@ -0,0 +1,250 @@
+import random
+import libpry
+from openbsd.utils import *
+from openbsd.cidr import *
+
+class uParseNetwork(libpry.AutoTree):
+    def test_text(self):
+        a, m = parseNetwork("10.0.0.0/8")
+        assert a == "10.0.0.0"
+        assert m.prefix == 8
+
+    def test_mask(self):
+        a, m = parseNetwork("10.0.0.0", "255.255.0.0")
+        assert m.prefix == 16
+        a, m = parseNetwork(Address("fe80::"), 10)
+        assert m.prefix == 10
+
+    def test_hostbits(self):
+        a, m = parseNetwork("10.1.2.3/8")
+        assert a == "10.0.0.0"
+
+    def test_host(self):
+        a, m = parseNetwork("fe80::1")
+        assert m.prefix == 128
+
+    def test_err(self):
+        libpry.raises(ValueError, parseNetwork, "10.0.0.0/33")
+        libpry.raises(ValueError, parseNetwork, "00:00:00:00:00:01")
+
+
+class uRadixTree(libpry.AutoTree):
+    def setUp(self):
+        self.t = RadixTree([
+                    "10.0.0.0/8",
+                    "10.1.0.0/16",
+                    "10.1.2.0/24",
+                    "192.168.0.1",
+                    "fe80::/10",
+                ])
+
+    def test_len(self):
+        assert len(self.t) == 5
+        assert len(RadixTree()) == 0
+
+    def test_insert(self):
+        self.t.insert("10.1.2.0", 24, "foo")
+        assert len(self.t) == 5
+        assert self.t.get("10.1.2.0/24") == "foo"
+        self.t["172.16.0.0/12"] = "bar"
+        assert len(self.t) == 6
+        assert self.t["172.16.0.0/12"] == "bar"
+
+    def test_has_key(self):
+        assert self.t.has_key("10.1.0.0", 16)
+        assert self.t.has_key("192.168.0.1")
+        assert not self.t.has_key("10.1.0.0", 17)
+        assert not self.t.has_key("10.0.0.0/7")
+
+    def test_getitem(self):
+        assert self.t["10.0.0.0/8"] is True
+        libpry.raises(KeyError, self.t.__getitem__, "10.0.0.0/9")
+
+    def test_delete(self):
+        self.t.delete("10.1.0.0/16")
+        assert len(self.t) == 4
+        assert not self.t.has_key("10.1.0.0/16")
+        assert self.t.has_key("10.1.2.0/24")
+        assert self.t.lookup("10.1.3.1")[1].prefix == 8
+        libpry.raises(KeyError, self.t.delete, "10.1.0.0/16")
+        libpry.raises(KeyError, self.t.delete, "11.0.0.0/8")
+        for i in list(self.t):
+            self.t.delete(*i)
+        assert len(self.t) == 0
+        assert not list(self.t.items())
+
+    def test_lookup(self):
+        a, m, v = self.t.lookup("10.1.2.3")
+        assert a == "10.1.2.0"
+        assert m.prefix == 24
+        assert self.t.lookup("10.1.3.3")[1].prefix == 16
+        assert self.t.lookup("10.2.3.3")[1].prefix == 8
+        assert self.t.lookup("10.1.0.0/15")[1].prefix == 8
+        assert self.t.lookup("11.0.0.1") is None
+        assert self.t.lookup("fe80::1")[0] == "fe80::"
+        assert self.t.lookup("::1") is None
+
+    def test_contains(self):
+        assert "10.200.0.1" in self.t
+        assert "192.168.0.1" in self.t
+        assert not "192.168.0.2" in self.t
+        assert "fe80::1" in self.t
+
+    def test_covering(self):
+        x = [m.prefix for a, m, v in self.t.covering("10.1.2.3")]
+        assert x == [8, 16, 24]
+        assert not list(self.t.covering("11.0.0.0/8"))
+
+    def test_covered(self):
+        x = [(str(a), m.prefix) for a, m, v in self.t.covered("10.0.0.0/8")]
+        assert x == [("10.0.0.0", 8), ("10.1.0.0", 16), ("10.1.2.0", 24)]
+        x = [m.prefix for a, m, v in self.t.covered("10.1.0.0/15")]
+        assert x == [16, 24]
+        assert len(list(self.t.covered("0.0.0.0/0"))) == 4
+        assert not list(self.t.covered("10.2.0.0/16"))
+
+    def test_items(self):
+        x = [str(a) for a, m, v in self.t.items()]
+        assert x == ["10.0.0.0", "10.1.0.0", "10.1.2.0", "192.168.0.1", "fe80::"]
+
+    def test_update(self):
+        t = RadixTree()
+        t.update([
+                    {"address": Address("10.0.0.0"), "mask": IPMask(8)},
+                    ("fe80::", 10)
+                ])
+        assert len(t) == 2
+        assert t.has_key("fe80::/10")
+
+    def test_repr(self):
+        repr(self.t)
+
+
+def _expand(networks):
+    """
+        The naive expansion of a list of (address, mask) networks into the
+        set of (af, integer address) pairs they cover.
+    """
+    s = set()
+    for a, m in networks:
+        for i in range(1 << (a.WIDTH - m.prefix)):
+            s.add((a.af, long(a) + i))
+    return s
+
+
+class uSetOperations(libpry.AutoTree):
+    def _random(self, r, n):
+        nets = []
+        for i in range(n):
+            if r.random() < 0.8:
+                p = r.randrange(22, 33)
+                num = 0x0a000000 | (r.randrange(0, 1 << 10) & ~((1 << (32 - p)) - 1))
+                nets.append("%s/%s"%(IPAddress.fromInt(num), p))
+            else:
+                p = r.randrange(118, 129)
+                num = (0xfe80L << 112) | (r.randrange(0, 1 << 10) & ~((1 << (128 - p)) - 1))
+                nets.append("%s/%s"%(IP6Address.fromInt(num), p))
+        return nets
+
+    def test_aggregate(self):
+        x = [(str(a), m.prefix) for a, m in aggregate([
+                    "10.0.0.0/25",
+                    "10.0.0.128/25",
+                    "10.0.1.0/24",
+                    "10.0.1.7",
+                    "10.0.2.0/24",
+                    "fe80::/10",
+                    "fe80::/64",
+                ])]
+        assert x == [("10.0.0.0", 23), ("10.0.2.0", 24), ("fe80::", 10)]
+        assert not list(aggregate([]))
+
+    def test_unaligned(self):
+        x = [(str(a), m.prefix) for a, m in aggregate(["10.0.0.1", "10.0.0.2/31"])]
+        assert x == [("10.0.0.1", 32), ("10.0.0.2", 31)]
+
+    def test_operations(self):
+        a = ["10.0.0.0/24", "10.0.2.0/24"]
+        b = ["10.0.0.128/25", "10.0.1.0/24"]
+        x = [(str(i), m.prefix) for i, m in union(a, b)]
+        assert x == [("10.0.0.0", 23), ("10.0.2.0", 24)]
+        x = [(str(i), m.prefix) for i, m in intersection(a, b)]
+        assert x == [("10.0.0.128", 25)]
+        x = [(str(i), m.prefix) for i, m in difference(a, b)]
+        assert x == [("10.0.0.0", 25), ("10.0.2.0", 24)]
+
+    def test_random(self):
+        r = random.Random(0)
+        for i in range(200):
+            a = self._random(r, r.randrange(0, 20))
+            b = self._random(r, r.randrange(0, 20))
+            ea = _expand([parseNetwork(j) for j in a])
+            eb = _expand([parseNetwork(j) for j in b])
+            agg = list(aggregate(a))
+            assert _expand(agg) == ea
+            # The output is sorted and disjoint, and can't be reduced further.
+            assert sum([1 << (j.WIDTH - m.prefix) for j, m in agg]) == len(ea)
+            assert list(aggregate(agg)) == agg
+            assert _expand(union(a, b)) == ea | eb
+            assert _expand(intersection(a, b)) == ea & eb
+            assert _expand(difference(a, b)) == ea - eb
+
+
+class uRanges(libpry.AutoTree):
+    def test_hosts(self):
+        h = hosts("10.0.0.0/8")
+        assert len(h) == 2**24 - 2
+        assert h[0] == "10.0.0.1"
+        assert h[-1] == "10.255.255.254"
+        assert "10.1.2.3" in h
+        assert not "10.0.0.0" in h
+        assert not "11.0.0.1" in h
+        assert h.index("10.0.1.0") == 255
+        assert [str(i) for i in hosts("10.0.0.0/30")] == ["10.0.0.1", "10.0.0.2"]
+        assert [str(i) for i in hosts("10.0.0.0/31")] == ["10.0.0.0", "10.0.0.1"]
+        assert list(hosts("fe80::/127")) == ["fe80::", "fe80::1"]
+
+    def test_large(self):
+        h = hosts("2001:db8::/64")
+        assert h.size == 2**64
+        libpry.raises(OverflowError, len, h)
+        assert h
+        assert h[-1] == "2001:db8::ffff:ffff:ffff:ffff"
+        x = h[2**40:][:3]
+        assert len(x) == 3
+        assert list(x)[2] == "2001:db8::100:0:2"
+        libpry.raises(IndexError, h.__getitem__, 2**64)
+
+    def test_slice(self):
+        r = AddressRange("10.0.0.0", "10.0.0.9")
+        for s in [slice(2, 8, 3), slice(None, None, -4), slice(-3, None), slice(8, 2)]:
+            assert list(r[s]) == list(r)[s]
+        assert list(r[::-4][1:]) == ["10.0.0.5", "10.0.0.1"]
+        assert not AddressRange("10.0.0.5", "10.0.0.1")
+        libpry.raises(ValueError, AddressRange, "10.0.0.1", "::1")
+
+    def test_subnets(self):
+        s = subnets("10.0.0.0/24", prefix=26)
+        assert len(s) == 4
+        assert [(str(a), m.prefix) for a, m in s[1::2]] == [("10.0.0.64", 26), ("10.0.0.192", 26)]
+        assert "10.0.0.128/26" in s
+        assert not "10.0.0.128/25" in s
+        s = subnets("2001:db8::/32", prefix=64)
+        assert s.size == 2**32
+        assert s[16][0] == "2001:db8:0:10::"
+        assert s.index("2001:db8:0:10::/64") == 16
+        assert len(subnets("10.0.0.0/30")) == 4
+        libpry.raises(ValueError, subnets, "10.0.0.0/24", None, 16)
+
+    def test_repr(self):
+        repr(hosts("10.0.0.0/8"))
+        repr(AddressRange("10.0.0.5", "10.0.0.1"))
+        repr(subnets("10.0.0.0/8", prefix=24))
+
+
+tests = [
+    uParseNetwork(),
+    uRadixTree(),
+    uSetOperations(),
+    uRanges()
+]
@@ -0,0 +1,137 @@
+import collections, threading, urllib2
+import libpry
+from openbsd.exporter import *
+import openbsd.exporter
+
+_Snapshot = collections.namedtuple("_Snapshot", ["time", "interfaces", "ip", "icmp"])
+
+
+class _Netstat:
+    def __init__(self):
+        self.interfaces = {
+            "em0": {"mtu": 1500L, "ipackets": 10L, "ibytes": 1000L, "link_state": "UP"},
+            "lo0": {"mtu": 33208L, "ipackets": 3L, "ibytes": 300L, "link_state": "UNKNOWN"},
+        }
+        self.ip = {"total": 13L, "forward": 0L}
+        self.icmp = {"error": 0L, "inhist": {"echo": 2L}}
+
+    def snapshot(self, blocks = None):
+        return _Snapshot(1.0, self.interfaces, self.ip, self.icmp)
+
+
+class _PF:
+    def getStatistics(self):
+        return {
+            "running": 1, "states": 12, "hostid": 7, "ifname": "",
+            "counters": {"match": 40L, "bad-offset": 0L},
+            "packets": {"ipv4": {"in": {"pass": 9L, "block": 1L}}},
+            "bytes": {"ipv4": {"in": 900L, "out": 800L}},
+        }
+
+    def getInterfaces(self):
+        t = {"ipv4": {"in": {"pass": {"packets": 5L, "bytes": 500L}, "blocK": {"packets": 1L, "bytes": 60L}}}}
+        return {"em0": {"states": 4, "flags": 0, "trafinfo": t}}
+
+
+class _System:
+    cpustats = {"user": 10L, "idle": 90L}
+
+
+class uExporter(libpry.AutoTree):
+    def setUp(self):
+        self.n = _Netstat()
+        self.e = Exporter(self.n, _PF(), _System())
+
+    def test_render(self):
+        lines = self.e.render().splitlines()
+        assert lines[-1] == "# EOF"
+        for i in [
+                    "# TYPE openbsd_netstat_interface_ipackets counter",
+                    "openbsd_netstat_interface_ipackets_total{interface=\"em0\"} 10",
+                    "openbsd_netstat_interface_ipackets_total{interface=\"lo0\"} 3",
+                    "# TYPE openbsd_netstat_interface_mtu gauge",
+                    "openbsd_netstat_interface_mtu{interface=\"lo0\"} 33208",
+                    "openbsd_netstat_ip_total_total 13",
+                    "openbsd_netstat_icmp_inhist_total{type=\"echo\"} 2",
+                    "openbsd_pf_states 12",
+                    "openbsd_pf_counters_total{reason=\"bad-offset\"} 0",
+                    "openbsd_pf_packets_total{af=\"ipv4\",direction=\"in\",action=\"block\"} 1",
+                    "openbsd_pf_bytes_total{af=\"ipv4\",direction=\"out\"} 800",
+                    "openbsd_pf_interface_bytes_total{interface=\"em0\",af=\"ipv4\",direction=\"in\",action=\"block\"} 60",
+                    "openbsd_pf_interface_states{interface=\"em0\"} 4",
+                    "openbsd_cpu_ticks_total{mode=\"idle\"} 90",
+                ]:
+            assert i in lines
+        assert not [i for i in lines if "link_state" in i or "hostid" in i or "flags" in i]
+        # Each family is introduced once, before its samples.
+        types = [i.split()[2] for i in lines if i.startswith("# TYPE")]
+        assert len(types) == len(set(types))
+
+    def test_templates(self):
+        self.e.render()
+        g = self.e._groups["netstat_interface"]
+        template = g._template
+        self.n.interfaces["em0"]["ipackets"] = 11L
+        assert "{interface=\"em0\"} 11\n" in self.e.render()
+        assert g._template is template
+        self.n.interfaces["em1"] = {"mtu": 1500L, "ipackets": 1L, "ibytes": 2L, "link_state": "UP"}
+        assert "openbsd_netstat_interface_ibytes_total{interface=\"em1\"} 2\n" in self.e.render()
+        assert g._template is not template
+        for i in self.n.interfaces.values():
+            del i["ibytes"]
+            i["obytes"] = 5L
+        assert "openbsd_netstat_interface_obytes_total{interface=\"em0\"} 5\n" in self.e.render()
+
+    def test_nested(self):
+        self.e.render()
+        self.n.icmp["inhist"]["unreach"] = 1L
+        x = self.e.render()
+        assert "openbsd_netstat_icmp_inhist_total{type=\"echo\"} 2\n" in x
+        assert "openbsd_netstat_icmp_inhist_total{type=\"unreach\"} 1\n" in x
+        self.n.icmp["inhist"] = {"echo": 3L}
+        x = self.e.render()
+        assert "{type=\"echo\"} 3\n" in x
+        assert not "unreach" in x
+
+    def test_mismatched(self):
+        self.e.render()
+        # Rows need not share their counters.
+        self.n.interfaces["em0"]["obytes"] = 5L
+        del self.n.interfaces["lo0"]["ipackets"]
+        x = self.e.render()
+        assert "openbsd_netstat_interface_obytes_total{interface=\"em0\"} 5\n" in x
+        assert not "obytes_total{interface=\"lo0\"}" in x
+        assert "openbsd_netstat_interface_ipackets_total{interface=\"em0\"} 10\n" in x
+        assert not "ipackets_total{interface=\"lo0\"}" in x
+        assert len([i for i in x.splitlines() if i == "# TYPE openbsd_netstat_interface_obytes counter"]) == 1
+        self.n.interfaces["em0"]["obytes"] = "x"
+        assert not "obytes" in self.e.render()
+
+    def test_escape(self):
+        self.n.interfaces = {"a\"%d\\": {"ipackets": 1L}}
+        assert "{interface=\"a\\\"%d\\\\\"} 1\n" in self.e.render()
+
+    def test_partial(self):
+        e = Exporter(system=_System(), prefix="host")
+        assert e.render() == "# TYPE host_cpu_ticks counter\nhost_cpu_ticks_total{mode=\"idle\"} 90\nhost_cpu_ticks_total{mode=\"user\"} 10\n# EOF\n"
+        assert Exporter().render() == "# EOF\n"
+
+    def test_serve(self):
+        s = self.e.serve(("127.0.0.1", 0))
+        t = threading.Thread(target=s.serve_forever)
+        t.start()
+        try:
+            url = "http://127.0.0.1:%d"%s.server_address[1]
+            r = urllib2.urlopen(url + "/metrics")
+            assert r.info()["Content-Type"] == CONTENT_TYPE
+            assert r.read().endswith("# EOF\n")
+            libpry.raises(urllib2.HTTPError, urllib2.urlopen, url + "/")
+        finally:
+            s.shutdown()
+            s.server_close()
+            t.join()
+
+
+tests = [
+    uExporter()
+]
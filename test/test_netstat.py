@@ -1,6 +1,131 @@
-import os
+import os, sys, struct
 import openbsd.netstat
 import libpry
+# The _netstat stand-in, shared with the benchmarks.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bench"))
+import recordednetstat
+
+
+class uNetstatSnapshot(libpry.AutoTree):
+    def setUp(self):
+        self.real = openbsd.netstat._netstat
+        openbsd.netstat._netstat = recordednetstat
+        self.n = openbsd.netstat.Netstat()
+        del recordednetstat.calls[:]
+
+    def tearDown(self):
+        openbsd.netstat._netstat = self.real
+
+    def test_snapshot(self):
+        blocks = ["interfaces", "ip", "tcp", "udp", "icmp"]
+        s = self.n.snapshot(blocks)
+        assert recordednetstat.calls == [("snapshot", 5)]
+        assert s.time > 0
+        assert s.interfaces == self.n.ifstats()
+        assert s.ip == self.n.ipstats()
+        assert s.tcp == self.n.tcpstats()
+        assert s.udp == self.n.udpstats()
+        assert s.icmp == self.n.icmpstats()
+        assert s.ip6 is None
+        libpry.raises(AttributeError, setattr, s, "ip", {})
+
+    def test_blocks(self):
+        libpry.raises(ValueError, self.n.snapshot, ["ip", "nonexistent"])
+        assert self.n.snapshot([]).ip is None
+
+
+class uRateTracker(libpry.AutoTree):
+    def _snap(self, t, ifaces, tcp=None):
+        fields = dict([(i, None) for i in openbsd.netstat.NetstatSnapshot.BLOCKS])
+        fields["interfaces"] = dict([
+                (k, {"ipackets": v[0], "ibytes": v[1], "mtu": 1500L, "link_state": "UP"})
+                for k, v in ifaces.items()
+            ])
+        fields["tcp"] = tcp
+        return openbsd.netstat.NetstatSnapshot(time=t, **fields)
+
+    def test_rates(self):
+        r = openbsd.netstat.RateTracker(None, ["interfaces", "tcp"], width=32)
+        tcp = {"sndtotal": 10L, "outhist": {"echo": 1L}}
+        assert r.update(self._snap(10.0, {"em0": (100, 1000), "em1": (0, 0)}, tcp)) == {}
+        assert r.appeared == ["em0", "em1"]
+        assert not r.rates()
+        tcp = {"sndtotal": 30L, "outhist": {"echo": 5L}}
+        d = r.update(self._snap(12.0, {"em0": (300, 2000), "em1": (4, 8)}, tcp))
+        assert d["interfaces"]["em0"] == {"ipackets": 200, "ibytes": 1000}
+        assert d["tcp"] == {"sndtotal": 20, "outhist/echo": 4}
+        assert r.rates()["interfaces"]["em0"]["ipackets"] == 100.0
+        assert r.rates()["tcp"]["sndtotal"] == 10.0
+        assert not r.appeared and not r.disappeared
+
+    def test_wrap(self):
+        r = openbsd.netstat.RateTracker(None, ["interfaces"], width=32)
+        r.update(self._snap(0.0, {"em0": (2**32 - 10, 5000)}))
+        d = r.update(self._snap(1.0, {"em0": (5, 10)}))
+        # ipackets wrapped, and ibytes is too far back to have wrapped.
+        assert d["interfaces"]["em0"] == {"ipackets": 15, "ibytes": 10}
+        assert r.wraps == 1
+        assert r.resets == 1
+
+    def test_interfaces(self):
+        r = openbsd.netstat.RateTracker(None, ["interfaces"])
+        r.update(self._snap(0.0, {"em0": (1, 1), "em1": (1, 1)}))
+        d = r.update(self._snap(1.0, {"em0": (2, 2), "vlan5": (1, 1)}))
+        assert d["interfaces"].keys() == ["em0"]
+        assert r.appeared == ["vlan5"]
+        assert r.disappeared == ["em1"]
+        assert len(r._prev) == 2
+
+    def test_changed(self):
+        r = openbsd.netstat.RateTracker(None, ["interfaces"])
+        r.update(self._snap(0.0, {"em0": (1, 1), "em1": (1, 1)}))
+        s = self._snap(1.0, {"em0": (2, 2), "em1": (2, 2)})
+        s.interfaces["em1"]["obytes"] = 7L
+        d = r.update(s)
+        assert d["interfaces"].keys() == ["em0"]
+        assert r.changed == ["em1"]
+        assert not r.appeared
+        assert len(r._names) == 2
+        s = self._snap(2.0, {"em0": (3, 3)})
+        r.update(s)
+        assert r.disappeared == ["em1"]
+        assert len(r._names) == 1
+
+
+IFLIST_LAYOUT = recordednetstat.IFLIST_LAYOUT
+_ifMessage = recordednetstat.ifMessage
+
+
+class uParseIfList(libpry.AutoTree):
+    def test_parse(self):
+        em0 = {"mtu": 1500, "baudrate": 1000000000, "ipackets": 2**40 + 7, "obytes": 12345}
+        # An RTM_NEWADDR message, which is skipped.
+        newaddr = struct.pack("<HBB", 20, 4, 12) + "\x00"*16
+        data = "".join([
+                    _ifMessage("lo0", 1, {"mtu": 33208, "ipackets": 10}, link_state=0),
+                    newaddr,
+                    _ifMessage("em0", 2, em0, dst=True),
+                    _ifMessage("vlan100", 3, {}, link_state=2),
+                ])
+        x = openbsd.netstat.parseIfList(data, IFLIST_LAYOUT, "<")
+        assert sorted(x) == ["em0", "lo0", "vlan100"]
+        assert sorted(x["em0"]) == sorted(IFLIST_LAYOUT["fields"])
+        assert x["em0"]["ipackets"] == 2**40 + 7
+        assert x["em0"]["obytes"] == 12345
+        assert x["em0"]["link_state"] == "FULL DUPLEX"
+        assert x["lo0"]["mtu"] == 33208
+        assert x["lo0"]["link_state"] == "UNKNOWN"
+        assert x["vlan100"]["link_state"] == "DOWN"
+        assert openbsd.netstat.parseIfList("", IFLIST_LAYOUT, "<") == {}
+
+    def test_malformed(self):
+        data = _ifMessage("em0", 1, {}, link_state=3)
+        libpry.raises(ValueError, openbsd.netstat.parseIfList, data, IFLIST_LAYOUT, "<")
+        libpry.raises(
+            openbsd.netstat.OException, openbsd.netstat.parseIfList,
+            "\x00"*32, IFLIST_LAYOUT, "<"
+        )
+
 
 class uNetstat(libpry.AutoTree):
     def setUp(self):
@@ -12,6 +137,14 @@ class uNetstat(libpry.AutoTree):
     def test_ifstats(self):
         assert self.n.ifstats()["lo0"]
 
+    def test_sysctl(self):
+        n = openbsd.netstat.Netstat(backend="sysctl")
+        x, y = n.ifstats(), self.n.ifstats()
+        assert sorted(x) == sorted(y)
+        assert sorted(x["lo0"]) == sorted(y["lo0"])
+        assert n.snapshot(["interfaces"]).interfaces["lo0"]
+        libpry.raises(ValueError, openbsd.netstat.Netstat, "nonexistent")
+
     def test_ipstats(self):
         assert self.n.ipstats()
 
@@ -42,7 +175,28 @@ class uNetstat(libpry.AutoTree):
     def test_ipcompstats(self):
         assert self.n.ipcompstats()
 
-tests = []
+    def test_snapshot(self):
+        before = self.n.tcpstats()
+        s = self.n.snapshot()
+        assert s.interfaces["lo0"]
+        for k, v in before.items():
+            assert s.tcp[k] >= v
+        assert self.n.snapshot().time >= s.time
+        assert self.n.snapshot(["ip"]).tcp is None
+
+    def test_rates(self):
+        r = openbsd.netstat.RateTracker(self.n, ["interfaces", "ip", "tcp"])
+        r.update()
+        d = r.update()
+        assert d["interfaces"]["lo0"]["ipackets"] >= 0
+        assert r.elapsed > 0
+        assert r.rates()["ip"]
+
+tests = [
+    uNetstatSnapshot(),
+    uRateTracker(),
+    uParseIfList()
+]
 if os.geteuid() == 0:
     tests.append(
         uNetstat()
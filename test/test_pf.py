@@ -1,6 +1,9 @@
-import os, pprint
+import os, sys, pprint, array, struct, errno
 import openbsd.pf
 import libpry
+# The _pf stand-in, shared with the benchmarks.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bench"))
+import recordedpf
 from openbsd._sysvar import *
 from openbsd.utils import *
 
@@ -59,6 +62,66 @@ class uTable(libpry.AutoTree):
         ao = Address("192.168.0.1")
         libpry.raises(openbsd.pf.OException, self.tbl.deleteAddress, ao)
 
+    def test_addAddresses(self):
+        fb = self.tbl.addAddresses(["192.168.0.1", "10.0.0.0/8", "fe80::/10", "10.0.0.0/8", "nonsense"])
+        assert fb.count == 3
+        assert len(fb) == 5
+        assert fb.counts() == {"added": 3, "duplicate": 1, "invalid": 1}
+        assert [i["feedback"] for i in fb] == ["added", "added", "added", "duplicate", "invalid"]
+        assert len(self.tbl.getAddresses()) == 3
+        fb = self.tbl.addAddresses(self.tbl.getAddresses())
+        assert fb.count == 0
+
+    def test_addAddresses_packed(self):
+        p = parseAddresses(["192.168.0.1", "!192.168.0.0/24"])
+        assert self.tbl.addAddresses(p).count == 2
+        assert self.tbl.addAddresses(p).count == 0
+
+    def test_addAddresses_dummy(self):
+        assert self.tbl.addAddresses(["192.168.0.1", "::1"], dummy=1).count == 2
+        assert not self.tbl.getAddresses()
+
+    def test_deleteAddresses(self):
+        self.tbl.addAddresses(["192.168.0.1", "10.0.0.0/8"])
+        fb = self.tbl.deleteAddresses([("10.0.0.0", 8), "192.168.0.2"])
+        assert fb.count == 1
+        assert fb.counts() == {"deleted": 1, "none": 1}
+        assert len(self.tbl.getAddresses()) == 1
+        repr(fb)
+
+    def test_getAddressesPacked(self):
+        self.tbl.addAddresses(["192.168.0.1", "fe80::/10"])
+        p = self.tbl.getAddressesPacked()
+        assert len(p) == 2
+        assert [i[0] for i in p] == ["192.168.0.1", "fe80::"]
+
+    def test_replace(self):
+        self.tbl.addAddresses(["192.168.0.1", "192.168.0.2", "!10.0.0.0/8"])
+        r = self.tbl.replace(["192.168.0.2", "192.168.0.3", "10.0.0.0/8", "192.168.0.3", "x"])
+        assert r["added"] == 2
+        assert r["deleted"] == 2
+        assert r["unchanged"] == 1
+        assert r["invalid"] == 1
+        assert r["timings"].has_key("delta")
+        x = [(str(i[0]), i[2]) for i in self.tbl.getAddressesPacked()]
+        x.sort()
+        assert x == [("10.0.0.0", 0), ("192.168.0.2", 0), ("192.168.0.3", 0)]
+        r = self.tbl.replace([])
+        assert r["deleted"] == 3
+        assert not self.tbl.getAddresses()
+
+    def test_replace_atomic(self):
+        self.tbl.addAddresses(["192.168.0.1", "192.168.0.2"])
+        r = self.tbl.replace(["192.168.0.2", "!192.168.0.3"], atomic=1)
+        assert r["added"] == 1
+        assert r["deleted"] == 1
+        assert len(self.tbl.getAddresses()) == 2
+
+    def test_replace_dummy(self):
+        self.tbl.addAddresses(["192.168.0.1"])
+        assert self.tbl.replace(["192.168.0.2"], dummy=1)["added"] == 1
+        assert self.tbl.getAddresses()[0]["address"] == "192.168.0.1"
+
     def test_repr(self):
         repr(self.tbl)
 
@@ -119,6 +182,29 @@ class uTables(libpry.AutoTree):
         assert len(self.p["pftest"].tables) == 2
         assert len(self.p["pftest"].tables.keys()) == 2
 
+    def test_cache(self):
+        t = self.p["pftest"].tables
+        t.enableCache()
+        assert len(t) == 2
+        assert t.has_key("one")
+        assert t["two"].name == "two"
+        assert t.cacheStats()["hits"] == 2
+        assert t.cacheStats()["misses"] == 1
+        # Mutations through the container invalidate the snapshot.
+        t.add("three")
+        assert t.has_key("three")
+        assert t.cacheStats()["misses"] == 2
+        # Changes made elsewhere are only seen after a refresh.
+        self.p["pftest"].tables.delete("three")
+        assert t.has_key("three")
+        t.refresh()
+        assert not t.has_key("three")
+        t.enableCache(0)
+        len(t), len(t)
+        assert t.cacheStats()["misses"] == 5
+        t.disableCache()
+        assert not t.cacheStats()["enabled"]
+
 
 class uAnchor(libpry.AutoTree):
     def setUp(self):
@@ -158,6 +244,34 @@ class uAnchorContainment(libpry.AutoTree):
     def test_items(self):
         assert self.p.items()
 
+    def test_walk(self):
+        self.p["pftest"]["sub"].tables.add("baz")
+        try:
+            x = [a.name for a in self.p.depthFirst()]
+            assert x[0] == ""
+            assert x.index("pftest") + 1 == x.index("pftest/sub")
+            y = [a.name for a in self.p.breadthFirst()]
+            assert sorted(x) == sorted(y)
+            assert y.index("pftest2") < y.index("pftest/sub")
+            t = {}
+            for a, tables in self.p["pftest"].depthFirst(tables=True):
+                t[a.name] = tables.keys()
+            assert t == {"pftest": ["foo"], "pftest/sub": ["baz"]}
+        finally:
+            self.p["pftest"]["sub"].tables.delete("baz")
+
+    def test_cache(self):
+        self.p.enableCache()
+        assert self.p.has_key("pftest")
+        self.p["pftest3"].tables.add("baz")
+        try:
+            assert not self.p.has_key("pftest3")
+            self.p.refresh()
+            assert self.p.has_key("pftest3")
+        finally:
+            self.p["pftest3"].tables.delete("baz")
+        assert self.p.cacheStats()["misses"] == 2
+
 
 class uPF(libpry.AutoTree):
     def setUp(self):
@@ -194,6 +308,46 @@ class uPF(libpry.AutoTree):
     def test_getStates(self):
         self.p.getStates()
 
+    def test_iterStates(self):
+        b = self.p.getStatesRaw()
+        for i in self.p.iterStates():
+            i.proto, i.ext.address
+
+    def test_sampler(self):
+        s = openbsd.pf.StatsSampler(interval=0.01, size=4)
+        assert not s.rates()
+        s.run(count=5)
+        assert len(s) == 4
+        assert len(s.samples()[0][1]) == len(s.names)
+        v = s.values()
+        assert "packets/ipv4/in/pass" in v
+        if s._ifnames:
+            name = "interfaces/%s/ipv6/out/block/bytes"%s._ifnames[0]
+            assert name in s.names
+            assert name in v
+        assert not [i for i in s.names if "blocK" in i]
+        r = s.rates()
+        assert not "states" in r
+        assert r["packets/ipv4/in/pass"] >= 0
+        assert set(s.deltas()) == set(r)
+        assert set(s.average()) == set(r)
+
+    def test_lookup(self):
+        for i in self.p.findStates(proto=IPPROTO_TCP)[:5]:
+            assert self.p.getState(i.id, i.creatorid).id == i.id
+        assert self.p.lookupState(IPPROTO_TCP, "192.0.2.1", "192.0.2.2", 1, 2) is None
+        assert self.p.getState(0, 0) is None
+
+    def test_killStatesBatch(self):
+        total, counts = self.p.killStatesBatch([
+                            ("0.0.0.0/24", None, None, None, None, None),
+                            {"src": "0.0.0.7", "interface": "lo0"},
+                            {"dst": "0.0.0.7", "dstport": 22},
+                        ])
+        assert counts[1] == 0
+        assert total == sum(counts)
+        assert self.p.killStatesBatch([]) == (0, [])
+
     def test_clearStates(self):
         self.p.clearStates()
         self.p.clearStates("lo0")
@@ -222,6 +376,451 @@ class uPF(libpry.AutoTree):
         repr(self.p)
 
 
+def _stateRecord(**kwargs):
+    """
+        Pack a single pfsync_state record, using the layout exported by the
+        _pf module.
+    """
+    L = openbsd.pf._STATE_LAYOUT
+    rec = array.array("B", [0]*L["size"])
+    def put(fmt, off, *values):
+        struct.pack_into(fmt, rec, off, *values)
+    put("!Q", L["id"], kwargs.get("id", 1))
+    put("!I", L["creatorid"], kwargs.get("creatorid", 2))
+    put("16s", L["ifname"], kwargs.get("ifname", "em0"))
+    put("B", L["af"], kwargs.get("af", AF_INET))
+    put("B", L["proto"], kwargs.get("proto", 6))
+    put("B", L["direction"], kwargs.get("direction", PFDIR_OUT))
+    put("!I", L["expire"], kwargs.get("expire", 30))
+    for name in ("lan", "gwy", "ext"):
+        address, port = kwargs.get(name, ("10.0.0.1", 80))
+        put("16s", L[name], Address(address).bytes)
+        put("!H", L[name] + L["host_port"], port)
+    put("!IIII", L["packets"], *kwargs.get("packets", (0, 1, 0, 2)))
+    put("!IIII", L["bytes"], *kwargs.get("bytes", (1, 0, 0, 5)))
+    put("B", L["src"] + L["peer_state"], kwargs.get("srcstate", 4))
+    return rec.tostring()
+
+
+class uStateRecord(libpry.AutoTree):
+    def test_fields(self):
+        b = openbsd.pf.StateBuffer(_stateRecord(ext=("192.168.0.9", 443)))
+        assert len(b) == 1
+        s = b[0]
+        assert s.id == 1
+        assert s.creatorid == 2
+        assert s.ifname == "em0"
+        assert s.af == AF_INET
+        assert s.proto == 6
+        assert s.direction == PFDIR_OUT
+        assert s.expire == 30
+        assert s.ext["address"] == "192.168.0.9"
+        assert s.ext.port == 443
+        assert s.packets == {"out": 1, "in": 2}
+        assert s.bytes == {"out": 1 << 32, "in": 5}
+        assert s.src["state"] == 4
+        repr(s)
+
+    def test_ip6(self):
+        b = openbsd.pf.StateBuffer(_stateRecord(af=AF_INET6, lan=("fe80::1", 22)))
+        assert b[0].lan.address == "fe80::1"
+
+    def test_buffer(self):
+        data = "".join([_stateRecord(id=i) for i in range(5)])
+        b = openbsd.pf.StateBuffer(data)
+        assert [i.id for i in b] == range(5)
+        assert b[-1].id == 4
+        assert b.view.tobytes() == data
+        libpry.raises(IndexError, b.__getitem__, 5)
+        libpry.raises(openbsd.pf.OException, openbsd.pf.StateBuffer, data[:-1])
+
+
+class u_TablesCache(libpry.AutoTree):
+    class _TablePF:
+        """
+            Stands in for _pf. Each change lists the tables before it takes
+            effect, as another thread might.
+        """
+        def __init__(self):
+            self.tables = {"one": {}}
+            self.listing = None
+        def get_tables(self, anchor):
+            return dict(self.tables)
+        def add_table(self, name, anchor, tflags, iflags):
+            self.listing.keys()
+            self.tables[name] = {}
+            return 1
+        def delete_table(self, name, anchor, tflags, iflags):
+            self.listing.keys()
+            del self.tables[name]
+            return 1
+        def clear_tables(self, anchor, iflags):
+            self.listing.keys()
+            n = len(self.tables)
+            self.tables.clear()
+            return n
+
+    def test_mutations(self):
+        pf = openbsd.pf._pf
+        openbsd.pf._pf = self._TablePF()
+        try:
+            t = openbsd.pf.Tables("")
+            openbsd.pf._pf.listing = t
+            t.enableCache()
+            t.add("two")
+            assert sorted(t.keys()) == ["one", "two"]
+            t.delete("one")
+            assert t.keys() == ["two"]
+            assert t.clear() == 1
+            assert not len(t)
+        finally:
+            openbsd.pf._pf = pf
+
+
+class u_lookupState(libpry.AutoTree):
+    class _StatePF:
+        """
+            Stands in for _pf, with one state, and a get_state that fails
+            with the given errno.
+        """
+        def __init__(self, err):
+            self.err, self.scans = err, 0
+        def _init(self):
+            pass
+        def get_states_raw(self):
+            self.scans += 1
+            return _stateRecord(ext=("192.0.2.9", 443))
+        def get_state(self, id, creatorid):
+            raise openbsd.pf.OException(self.err, "error")
+
+    def _lookups(self, err):
+        pf = openbsd.pf._pf
+        openbsd.pf._pf = self._StatePF(err)
+        try:
+            p = openbsd.pf.PF()
+            for i in range(3):
+                assert p.lookupState(6, "10.0.0.1", "192.0.2.9", 80, 443).id == 1
+            return p, openbsd.pf._pf.scans
+        finally:
+            openbsd.pf._pf = pf
+
+    def test_transient(self):
+        p, scans = self._lookups(errno.EIO)
+        assert p._stateQuery
+        assert scans == 3
+
+    def test_unsupported(self):
+        p, scans = self._lookups(errno.ENOTTY)
+        assert not p._stateQuery
+        assert len(p._stateKeys) == 1
+
+
+class u_getStatesRaw(libpry.AutoTree):
+    def setUp(self):
+        self.real = openbsd.pf._pf
+        openbsd.pf._pf = recordedpf
+        recordedpf.makeStates(10)
+
+    def tearDown(self):
+        recordedpf.growth = 0
+        recordedpf.makeStates(0)
+        openbsd.pf._pf = self.real
+
+    def test_growing(self):
+        recordedpf.growth = 0.5
+        b = openbsd.pf.PF().getStatesRaw()
+        assert len(b) == len(recordedpf.states)/recordedpf.STATE_LAYOUT["size"]
+        assert len(b) > 10
+
+    def test_outgrown(self):
+        recordedpf.growth = 2
+        try:
+            openbsd.pf.PF().getStatesRaw()
+        except openbsd.pf.OException, v:
+            assert v.args[0] == errno.EAGAIN
+        else:
+            raise AssertionError("Expected EAGAIN.")
+
+
+class uStatsSampler(libpry.AutoTree):
+    class _SamplerPF:
+        """
+            Stands in for _pf, returning a scripted sequence of
+            (stats, ifaces) pairs.
+        """
+        def __init__(self, script):
+            self.script = list(script)
+        def get_stats(self):
+            return self.script[0][0]
+        def get_ifaces(self):
+            return self.script.pop(0)[1]
+
+    def _stats(self, n, since=1000, match=None):
+        if match is None:
+            match = n
+        return {
+            "states": 5, "src_nodes": 0, "since": since,
+            "counters": {"match": match}, "limits": {},
+            "state_table": {"searches": 2*n}, "source_tracking_table": {},
+            "packets": [n]*12, "bytes": [n]*4,
+        }
+
+    def _ifaces(self, n, *names):
+        return dict([(i, {"trafinfo": [n]*16}) for i in names])
+
+    def _sampler(self, script, times):
+        pf = openbsd.pf._pf
+        openbsd.pf._pf = self._SamplerPF(script)
+        try:
+            s = openbsd.pf.StatsSampler(size=4)
+            for t in times:
+                s.sample(t)
+            return s
+        finally:
+            openbsd.pf._pf = pf
+
+    def test_rates(self):
+        s = self._sampler(
+                [(self._stats(n), self._ifaces(n, "em0")) for n in (0, 10, 30)],
+                (10.0, 12.0, 14.0)
+            )
+        assert len(s) == 3
+        assert s.values()["states"] == 5
+        d = s.deltas()
+        assert d["counters/match"] == 20
+        assert d["state_table/searches"] == 40
+        assert d["interfaces/em0/ipv4/in/block/bytes"] == 20
+        assert not "states" in d
+        r = s.rates()
+        assert r["counters/match"] == 10
+        assert r["packets/ipv6/out/unknown"] == 10
+        a = s.average()
+        assert a["counters/match"] == 7.5
+        assert a["interfaces/em0/ipv6/out/pass/packets"] == 7.5
+        assert s.resets == 0
+
+    def test_backwards(self):
+        script = [
+            (self._stats(100), {}),
+            (self._stats(110, match=40), {}),
+            (self._stats(120, match=50), {}),
+        ]
+        s = self._sampler(script[:2], (1.0, 2.0))
+        assert s.resets == 1
+        assert s.deltas()["counters/match"] == 40
+        assert s.deltas()["state_table/searches"] == 20
+        s = self._sampler(script, (1.0, 2.0, 3.0))
+        assert s.resets == 1
+        assert s.deltas()["counters/match"] == 10
+        assert s.average()["counters/match"] == 25
+
+    def test_restart(self):
+        s = self._sampler(
+                [(self._stats(100), {}), (self._stats(7, since=2000), {})],
+                (1.0, 2.0)
+            )
+        assert s.resets == 1
+        d = s.deltas()
+        assert d["counters/match"] == 7
+        assert d["packets/ipv4/in/pass"] == 7
+        assert s.rates()["state_table/searches"] == 14
+
+    def test_interfaces(self):
+        s = self._sampler(
+                [
+                    (self._stats(0), self._ifaces(0, "em0")),
+                    (self._stats(10), self._ifaces(10, "em0")),
+                    (self._stats(20), self._ifaces(20, "em0", "em1")),
+                ],
+                (1.0, 2.0, 3.0)
+            )
+        assert len(s) == 1
+        assert not s.deltas()
+        assert not s.rates()
+        assert "interfaces/em1/ipv4/in/pass/bytes" in s.names
+        assert s.values()["interfaces/em1/ipv4/in/pass/bytes"] == 20
+        assert s.resets == 0
+
+
+class uStateSnapshot(libpry.AutoTree):
+    def setUp(self):
+        self.s = openbsd.pf.StateSnapshot("".join([
+                    _stateRecord(id=1, ifname="em0", proto=6, bytes=(0, 10, 0, 1)),
+                    _stateRecord(id=2, ifname="em1", proto=17, bytes=(1, 0, 0, 2)),
+                    _stateRecord(id=3, ifname="em0", proto=6, bytes=(0, 30, 0, 3),
+                                    ext=("192.168.0.9", 443)),
+                    _stateRecord(id=4, ifname="em0", af=AF_INET6, proto=17,
+                                    bytes=(0, 40, 0, 4), ext=("fe80::1", 53)),
+                ]))
+
+    def test_columns(self):
+        s = self.s
+        assert len(s) == 4
+        assert list(s.column("id")) == [1, 2, 3, 4]
+        assert list(s.column("bytes_out")) == [10, 1 << 32, 30, 40]
+        assert list(s.column("bytes")) == [11, (1 << 32) + 2, 33, 44]
+        assert list(s.column("ext_port")) == [80, 80, 443, 53]
+        assert s.ifnames == ["em0", "em1"]
+        assert list(s.column("ifname")) == [0, 1, 0, 0]
+        assert s.record(2).ext.address == "192.168.0.9"
+        libpry.raises(KeyError, s.column, "foo")
+        assert len(openbsd.pf.StateSnapshot("")) == 0
+        s = openbsd.pf.StateSnapshot(
+                    _stateRecord(ifname="trunk123456789") + _stateRecord(ifname="em0")
+                )
+        assert s.ifnames == ["em0", "trunk123456789"]
+        assert list(s.column("ifname")) == [1, 0]
+
+    def test_groupBy(self):
+        s = self.s
+        assert s.groupBy("proto") == {6: 2, 17: 2}
+        assert s.groupBy("ifname", "bytes_in") == {"em0": 8, "em1": 2}
+        assert s.groupBy(("ifname", "proto"), "bytes_in") == {
+                    ("em0", 6): 4, ("em0", 17): 4, ("em1", 17): 2
+                }
+        x = s.groupBy("ext", "bytes_in")
+        assert x[Address("10.0.0.1")] == 3
+        assert x[Address("fe80::1")] == 4
+        # The same answers by way of the per-key loop.
+        s.PASSES = 0
+        assert s.groupBy("ifname", "bytes_in") == {"em0": 8, "em1": 2}
+        assert s.groupBy(("ifname", "proto")) == {("em0", 6): 2, ("em0", 17): 1, ("em1", 17): 1}
+
+    def test_sort(self):
+        s = self.s
+        assert s.top(2, "bytes_out") == [(1, 1 << 32), (3, 40)]
+        assert s.top(1, "bytes_in", "ifname") == [("em0", 8)]
+        assert s.argsort("bytes_in", reverse=True) == [3, 2, 1, 0]
+        assert list(s.take("id", s.argsort("bytes_out"))) == [1, 3, 4, 2]
+
+    def test_export(self):
+        col = self.s.column("bytes_in")
+        x = self.s.export("bytes_in").__array_interface__
+        assert x["shape"] == (4,)
+        assert x["data"][0] == col.buffer_info()[0]
+        assert str(buffer(col)) == col.tostring()
+
+class uStateDiffer(libpry.AutoTree):
+    def test_update(self):
+        d = openbsd.pf.StateDiffer()
+        c = d.update("".join([_stateRecord(id=i) for i in range(3)]))
+        assert [i.id for i in c.new] == [0, 1, 2]
+        assert not c.updated and not c.expired
+        assert len(d) == 3
+        c = d.update("".join([
+                    _stateRecord(id=1, creatorid=2),
+                    _stateRecord(id=2, bytes=(1, 0, 0, 9)),
+                    _stateRecord(id=3),
+                ]))
+        assert [i.id for i in c.new] == [3]
+        assert c.expired == {
+            (2, 0): {"packets": {"out": 1, "in": 2}, "bytes": {"out": 1 << 32, "in": 5}}
+        }
+        assert len(c.updated) == 1
+        rec, delta = c.updated[0]
+        assert rec.id == 2
+        assert delta == {"packets": {"out": 0, "in": 0}, "bytes": {"out": 0, "in": 4}}
+        assert len(c) == 3
+        repr(c)
+
+    def test_reset(self):
+        d = openbsd.pf.StateDiffer()
+        d.update(_stateRecord(bytes=(0, 10, 0, 10)))
+        c = d.update(_stateRecord(bytes=(0, 3, 0, 12)))
+        assert c.updated[0][1]["bytes"] == {"out": 3, "in": 2}
+        assert not d.update(_stateRecord(bytes=(0, 3, 0, 12)))
+        c = d.update(openbsd.pf.StateBuffer(""))
+        assert c.expired.keys() == [(2, 1)]
+
+class u_StateFilter(libpry.AutoTree):
+    def setUp(self):
+        self.b = openbsd.pf.StateBuffer("".join([
+                    _stateRecord(id=1, lan=("10.0.0.1", 1025), ext=("192.168.0.9", 443)),
+                    _stateRecord(id=2, lan=("10.0.0.2", 1025), ext=("192.168.0.9", 443)),
+                    _stateRecord(id=3, lan=("10.0.0.1", 1026), ext=("192.168.0.9", 80),
+                                    proto=17, ifname="em1"),
+                    _stateRecord(id=4, lan=("10.0.0.1", 1025), ext=("192.168.0.9", 443),
+                                    direction=PFDIR_IN),
+                    _stateRecord(id=5, af=AF_INET6, lan=("fe80::1", 22), ext=("fe80::2", 4000)),
+                ]))
+
+    def _ids(self, *args):
+        return [i.id for i in openbsd.pf._StateFilter(*args).scan(self.b)]
+
+    def test_scan(self):
+        assert self._ids(None, None, "10.0.0.1", None, 0, 0) == [1, 3]
+        assert self._ids(None, None, "192.168.0.9", None, 0, 0) == [4]
+        assert self._ids(None, None, "10.0.0.1", "192.168.0.9", 1025, 443) == [1]
+        assert self._ids(None, None, None, None, 0, 443) == [1, 2]
+        assert self._ids(None, 17, None, None, 0, 0) == [3]
+        assert self._ids("em1", None, None, None, 0, 0) == [3]
+        assert self._ids(None, None, "fe80::1", "fe80::2", 22, 4000) == [5]
+        assert self._ids(None, None, "fe80::1", None, 23, 0) == []
+        assert len(self._ids(None, None, None, None, 0, 0)) == 5
+        f = openbsd.pf._StateFilter(None, None, "10.0.0.1", None, 0, 0)
+        assert [i.id for i in f.scan(self.b, 1)] == [1]
+
+class u_killFilters(libpry.AutoTree):
+    def test_killFilter(self):
+        f = openbsd.pf._killFilter
+        assert f({"src": "10.0.0.1"}) == (AF_INET, "", 0, 0, (0x0a000001, 32), (0, 0))
+        assert f({"dst": "10.1.2.3", "dstmask": "255.255.0.0", "dstport": 22}) == \
+                    (AF_INET, "", 0, 22, (0, 0), (0x0a010000, 16))
+        assert f(("fe80::/10", None, None, None, (0, 80), "em0"))[:4] == (AF_INET6, "em0", 0, 80)
+        assert f({"interface": "lo0"}) == (0, "lo0", 0, 0, (0, 0), (0, 0))
+        libpry.raises(ValueError, f, {"src": "10.0.0.1", "dst": "fe80::1"})
+        libpry.raises(ValueError, f, {"interface": "x"*16})
+
+    def test_pack(self):
+        f = openbsd.pf._killFilter(("10.0.0.0/8", None, None, None, (1, 2), "em0"))
+        x = openbsd.pf._packKillFilter(f)
+        assert len(x) == 85
+        assert x[:4] == "\x02em0"
+        assert x[17:21] == "\x0a\x00\x00\x00"
+        assert x[33:37] == "\xff\x00\x00\x00"
+        assert x[-4:] == "\x00\x01\x00\x02"
+
+    def test_coalesce(self):
+        filters = [openbsd.pf._killFilter(i) for i in [
+                    {"src": "10.1.2.3"},
+                    {"src": "10.1.0.0/16"},
+                    {"src": "10.1.2.3", "dst": "192.168.0.1", "interface": "em0"},
+                    {"src": "10.2.0.1"},
+                    {"src": "10.2.0.1"},
+                    {"dst": "10.1.2.3"},
+                    {"src": "fe80::1"},
+                    {"src": "10.3.0.1", "srcport": 22},
+                    {"interface": "em1"},
+                    {"interface": "em1", "src": "10.3.0.1"},
+                ]]
+        assert openbsd.pf._coalesceKills(filters) == [1, 3, 5, 6, 7, 8]
+
+    def test_partial(self):
+        class _Failing:
+            def _init(self):
+                pass
+            def kill_states_batch(self, data):
+                # The second record issued fails, after the first killed 3.
+                raise openbsd.pf.OException(16, "Device busy", 1, [3L])
+        pf = openbsd.pf._pf
+        openbsd.pf._pf = _Failing()
+        try:
+            p = openbsd.pf.PF()
+            try:
+                p.killStatesBatch([{"src": "10.1.2.3"}, {"src": "10.1.0.0/16"}, {"dst": "10.0.0.1"}])
+            except openbsd.pf.StateKillError, v:
+                assert v.index == 2
+                assert v.counts == [0, 3L, 0]
+                assert v.total == 3
+                assert v.errno == 16
+                assert isinstance(v, openbsd.pf.OException)
+                str(v)
+            else:
+                raise AssertionError, "StateKillError not raised"
+        finally:
+            openbsd.pf._pf = pf
+
+
 class u_makeTree(libpry.AutoTree):
     def test_flatTreeWalker(self):
         x = [i for i in openbsd.pf._flatTreeWalker(["a", "b"], ["c", "d"])]
@@ -233,6 +832,15 @@ class u_makeTree(libpry.AutoTree):
 
 
 tests = [
+    uStateRecord(),
+    uStateSnapshot(),
+    uStateDiffer(),
+    u_StateFilter(),
+    u_killFilters(),
+    u_TablesCache(),
+    u_lookupState(),
+    u_getStatesRaw(),
+    uStatsSampler(),
     u_makeTree()
 ]
 if os.geteuid() == 0:
@@ -0,0 +1,127 @@
+import tempfile, os, struct
+import libpry
+from openbsd.ring import *
+import openbsd.ring
+
+
+class uRing(libpry.AutoTree):
+    def setUp(self):
+        self.path = tempfile.mktemp()
+        self.w = RingWriter(self.path, ["a", "b/c"], slots=4)
+        self.r = RingReader(self.path)
+
+    def tearDown(self):
+        self.w.close()
+        self.r.close()
+        os.remove(self.path)
+
+    def test_read(self):
+        assert self.r.names == ("a", "b/c")
+        assert self.r.slots == 4
+        assert self.r.latest() is None
+        assert self.r.history() == []
+        self.w.write([1, 2], 10.0)
+        assert self.r.latest() == (10.0, (1, 2))
+        self.w.write([3, 2**64 - 1], 11.0)
+        assert self.r.head == 2
+        assert self.r.history() == [(10.0, (1, 2)), (11.0, (3, 2**64 - 1))]
+        assert self.r.history(1) == [(11.0, (3, 2**64 - 1))]
+        assert self.r.get("a") == [(10.0, 1), (11.0, 3)]
+        libpry.raises(ValueError, self.w.write, [1])
+
+    def test_wrap(self):
+        for i in range(10):
+            self.w.write([i, i*2], float(i))
+        assert self.r.latest() == (9.0, (9, 18))
+        assert [t for t, v in self.r.history()] == [6.0, 7.0, 8.0, 9.0]
+        assert self.r._read(2) is None
+
+    def test_torn(self):
+        self.w.write([1, 1], 1.0)
+        self.w.write([2, 2], 2.0)
+        # Simulate the writer stopping half way through sample 2.
+        self.r.RETRIES = 3
+        struct.pack_into("<Q", self.w._mm, self.w._offset(2), 5)
+        assert self.r._read(2) is None
+        assert self.r.latest() == (2.0, (2, 2))
+        # And half way through sample 4, overwriting sample 0.
+        struct.pack_into("<Q", self.w._mm, self.w._offset(4), 9)
+        assert [t for t, v in self.r.history()] == [2.0]
+
+    def test_rename(self):
+        self.w.write([1, 2], 1.0)
+        self.w.rename(["a", "b/c", "d"])
+        assert self.r.latest() is None
+        assert self.r.names == ("a", "b/c", "d")
+        self.w.write([1, 2, 3], 2.0)
+        assert self.r.latest() == (2.0, (1, 2, 3))
+        libpry.raises(ValueError, RingWriter, self.path, ["a\nb"])
+
+    def test_err(self):
+        f = open(self.path, "r+b")
+        f.write("XXXX")
+        f.close()
+        libpry.raises(ValueError, RingReader, self.path)
+
+    def test_restart(self):
+        self.w.write([1, 2], 1.0)
+        self.w.close()
+        self.w = RingWriter(self.path, ["a", "b/c"], slots=4)
+        self.w.write([42, 43], 2.0)
+        assert self.r.latest() == (2.0, (42, 43))
+        assert self.r.head == 1
+        assert not [i for i in os.listdir(os.path.dirname(self.path)) if i.startswith(os.path.basename(self.path) + ".")]
+
+    def test_fork(self):
+        path = self.path + ".child"
+        w = RingWriter(path, ["x", "y"], slots=16)
+        r = RingReader(path)
+        pid = os.fork()
+        if not pid:
+            for i in range(1, 20001):
+                w.write([i, i], float(i))
+            os._exit(0)
+        w.close()
+        try:
+            # Read while the child writes: every sample must be whole.
+            reads = 0
+            while not os.waitpid(pid, os.WNOHANG)[0]:
+                for t, v in r.history():
+                    assert v == (t, t)
+                    reads += 1
+            assert r.latest() == (20000.0, (20000, 20000))
+            assert len(r.history()) == 16
+        finally:
+            r.close()
+            os.remove(path)
+
+
+class uCollector(libpry.AutoTree):
+    def setUp(self):
+        self.path = tempfile.mktemp()
+        self.ifaces = {"em0": {"ipackets": 1, "name": "em0"}}
+        self.c = Collector(self.path, {
+                    "ip": lambda: {"total": 10, "rate": -1},
+                    "interfaces": lambda: self.ifaces,
+                }, interval=0)
+
+    def tearDown(self):
+        self.c.close()
+        os.remove(self.path)
+
+    def test_sample(self):
+        self.c.run(2)
+        r = RingReader(self.path)
+        assert r.names == ("interfaces/em0/ipackets", "ip/total")
+        assert r.head == 2
+        self.ifaces["em1"] = {"ipackets": 5}
+        self.c.sample()
+        assert r.latest()[1] == (1, 5, 10)
+        assert r.names == ("interfaces/em0/ipackets", "interfaces/em1/ipackets", "ip/total")
+        r.close()
+
+
+tests = [
+    uRing(),
+    uCollector()
+]
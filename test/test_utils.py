@@ -19,6 +19,42 @@ class uUtility(libpry.AutoTree):
         tstr = "".join([chr(i) for i in range(9)])
         assert cksum16(tstr) == 60399
 
+    def test_checksumTypes(self):
+        import array
+        tstr = "".join([chr(i) for i in range(9)])
+        assert cksum16(bytearray(tstr)) == 60399
+        assert cksum16(array.array("B", range(9))) == 60399
+        assert cksum16(buffer("xx" + tstr, 2)) == 60399
+
+    def test_checksumEdges(self):
+        assert cksum16("") == 0xffff
+        assert cksum16("\x00\x00") == 0xffff
+        assert cksum16("\xff\xff") == 0
+        assert cksum16("\x01") == 0xfeff
+
+    def test_cksumAdd(self):
+        data = "".join([chr(i) for i in range(101)])
+        assert ~cksumAdd(data[40:], cksumAdd(data[:40])) & 0xffff == cksum16(data)
+
+    def test_cksumTransport(self):
+        seg = "\x04\xd2\x00\x35\x00\x0b\x00\x00abc"
+        pseudo = IPAddress("10.0.0.1").bytes + IPAddress("10.0.0.2").bytes + "\x00\x11\x00\x0b"
+        assert cksumTransport("10.0.0.1", "10.0.0.2", 17, seg) == cksum16(pseudo + seg)
+        pseudo = IP6Address("fe80::1").bytes + IP6Address("fe80::2").bytes + \
+                    "\x00\x00\x00\x0b\x00\x00\x00\x11"
+        assert cksumTransport("fe80::1", "fe80::2", 17, seg) == cksum16(pseudo + seg)
+        libpry.raises(ValueError, cksumPseudoHeader, "10.0.0.1", "fe80::2", 17, 0)
+
+    def test_cksumUpdate(self):
+        data = "".join([chr((i*7)%256) for i in range(40)])
+        new = data[:12] + "\xc0\xa8\x00\x01" + data[16:]
+        c = cksumUpdate(cksum16(data), data[12:16], "\xc0\xa8\x00\x01")
+        assert c == cksum16(new)
+        new = data[:2] + "\xff\xff" + data[4:]
+        c = cksumUpdate(cksum16(data), multiord(data[2:4]), 0xffff)
+        assert c == cksum16(new)
+        libpry.raises(ValueError, cksumUpdate, 0, "a", "b")
+
     def test_findLongestSubsequence(self):
         fls = findLongestSubsequence
         assert fls("ffaaaff", "a") == (2, 4)
@@ -26,6 +62,8 @@ class uUtility(libpry.AutoTree):
         assert fls("ffaaaffaaa", "a") == (2, 4)
         assert fls("aaaffaaa", "a") == (0, 2)
         assert fls("aaa", "a") == (0, 2)
+        assert fls("ffaa", "a") == (2, 3)
+        assert fls("fffa", "a") == (0, 0)
 
     def test_isStringLike(self):
         assert isStringLike("sdf")
@@ -51,6 +89,151 @@ class uDoubleAssociation(libpry.AutoTree):
         assert d[1] == "one"
 
 
+class uLRUCache(libpry.AutoTree):
+    def test_getput(self):
+        c = LRUCache(2)
+        assert c.get("a") is None
+        c.put("a", 1)
+        assert c.get("a") == 1
+        assert c.stats() == {"hits": 1, "misses": 1, "entries": 1, "size": 2}
+
+    def test_evict(self):
+        c = LRUCache(2)
+        c.put("a", 1)
+        c.put("b", 2)
+        c.get("a")
+        c.put("c", 3)
+        assert "a" in c
+        assert not "b" in c
+        assert len(c) == 2
+
+    def test_pop(self):
+        c = LRUCache(2)
+        c.put("a", 1)
+        c.put("b", 2)
+        assert c.pop("a") == 1
+        assert c.pop("a", 3) == 3
+        c.put("c", 3)
+        c.put("d", 4)
+        assert len(c) == 2
+        assert not "b" in c
+
+    def test_resize(self):
+        c = LRUCache(3)
+        for i in range(3):
+            c.put(i, i)
+        c.resize(1)
+        assert len(c) == 1
+        assert 2 in c
+        c.resize(0)
+        c.put("a", 1)
+        assert not len(c)
+
+    def test_clear(self):
+        c = LRUCache(3)
+        c.put("a", 1)
+        c.get("a")
+        c.clear()
+        assert not len(c)
+        assert c.hits == 0
+        c.put("b", 1)
+        assert c.get("b") == 1
+
+
+class uIntern(libpry.AutoTree):
+    def setUp(self):
+        clearInternCache()
+
+    def tearDown(self):
+        setInternCacheSize(INTERN_CACHE_SIZE)
+
+    def test_text(self):
+        a = Address("10.0.0.1")
+        assert Address("10.0.0.1") is a
+        stats = internCacheStats()["text"]
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+    def test_bytes(self):
+        a = AddressFromBytes("\x0a\x00\x00\x01")
+        assert AddressFromBytes("\x0a\x00\x00\x01") is a
+        assert internCacheStats()["bytes"]["hits"] == 1
+
+    def test_disabled(self):
+        setInternCacheSize(0)
+        assert not Address("10.0.0.1") is Address("10.0.0.1")
+
+    def test_detection(self):
+        assert isinstance(Address("10.0.0.1"), IPAddress)
+        assert isinstance(Address("::1"), IP6Address)
+        assert isinstance(Address("1:2:3:4:5:6:7:8"), IP6Address)
+        assert isinstance(Address("1::3:4:5:6"), IP6Address)
+        assert isinstance(Address("0:1:2:3:4:5"), EthernetAddress)
+        assert isinstance(Address("0:1:2:3:4:5:"), EthernetAddress)
+        libpry.raises(ValueError, Address, "10.0.0")
+        libpry.raises(ValueError, Address, "0:1:2:3:4")
+        libpry.raises(ValueError, Address, "twenty")
+
+
+class uPackedAddresses(libpry.AutoTree):
+    def test_parse(self):
+        p = parseAddresses([
+                "# A comment\n",
+                "10.0.0.1\n",
+                "\n",
+                "192.168.0.0/16  10.0.0.0/8 # trailing comment\n",
+                "!172.16.0.0/12\n",
+                "fe80::/10\n",
+            ])
+        assert len(p) == 5
+        assert not p.errors
+        assert len(p.tostring()) == 5 * PackedAddresses.SIZE
+        assert p[0] == (IPAddress("10.0.0.1"), 32, 0, 0)
+        assert p[1] == (IPAddress("192.168.0.0"), 16, 0, 0)
+        assert p[3] == (IPAddress("172.16.0.0"), 12, 1, 0)
+        assert p[-1] == (IP6Address("fe80::"), 10, 0, 0)
+        libpry.raises(IndexError, p.__getitem__, 5)
+
+    def test_layout(self):
+        p = parseAddresses(["10.0.0.1/24"])
+        assert p.tostring() == "\x0a\x00\x00\x00" + "\x00"*12 + chr(AF_INET) + "\x18\x00\x00"
+
+    def test_hostbits(self):
+        p = parseAddresses(["10.1.2.3/8", "fe80::1/64"])
+        assert p[0][0] == "10.0.0.0"
+        assert p[1][0] == "fe80::"
+
+    def test_errors(self):
+        p = parseAddresses([
+                "10.0.0.1\n",
+                "10.0.0.256\n",
+                "10.0.0.0/33 foo\n",
+                "10.0.0.0/x\n",
+                "fe80::/10\n",
+            ])
+        assert len(p) == 2
+        assert [i[0] for i in p.errors] == [2, 3, 3, 4]
+        assert p.errors[1][1] == "10.0.0.0/33"
+
+    def test_file(self):
+        import StringIO
+        p = parseAddresses(StringIO.StringIO("10.0.0.1\n::1\n"))
+        assert len(p) == 2
+        assert list(p)[1][0] == "::1"
+
+    def test_append(self):
+        p = PackedAddresses()
+        p.append("10.0.0.1")
+        assert len(p) == 1
+        libpry.raises(ValueError, p.append, "foo")
+
+    def test_fromString(self):
+        p = parseAddresses(["10.0.0.1", "::1"])
+        q = PackedAddresses.fromString(p.tostring())
+        assert list(q) == list(p)
+        libpry.raises(ValueError, PackedAddresses.fromString, "foo")
+
+
 class uAddrBase(libpry.AutoTree):
     def test_eq(self):
         a = IPAddress("1.2.4.8")
@@ -63,6 +246,67 @@ class uAddrBase(libpry.AutoTree):
         a = IPAddress("1.2.4.8")
         libpry.raises(ValueError, cmp, a, "twenty")
 
+    def test_ne(self):
+        assert IPAddress("1.2.4.8") != "1.2.4.9"
+        assert not IPAddress("1.2.4.8") != "1.2.4.8"
+        assert IPAddress("0.0.0.0") != IP6Address("::")
+
+    def test_nonaddress(self):
+        a = IPAddress("1.2.4.8")
+        assert not a == None
+        assert a != None
+        assert not a == 5
+
+    def test_hash(self):
+        a = IPAddress("1.2.4.8")
+        b = IPAddress.fromBytes("\x01\x02\x04\x08")
+        assert hash(a) == hash(b)
+        assert len(set([a, b, IPAddress("1.2.4.9")])) == 2
+        d = {a: 1}
+        assert d[b] == 1
+        assert not IP6Address("::1") in set([IPAddress("0.0.0.1")])
+
+    def test_ordering(self):
+        a, b = IPAddress("1.2.4.8"), IPAddress("1.2.4.9")
+        assert a < b
+        assert a <= b
+        assert b > a
+        assert b >= a
+        assert a < "1.2.4.9"
+        assert IPAddress("255.255.255.255") < IP6Address("::")
+        lst = [IP6Address("::1"), b, a, IP6Address("::")]
+        lst.sort()
+        assert lst == [a, b, "::", "::1"]
+
+    def test_fromInt(self):
+        assert IPAddress.fromInt(0x01020408) == "1.2.4.8"
+        assert IP6Address.fromInt(1) == "::1"
+        assert EthernetAddress.fromInt(0xff) == "00:00:00:00:00:ff"
+        libpry.raises(ValueError, IPAddress.fromInt, 1 << 32)
+        libpry.raises(ValueError, IPAddress.fromInt, -1)
+
+    def test_int(self):
+        assert int(IPAddress("1.2.4.8")) == 0x01020408
+        assert long(IP6Address("::1")) == 1
+
+    def test_slots(self):
+        a = IPAddress("1.2.4.8")
+        assert not hasattr(a, "__dict__")
+        assert not hasattr(IP6Mask(64), "__dict__")
+        assert not hasattr(EthernetAddress("00:00:00:00:00:ff"), "__dict__")
+
+    def test_copy(self):
+        a = IPAddress("1.2.4.8")
+        assert IPAddress(a) == a
+        assert IPMask(IPMask(8)).prefix == 8
+
+    def test_pickle(self):
+        import pickle
+        for proto in range(3):
+            assert pickle.loads(pickle.dumps(IPAddress("1.2.4.8"), proto)) == "1.2.4.8"
+            m = pickle.loads(pickle.dumps(IP6Mask(12), proto))
+            assert m.prefix == 12
+
 
 class uIPAddress(libpry.AutoTree):
     def test_create(self):
@@ -123,6 +367,31 @@ class uIPMask(libpry.AutoTree):
         libpry.raises(ValueError, IPMask, -1)
         libpry.raises(ValueError, IPMask, 33)
         
+    def test_fromBytes(self):
+        m = IPMask.fromBytes("\xff\xf0\x00\x00")
+        assert isinstance(m, IPMask)
+        assert m.prefix == 12
+        assert m.address == "255.240.0.0"
+        libpry.raises(ValueError, IPMask.fromBytes, "\xff\x0f\x00\x00")
+
+    def test_shared(self):
+        m = IPMask(24)
+        assert IPMask("255.255.255.0") is m
+        assert IPMask("255.255.255.000") is m
+        assert IPMask.fromBytes("\xff\xff\xff\x00") is m
+        assert IPMask(IPAddress("255.255.255.0")) is m
+        assert IPAddress("10.0.0.1").mask(24) is m
+        assert IPMask() is IPMask(32)
+        assert IP6Mask(64) is IP6Mask("ffff:ffff:ffff:ffff::")
+        libpry.raises(ValueError, IPMask, IP6Mask(8))
+
+    def test_immutable(self):
+        import copy, pickle
+        m = IPMask(24)
+        libpry.raises(AttributeError, setattr, m, "prefix", 8)
+        assert copy.copy(m) is m
+        assert pickle.loads(pickle.dumps(m)) is m
+
     def test_prefix(self):
         assert IPMask("255.255.0.0").prefix == 16
         assert IPMask("0.0.0.0").prefix == 0
@@ -170,6 +439,35 @@ class uIP6Address(libpry.AutoTree):
     def test_ip6ToStrErr(self):
         libpry.raises(ValueError, IP6Address.fromBytes, "\xff\xff\xff\x00\x01")
 
+    def test_canonical(self):
+        fi = IP6Address.fromInt
+        assert fi(0).address == "::"
+        assert fi(1).address == "::1"
+        assert fi(1L << 112).address == "1::"
+        assert fi(0xfe800000000000000000000000000001L).address == "fe80::1"
+        # A single zero group is not compressed.
+        assert fi(0x00010000000200030004000500060007L).address == "1:0:2:3:4:5:6:7"
+        # The leftmost of two equally long runs is compressed.
+        assert fi(0x00010000000000020000000000030004L).address == "1::2:0:0:3:4"
+        assert fi(0x00010000000200000000000000030004L).address == "1:0:2::3:4"
+        assert fi(0x0000000000000000000000000000ABCDL).address == "::abcd"
+        assert fi(0xffff0a000001L).address == "::ffff:10.0.0.1"
+
+    def test_embedded(self):
+        assert IP6Address("::ffff:10.0.0.1").bytes == "\x00"*10 + "\xff"*2 + "\x0a\x00\x00\x01"
+        assert IP6Address("64:ff9b::1.2.3.4") == "64:ff9b::102:304"
+        assert IP6Address("1:2:3:4:5:6:1.2.3.4") == "1:2:3:4:5:6:102:304"
+        libpry.raises(ValueError, IP6Address, "::1.2.3")
+        libpry.raises(ValueError, IP6Address, "1:2:3:4:5:6:7:1.2.3.4")
+
+    def test_forms(self):
+        assert IP6Address("FE80::0001") == "fe80::1"
+        assert IP6Address("1:2:3:4:5:6:7::") == "1:2:3:4:5:6:7:0"
+        assert IP6Address("::2:3:4:5:6:7:8") == "0:2:3:4:5:6:7:8"
+        for i in ["", ":", ":::", "1:::2", ":1::2", "1::2:", "12345::",
+                  "1:2:3:4:5:6:7", "1:2:3:4::5:6:7:8", "+1::"]:
+            libpry.raises(ValueError, IP6Address, i)
+
     def test_Roundtrips(self):
         addrs = [
             "0:9:6b:e0:ca:ce:0:1",
@@ -240,6 +538,9 @@ class uEthernetAddress(libpry.AutoTree):
 tests = [
     uUtility(),
     uDoubleAssociation(),
+    uLRUCache(),
+    uIntern(),
+    uPackedAddresses(),
     uAddrBase(),
     uIPAddress(),
     uIPMask(),